@@ -1,11 +1,11 @@
-from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify, send_file
+from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify, send_file, Response
 import os
+import time
 import tempfile
 import shutil
 import socket
 import json     
 import pandas as pd
-import requests
 import sys
 
 # เพิ่ม path สำหรับ src และ src/functions เพื่อให้ importlib หา module เจอ
@@ -16,9 +16,17 @@ if SRC_PATH not in sys.path:
 if FUNCTIONS_PATH not in sys.path:
     sys.path.append(FUNCTIONS_PATH)
 
+from services.jobs import JobManager, FINISHED_STATES, JOB_FAILED
+from services.reference_data import reload_references, reference_status
+from services.last_type_index import get_last_type_index
+from services.result_view import get_result_view, query_result, distinct_values, DEFAULT_PAGE_SIZE
+from services.exports import materialize, EXPORT_FORMATS
+from services.date_metadata import get_date_stats, combine_date_stats
+from services.api_client import get_api_client, API_BASE_URL
+
 app = Flask(__name__)
 app.secret_key = "your_secret_key"
-app.api_base_url = "http://th3sroeeeng4/RTMSAPI/ApiAutoUph/api"
+app.api_base_url = API_BASE_URL
 
 # Mapping operation -> function list
 OPERATION_FUNCTIONS = {
@@ -28,6 +36,15 @@ OPERATION_FUNCTIONS = {
     "Wire Bond": ["WB_AUTO_UPH"],
 }
 
+# Job manager สำหรับรันฟังก์ชันเบื้องหลัง (สร้างเมื่อใช้งานครั้งแรก เพื่อไม่ให้ worker process สร้างซ้ำ)
+_job_manager = None
+
+def get_job_manager():
+    global _job_manager
+    if _job_manager is None:
+        _job_manager = JobManager(os.path.join(os.getcwd(), "temp", "jobs"))
+    return _job_manager
+
 @app.route("/", methods=["GET"])
 def operation():
     return render_template("operation.html")
@@ -98,7 +115,7 @@ def method():
             if api_operation: params["operation"] = api_operation
             if bom_no: params["bom_no"] = bom_no
             try:
-                response = requests.get(api_url, params=params)
+                response = get_api_client().get(api_url, params=params)
                 if response.status_code == 200:
                     content_type = response.headers.get('Content-Type', '')
                     if 'application/json' in content_type and response.text.strip():
@@ -167,10 +184,10 @@ def function():
         if not start_date or not end_date:
             start_date = None
             end_date = None
+        # PNP_CHANGE_TYPE: ไม่ใช้สถานะสะสมเดิม คำนวณใหม่จากไฟล์ที่เลือกทั้งหมด
+        full_refresh = request.form.get("full_refresh") == "1"
         input_method = session.get("input_method")
         operation = session.get("operation")
-        result = None
-        current_file = None
 
         # เตรียม path ไฟล์ที่ต้องประมวลผล
         file_path = None
@@ -183,36 +200,11 @@ def function():
         else:
             file_path = None
 
-        # ประมวลผลฟังก์ชัน
-        try:
-            import importlib
-            import pandas as pd
-            func_module = importlib.import_module(f"functions.{func_name.lower()}")
-            func = getattr(func_module, func_name)
-            temp_root = os.path.join(os.getcwd(), "temp")
-            if func_name in ["DA_AUTO_UPH", "PNP_AUTO_UPH", "WB_AUTO_UPH"]:
-                result = func(file_path, temp_root, start_date, end_date)
-            else:
-                result = func(file_path, temp_root)
-        except Exception as e:
-            result = f"เกิดข้อผิดพลาดในการเรียกใช้ฟังก์ชัน {func_name}: {e}"
-
-        # --- สร้างไฟล์ผลลัพธ์สำหรับดาวน์โหลด ---
-        export_file_path = None
+        # ส่งงานเข้าคิวประมวลผลเบื้องหลัง (ไม่รันใน request thread)
         temp_root = os.path.join(os.getcwd(), "temp")
-        print("DEBUG result:", result)
-        if isinstance(result, pd.DataFrame):
-            export_file_path = os.path.join(temp_root, f"result_{operation}_{func_name}.xlsx")
-            result.to_excel(export_file_path, index=False)
-        elif isinstance(result, list):
-            # ถ้าเป็น list ของ path ให้ใช้ตัวแรกที่เป็นไฟล์จริง
-            for r in result:
-                if isinstance(r, str) and os.path.exists(r):
-                    export_file_path = r
-                    break
-        elif isinstance(result, str) and os.path.exists(result):
-            export_file_path = result
-        session["export_file_path"] = export_file_path
+        job_id = get_job_manager().submit(func_name, file_path, temp_root, start_date, end_date, operation, full_refresh)
+        session["job_id"] = job_id
+        session["export_file_path"] = None
 
         # ไม่ต้องเก็บ result_data ใน session อีกต่อไป
         session["current_file"] = file_path
@@ -220,81 +212,247 @@ def function():
         session["func_name"] = func_name
         session["start_date"] = start_date      # <--- เพิ่ม
         session["end_date"] = end_date          # <--- เพิ่ม
-        return redirect(url_for("result"))
+        return redirect(url_for("result", job_id=job_id))
 
     # GET: render หน้าเลือกฟังก์ชัน (เพิ่ม preview date range)
     input_method = session.get("input_method")
     current_file = None
     file_path = None
+    preview_files = []
     if input_method == "upload":
         file_path = session.get("uploaded_file_path")
         if file_path:
             if isinstance(file_path, list):
                 current_file = [os.path.basename(f) for f in file_path]
-                file_path_preview = file_path[0]
+                preview_files = file_path
             else:
                 current_file = os.path.basename(file_path)
-                file_path_preview = file_path
+                preview_files = [file_path]
     elif input_method == "folder":
         folder = session.get("selected_folder")
         if folder:
             if isinstance(folder, list):
                 current_file = [os.path.basename(f) for f in folder]
-                file_path_preview = folder[0]
+                preview_files = folder
             else:
                 current_file = folder
-                file_path_preview = folder
+                preview_files = [folder]
     elif input_method == "api":
         json_path = session.get("api_json_path")
         if json_path:
             current_file = os.path.basename(json_path)
-            file_path_preview = json_path
-    else:
-        file_path_preview = None
+            preview_files = [json_path]
 
-    # Preview date range
-    date_info = None
-    if file_path_preview and os.path.exists(file_path_preview):
+    # Preview date range ของทุกไฟล์ที่เลือก (สถิติวันที่ถูกเก็บใน sidecar index จึงไม่อ่านไฟล์ซ้ำ)
+    date_files = []
+    for preview_path in preview_files:
+        if not os.path.isfile(preview_path):
+            continue
         try:
-            from functions.da_auto_uph import preview_date_range
-            date_info = preview_date_range(file_path_preview)
+            stats = get_date_stats(preview_path)
         except Exception as e:
-            date_info = None
+            print(f"⚠️ ตรวจสอบช่วงวันที่ไม่สำเร็จ ({os.path.basename(preview_path)}): {e}")
+            stats = None
+        if stats:
+            date_files.append(dict(stats, file_name=os.path.basename(preview_path)))
+    date_info = combine_date_stats(date_files)
 
     operation = session.get("operation")
     functions = OPERATION_FUNCTIONS.get(operation, [])
-    return render_template("function.html", functions=functions, current_file=current_file, operation=operation, date_info=date_info)
+    return render_template("function.html", functions=functions, current_file=current_file, operation=operation, date_info=date_info, date_files=date_files)
 
 @app.route("/result", methods=["GET"])
 def result():
-    import pandas as pd
-    export_file_path = session.get("export_file_path")
+    job_id = request.args.get("job_id") or session.get("job_id")
     current_file = session.get("current_file")
     operation = session.get("operation")
     func_name = session.get("func_name")
     table_html = None
     result_data = None
     error_message = None
-    if not export_file_path:
-        error_message = "export_file_path ไม่ถูกสร้าง กรุณาตรวจสอบการประมวลผลหรือฟังก์ชันที่เลือก"
-    elif not os.path.exists(export_file_path):
-        error_message = f"ไม่พบไฟล์ผลลัพธ์: {export_file_path} กรุณาตรวจสอบว่าไฟล์ถูกสร้างจริงหลังประมวลผล"
+    job = None
+    if job_id:
+        # ?wait=<วินาที> รอให้งานเสร็จก่อนแสดงผล (ถ้าไม่ระบุจะแสดงสถานะปัจจุบันทันที)
+        wait = request.args.get("wait", type=float)
+        job = get_job_manager().wait(job_id, timeout=wait) if wait else get_job_manager().get(job_id)
+        if job is None:
+            error_message = f"ไม่พบงานประมวลผล: {job_id}"
+        elif job["state"] not in FINISHED_STATES:
+            # งานยังไม่เสร็จ: แสดงหน้ารอและให้หน้าเว็บ poll สถานะ
+            return render_template("result.html", job=job, result=None, current_file=current_file, operation=operation, func_name=func_name, table_html=None, start_date=session.get("start_date"), end_date=session.get("end_date"))
+        else:
+            session["job_id"] = job_id
+            session["export_file_path"] = job.get("export_file_path")
+            func_name = job.get("func_name") or func_name
+            if job["state"] == JOB_FAILED:
+                error_message = job.get("error") or "การประมวลผลล้มเหลว"
+    export_file_path = session.get("export_file_path")
+    if error_message is None:
+        if not export_file_path:
+            error_message = "export_file_path ไม่ถูกสร้าง กรุณาตรวจสอบการประมวลผลหรือฟังก์ชันที่เลือก"
+        elif not os.path.exists(export_file_path):
+            error_message = f"ไม่พบไฟล์ผลลัพธ์: {export_file_path} กรุณาตรวจสอบว่าไฟล์ถูกสร้างจริงหลังประมวลผล"
     if error_message:
         table_html = f"<pre>{error_message}</pre>"
+    elif export_file_path.endswith((".xlsx", ".csv")):
+        # ไม่อ่านไฟล์ตอนแสดงหน้า ตารางจะดึงข้อมูลทีละหน้าจาก /result/data
+        result_data = {"job_id": job_id or "", "file_name": os.path.basename(export_file_path)}
+    return render_template("result.html", job=job, result=result_data, current_file=current_file, operation=operation, func_name=func_name, table_html=table_html, start_date=session.get("start_date"), end_date=session.get("end_date"))
+
+def _result_file_path(job_id):
+    """
+    คืน (path ไฟล์ผลลัพธ์, path ข้อมูลผลลัพธ์ที่งานบันทึกไว้) ของ job_id หรือของ session ปัจจุบัน
+    path ไฟล์เป็น None ถ้าไม่มีไฟล์
+    """
+    job_id = job_id or session.get("job_id")
+    job = get_job_manager().get(job_id) if job_id else None
+    if job:
+        path, data_path = job.get("export_file_path"), job.get("result_data_path")
     else:
-        try:
-            if export_file_path.endswith(".xlsx"):
-                df = pd.read_excel(export_file_path)
-            elif export_file_path.endswith(".csv"):
-                df = pd.read_csv(export_file_path)
-            else:
-                df = None
-            if df is not None:
-                table_html = df.to_html(classes="table", border=0, index=False)
-                result_data = df.to_dict(orient="records")
-        except Exception as e:
-            table_html = f"<pre>เกิดข้อผิดพลาดในการอ่านไฟล์ผลลัพธ์: {e}</pre>"
-    return render_template("result.html", result=result_data, current_file=current_file, operation=operation, func_name=func_name, table_html=table_html, start_date=session.get("start_date"), end_date=session.get("end_date"))
+        path, data_path = session.get("export_file_path"), None
+    return (path if path and os.path.exists(path) else None), data_path
+
+@app.route("/result/data", methods=["GET"])
+def result_data():
+    """
+    ข้อมูลผลลัพธ์ทีละหน้า: ?job_id=&offset=0&limit=100&sort=<คอลัมน์>&order=asc|desc&q=<ข้อความ>
+    filter ตามค่าในคอลัมน์: ?filter_<คอลัมน์>=<ค่า> เช่น filter_bom_no=ABC
+    """
+    path, data_path = _result_file_path(request.args.get("job_id"))
+    if not path:
+        return jsonify({"error": "ไม่พบไฟล์ผลลัพธ์"}), 404
+    filters = {key[len("filter_"):]: value for key, value in request.args.items() if key.startswith("filter_") and value != ""}
+    try:
+        view = get_result_view(path, data_path)
+        page = query_result(
+            view,
+            offset=request.args.get("offset", 0, type=int),
+            limit=request.args.get("limit", DEFAULT_PAGE_SIZE, type=int),
+            sort=request.args.get("sort") or None,
+            ascending=request.args.get("order", "asc") != "desc",
+            filters=filters,
+            search=request.args.get("q", "").strip() or None,
+        )
+    except KeyError as e:
+        return jsonify({"error": f"ไม่พบคอลัมน์: {e.args[0]}"}), 400
+    except Exception as e:
+        return jsonify({"error": f"เกิดข้อผิดพลาดในการอ่านไฟล์ผลลัพธ์: {e}"}), 500
+    page["rows"] = json.loads(page["rows"].to_json(orient="values", date_format="iso", force_ascii=False))
+    return jsonify(page)
+
+@app.route("/result/values", methods=["GET"])
+def result_values():
+    """ค่าที่ไม่ซ้ำของคอลัมน์ในผลลัพธ์ สำหรับตัวเลือก filter: ?job_id=&column=bom_no"""
+    path, data_path = _result_file_path(request.args.get("job_id"))
+    if not path:
+        return jsonify({"error": "ไม่พบไฟล์ผลลัพธ์"}), 404
+    column = request.args.get("column", "")
+    try:
+        values = distinct_values(get_result_view(path, data_path), column)
+    except KeyError:
+        return jsonify({"column": column, "values": []})
+    except Exception as e:
+        return jsonify({"error": f"เกิดข้อผิดพลาดในการอ่านไฟล์ผลลัพธ์: {e}"}), 500
+    return jsonify({"column": column, "values": values})
+
+@app.route("/jobs/<job_id>", methods=["GET"])
+def job_status(job_id):
+    """สถานะงานแบบ JSON (รองรับ ?wait=<วินาที> เพื่อรอจนงานเสร็จ)"""
+    wait = request.args.get("wait", type=float)
+    job = get_job_manager().wait(job_id, timeout=wait) if wait else get_job_manager().get(job_id)
+    if job is None:
+        return jsonify({"error": f"ไม่พบงาน {job_id}"}), 404
+    job.pop("traceback", None)
+    return jsonify(job)
+
+@app.route("/jobs/<job_id>/events", methods=["GET"])
+def job_events(job_id):
+    """ส่ง progress event ของงานแบบ Server-Sent Events จนงานเสร็จ"""
+    manager = get_job_manager()
+    if manager.get(job_id) is None:
+        return jsonify({"error": f"ไม่พบงาน {job_id}"}), 404
+    offset = request.headers.get("Last-Event-ID", type=int)
+    offset = 0 if offset is None else offset + 1
+
+    def stream(offset):
+        last_sent = time.time()
+        while True:
+            job = manager.get(job_id)
+            for index, event in manager.events(job_id, offset):
+                yield f"id: {index}\nevent: progress\ndata: {json.dumps(event, ensure_ascii=False)}\n\n"
+                offset = index + 1
+                last_sent = time.time()
+            if job is None or job.get("state") in FINISHED_STATES:
+                end = {"state": job.get("state") if job else None, "error": job.get("error") if job else None}
+                yield f"event: end\ndata: {json.dumps(end, ensure_ascii=False)}\n\n"
+                return
+            if time.time() - last_sent > 15:
+                # keep-alive comment กัน proxy ตัดการเชื่อมต่อ
+                yield ": keep-alive\n\n"
+                last_sent = time.time()
+            time.sleep(0.5)
+
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    return Response(stream(offset), mimetype="text/event-stream", headers=headers)
+
+@app.route("/reference", methods=["GET"])
+def reference_data_status():
+    """ข้อมูลอ้างอิง (Wire Data, package) ที่โหลดไว้ใน memory ของ web process"""
+    return jsonify(reference_status())
+
+@app.route("/reference/reload", methods=["POST"])
+def reference_data_reload():
+    """สั่งโหลดข้อมูลอ้างอิงใหม่ทุก process (ระบุ ?name=wire_data หรือ package เพื่อล้างเฉพาะชุดนั้น)"""
+    cleared = reload_references(request.args.get("name"))
+    return jsonify({"reloaded": True, "cleared": cleared})
+
+@app.route("/api/cache", methods=["GET"])
+def api_cache_status():
+    """response ของ RTMS API ที่เก็บไว้ใน memory ของ web process"""
+    return jsonify(get_api_client().cache_status())
+
+@app.route("/api/cache/clear", methods=["POST"])
+def api_cache_clear():
+    """ล้าง response ของ RTMS API ที่เก็บไว้ (ดึงข้อมูลใหม่จาก API ในครั้งถัดไป)"""
+    return jsonify({"cleared": get_api_client().clear_cache()})
+
+@app.route("/api/last_type", methods=["GET", "POST"])
+def last_type_lookup():
+    """
+    ค้นหา Last_type ของ BOM เป็นชุดจาก Last_Type.xlsx ที่ PNP_CHANGE_TYPE สร้างล่าสุด
+    - POST {"bom_no": [...]} หรือ {"items": [{"bom_no", "package_code", "product_no"}, ...]}
+    - GET ?bom_no=A,B,C
+    """
+    started = time.perf_counter()
+    if request.method == "POST":
+        payload = request.get_json(silent=True) or {}
+        if payload.get("items"):
+            df_keys = pd.DataFrame(payload["items"])
+        else:
+            bom_list = payload.get("bom_no") or []
+            df_keys = pd.DataFrame({"bom_no": bom_list if isinstance(bom_list, list) else [bom_list]})
+    else:
+        bom_list = [b.strip() for b in request.args.get("bom_no", "").split(",") if b.strip()]
+        df_keys = pd.DataFrame({"bom_no": bom_list})
+    if df_keys.empty or "bom_no" not in df_keys.columns:
+        return jsonify({"error": "กรุณาระบุ bom_no"}), 400
+
+    try:
+        index = get_last_type_index()
+    except Exception as e:
+        print(f"❌ โหลด Last_Type ไม่สำเร็จ: {e}")
+        return jsonify({"error": f"โหลดข้อมูล Last_Type ไม่สำเร็จ กรุณาลองใหม่อีกครั้ง: {e}"}), 503
+    if index is None:
+        return jsonify({"error": "ยังไม่มีข้อมูล Last_Type กรุณารัน PNP_CHANGE_TYPE ก่อน"}), 404
+
+    result = index.lookup(df_keys)
+    return jsonify({
+        "key": list(index.key_for(df_keys.columns)),
+        "requested": len(df_keys),
+        "found": int(result["Last_type"].notna().sum()),
+        "results": json.loads(result.to_json(orient="records", force_ascii=False)),
+        "elapsed_ms": round((time.perf_counter() - started) * 1000, 2),
+    })
 
 @app.route("/api/", methods=["GET"])
 def get_api_data():
@@ -315,7 +473,7 @@ def get_api_data():
     if bom_no: params["bom_no"] = bom_no
 
     try:
-        response = requests.get(url, params=params)
+        response = get_api_client().get(url, params=params)
         response.raise_for_status()
         content_type = response.headers.get('Content-Type', '')
         if 'application/json' in content_type and response.text.strip():
@@ -346,12 +504,43 @@ def get_api_data():
 
 @app.route("/download_result")
 def download_result():
-    # สมมติไฟล์ผลลัพธ์ถูกสร้างไว้ใน session["export_file_path"]
-    export_file_path = session.get("export_file_path")
-    if not export_file_path or not os.path.exists(export_file_path):
-        flash("ไม่พบไฟล์สำหรับดาวน์โหลด", "error")
+    """
+    ดาวน์โหลดผลลัพธ์ ไม่ระบุพารามิเตอร์ = ไฟล์ผลลัพธ์ของ session ปัจจุบัน
+    - format=xlsx|csv|parquet แปลงผลลัพธ์เป็นรูปแบบที่ต้องการ (สร้างเมื่อขอครั้งแรก)
+    - artifact=<ชื่อ> ไฟล์เพิ่มเติมของงาน เช่น cleaned_data ของ DA_AUTO_UPH
+    """
+    fmt = request.args.get("format")
+    artifact = request.args.get("artifact")
+    job_id = request.args.get("job_id") or session.get("job_id")
+    if not fmt and not artifact:
+        export_file_path = session.get("export_file_path")
+        if not export_file_path or not os.path.exists(export_file_path):
+            flash("ไม่พบไฟล์สำหรับดาวน์โหลด", "error")
+            return redirect(url_for("result"))
+        return send_file(export_file_path, as_attachment=True)
+
+    fmt = fmt or "xlsx"
+    if fmt not in EXPORT_FORMATS:
+        flash(f"ไม่รองรับรูปแบบไฟล์: {fmt}", "error")
+        return redirect(url_for("result"))
+    job = get_job_manager().get(job_id) if job_id else None
+    if artifact:
+        data_path = ((job or {}).get("artifacts") or {}).get(artifact)
+        download_stem = os.path.splitext(os.path.basename(data_path))[0] if data_path else None
+    else:
+        export_file_path, data_path = _result_file_path(job_id)
+        if export_file_path and export_file_path.endswith(f".{fmt}"):
+            return send_file(export_file_path, as_attachment=True)
+        download_stem = os.path.splitext(os.path.basename(export_file_path))[0] if export_file_path else None
+    if not data_path or not os.path.exists(data_path):
+        flash("ไม่พบข้อมูลสำหรับดาวน์โหลดในรูปแบบนี้", "error")
+        return redirect(url_for("result"))
+    try:
+        out_path = materialize(data_path, fmt)
+    except Exception as e:
+        flash(f"สร้างไฟล์ {fmt} ไม่สำเร็จ: {e}", "error")
         return redirect(url_for("result"))
-    return send_file(export_file_path, as_attachment=True)
+    return send_file(out_path, as_attachment=True, download_name=f"{download_stem}.{fmt}")
 
 if __name__ == "__main__":
     ip = socket.gethostbyname(socket.gethostname())
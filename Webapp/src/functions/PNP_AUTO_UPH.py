@@ -1,6 +1,8 @@
 import pandas as pd
 import numpy as np  
 
+from services.outlier_engine import remove_outliers_grouped, attach_group_summary
+
 df = pd.read_excel("data/APL_utl1_2024Q1_DIE_ATTACH_MAP.xlsx")
 
 def apply_zscore(df):
@@ -100,19 +102,20 @@ def remove_outliers(df):
     else:
         raise KeyError("ไม่พบคอลัมน์ bom_no ในข้อมูล")
     
-    # รวมข้อมูลที่ผ่านการตัด outliers ตามกลุ่ม bom_no และ Machine Model
-    result_dfs = []
+    if 'uph' not in col_map:
+        raise KeyError("ไม่พบคอลัมน์ UPH ในข้อมูล")
+    uph_col = col_map['uph']
     
-    # จัดกลุ่มตาม bom_no และ Machine Model
-    for (bom_no, machine_model), group_df in df.groupby([bom_col, model_col]):
-        print(f"ประมวลผลกลุ่ม: BOM={bom_no}, Machine={machine_model}, จำนวนข้อมูล={len(group_df)}")
-        
-        # ตัด outliers สำหรับแต่ละกลุ่ม
-        cleaned_group = remove_outliers_auto(group_df)
-        result_dfs.append(cleaned_group)
+    # ตัด outliers ทุกกลุ่ม bom_no และ Machine Model พร้อมกันแบบ vectorized
+    group_cols = [bom_col, model_col]
+    keep, summary = remove_outliers_grouped(df, uph_col, group_cols, variant="chained")
+    for bom_no, machine_model, before in zip(summary[bom_col], summary[model_col], summary['DataPoints_Before']):
+        print(f"ประมวลผลกลุ่ม: BOM={bom_no}, Machine={machine_model}, จำนวนข้อมูล={before}")
     
     # รวมผลลัพธ์ทั้งหมด
-    return pd.concat(result_dfs, ignore_index=True)
+    cleaned = attach_group_summary(df, keep, summary, group_cols, ['Outlier_Method'])
+    cleaned[uph_col] = pd.to_numeric(cleaned[uph_col], errors='coerce')
+    return cleaned.reset_index(drop=True)
 
 def time_series_analysis(df):
     col_map = {col.lower(): col for col in df.columns}
@@ -1,9 +1,171 @@
 import os
 import glob
 import pandas as pd
+import numpy as np
 import re
 
-def run_all_years(input_path_or_file, output_dir):
+from services.input_cache import read_excel_cached, read_csv_cached, file_hash
+from services.last_type_store import load_state, save_state
+from services.last_type_index import get_last_type_index
+from services.parallel import parallel_map, resolve_workers
+from services.progress import report_progress
+
+# คอลัมน์ที่ใช้จากไฟล์ WF size (คอลัมน์อื่นไม่ต้องอ่าน)
+WF_COLUMNS = ['cust_code', 'package_code', 'product_no', 'bom_no', 'assy_pack_type', 'start_date']
+# คอลัมน์ข้อความที่มีค่าซ้ำมากเก็บเป็น category (คอลัมน์ key คงชนิดเดิมให้ตรงกับไฟล์ Excel)
+WF_CSV_DTYPES = {'assy_pack_type': 'category'}
+# parser สำหรับ CSV: "c" (ค่าเริ่มต้น) หรือ "pyarrow" (เร็วกว่า ใช้หลาย thread) ตั้งผ่าน env WF_CSV_ENGINE
+WF_CSV_ENGINE_ENV = "WF_CSV_ENGINE"
+# ตั้งจำนวน worker สำหรับอ่านไฟล์รายเดือนพร้อมกันผ่าน env นี้ (1 = ทีละไฟล์)
+PNP_CHANGE_WORKERS_ENV = "PNP_CHANGE_MAX_WORKERS"
+# ตั้งเป็น "1" เพื่อคำนวณใหม่จากทุกไฟล์แทนการรวมเฉพาะไฟล์เดือนใหม่เข้ากับสถานะที่เก็บไว้
+PNP_CHANGE_FULL_REFRESH_ENV = "PNP_CHANGE_FULL_REFRESH"
+
+GROUP_COLS = ['cust_code', 'package_code', 'product_no', 'bom_no']
+MONTH_ORDER = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun',
+               'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']
+
+def _csv_engine(engine=None):
+    engine = engine or os.environ.get(WF_CSV_ENGINE_ENV) or "c"
+    if engine == "pyarrow":
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            print("⚠️ ไม่พบ pyarrow ใช้ parser ปกติแทน")
+            engine = "c"
+    return engine
+
+def read_wf_csv(filepath, engine=None):
+    """อ่านไฟล์ WF size (.csv) เฉพาะคอลัมน์ที่ใช้ พร้อมกำหนดชนิดข้อมูลและแปลง start_date ตั้งแต่ตอนอ่าน"""
+    header = pd.read_csv(filepath, nrows=0).columns
+    usecols = [col for col in WF_COLUMNS if col in header]
+    kwargs = {
+        'usecols': usecols,
+        'dtype': {col: dtype for col, dtype in WF_CSV_DTYPES.items() if col in usecols},
+    }
+    if 'start_date' in usecols:
+        kwargs['parse_dates'] = ['start_date']
+    df = read_csv_cached(filepath, engine=_csv_engine(engine), **kwargs)
+    if 'start_date' in df.columns and pd.api.types.is_datetime64_any_dtype(df['start_date']):
+        # pyarrow ให้หน่วยวินาที แปลงเป็น ns ให้เหมือน parser ปกติ
+        df['start_date'] = df['start_date'].astype('datetime64[ns]')
+    return df
+
+def _load_wf_file(task):
+    """โหลดไฟล์ WF size หนึ่งไฟล์ (ใช้ใน process pool) คืน None ถ้าอ่านไม่ได้"""
+    filepath, year, engine = task
+    filename = os.path.basename(filepath)
+    month_match = re.search(r"WF size ([^ ]+)", filename)
+    month = month_match.group(1) if month_match else "Unknown"
+
+    try:
+        if filepath.endswith(('.xls', '.xlsx')):
+            df = read_excel_cached(filepath, engine="openpyxl" if filepath.endswith('.xlsx') else None)
+        elif filepath.endswith('.csv'):
+            df = read_wf_csv(filepath, engine)
+        else:
+            print(f"❌ ไม่รู้จักฟอร์แมต: {filename}")
+            return None
+    except Exception as e:
+        print(f"❌ อ่านไฟล์ {filename} ผิดพลาด: {e}")
+        return None
+
+    df['month'] = month
+    df['file_year'] = year
+    return df
+
+def summarize_type_changes(df_all, group_cols):
+    """
+    สรุป assy_pack_type แรก/ล่าสุดของแต่ละ BOM ด้วย groupby ครั้งเดียว
+    - เรียงตาม start_date แบบ stable (NaT อยู่ท้าย) record แรก/ล่าสุดจึงเป็นแถวแรก/แถวสุดท้ายของกลุ่ม
+    - ใช้ตำแหน่งแถวแรก/สุดท้ายแทน first/last เพื่อให้ assy_pack_type และวันที่มาจากแถวเดียวกันเสมอ (รวมค่าว่าง)
+    """
+    by_date = df_all.sort_values('start_date', kind='mergesort').reset_index(drop=True)
+    by_date['_pos'] = range(len(by_date))
+    grouped = by_date.groupby(group_cols)
+    positions = grouped.agg(first_pos=('_pos', 'min'), last_pos=('_pos', 'max'))
+    type_count = grouped['assy_pack_type'].nunique(dropna=False)
+    
+    first_record = by_date.iloc[positions['first_pos'].to_numpy()]
+    last_record = by_date.iloc[positions['last_pos'].to_numpy()]
+    summary_df = positions.index.to_frame(index=False)
+    summary_df['prev_assy_pack_type'] = first_record['assy_pack_type'].to_numpy()   # assy_pack_type แรก
+    summary_df['assy_pack_type'] = last_record['assy_pack_type'].to_numpy()         # assy_pack_type สุดท้าย
+    summary_df['prev_start_date'] = first_record['start_date'].to_numpy()           # วันที่เจอครั้งแรก
+    summary_df['start_date'] = last_record['start_date'].to_numpy()                 # วันที่เจอครั้งสุดท้าย
+    summary_df['prev_month_name'] = summary_df['prev_start_date'].dt.strftime('%b')
+    summary_df['curr_month_name'] = summary_df['start_date'].dt.strftime('%b')
+    summary_df['change_status'] = np.where(type_count.to_numpy() > 1, 'Changed', 'No Change')
+    # ปี/เดือนของไฟล์ที่เจอ record แรก/ล่าสุด (ใช้เรียงลำดับเมื่อรวมไฟล์เดือนใหม่เข้ากับสถานะเดิม)
+    summary_df['prev_file_year'] = first_record['file_year'].to_numpy()
+    summary_df['prev_month_num'] = first_record['month_num'].to_numpy()
+    summary_df['file_year'] = last_record['file_year'].to_numpy()
+    summary_df['month_num'] = last_record['month_num'].to_numpy()
+    return summary_df
+
+def prepare_wf_rows(df_all):
+    """เลือกคอลัมน์ที่ใช้ แปลง start_date และหาเลขเดือนของไฟล์ แล้วเรียงตาม BOM → เวลา คืน None ถ้าคอลัมน์ไม่ครบ"""
+    # คอลัมน์ที่ต้องใช้
+    required_cols = ['cust_code', 'package_code', 'product_no', 'bom_no', 'assy_pack_type', 'start_date', 'month']
+    missing = [c for c in required_cols if c not in df_all.columns]
+    if missing:
+        print(f"❌ คอลัมน์หายไป: {missing}")
+        return None
+
+    df_all = df_all[required_cols + ['file_year']]
+
+    # แปลง start_date เป็น datetime เพื่อเรียงตามวันที่
+    df_all['start_date'] = pd.to_datetime(df_all['start_date'], errors='coerce')
+
+    # จัดเรียงเดือน
+    month_map = {m: i for i, m in enumerate(MONTH_ORDER, 1)}
+    df_all['month_short'] = df_all['month'].str[:3]
+    df_all['month_num'] = df_all['month_short'].map(month_map)
+    return sort_wf_rows(df_all)
+
+def sort_wf_rows(df):
+    """เรียงตาม BOM → เวลา (ปี → เดือน → วันที่)"""
+    return df.sort_values(by=[
+        'bom_no', 'package_code', 'product_no', 'cust_code',
+        'file_year', 'month_num', 'start_date'
+    ]).reset_index(drop=True)
+
+def fold_type_changes(state, df_new, group_cols=GROUP_COLS):
+    """
+    รวมข้อมูลไฟล์เดือนใหม่ (จาก prepare_wf_rows) เข้ากับสถานะเดิมของแต่ละ BOM
+    record แรก/ล่าสุดเดิมถูกใส่กลับเป็นแถวตัวแทน จึงได้ผลเหมือนคำนวณจากทุกไฟล์ใหม่
+    (BOM ที่ยังไม่เปลี่ยน type ทุกแถวเดิมมี type เดียวกับแถวตัวแทน ส่วน BOM ที่เคยเปลี่ยนแล้วคงสถานะ Changed)
+    การรวมไฟล์เดิมซ้ำไม่ทำให้ผลเปลี่ยน
+    """
+    if state is None or state.empty:
+        return summarize_type_changes(df_new, group_cols)
+    
+    first_rows = state[group_cols].assign(
+        assy_pack_type=state['prev_assy_pack_type'], start_date=state['prev_start_date'],
+        file_year=state['prev_file_year'], month_num=state['prev_month_num'],
+    )
+    last_rows = state[group_cols].assign(
+        assy_pack_type=state['assy_pack_type'], start_date=state['start_date'],
+        file_year=state['file_year'], month_num=state['month_num'],
+    )
+    new_rows = df_new[group_cols + ['assy_pack_type', 'start_date', 'file_year', 'month_num']]
+    combined = pd.concat([first_rows, last_rows, new_rows], ignore_index=True)
+    summary_df = summarize_type_changes(sort_wf_rows(combined), group_cols)
+    
+    changed_before = state.loc[state['change_status'] == 'Changed', group_cols].assign(_changed=True)
+    was_changed = summary_df[group_cols].merge(changed_before, on=group_cols, how='left')['_changed']
+    summary_df.loc[was_changed.notna().to_numpy(), 'change_status'] = 'Changed'
+    return summary_df
+
+def run_all_years(input_path_or_file, output_dir, max_workers=None, engine=None, full_refresh=None):
+    """
+    สรุปการเปลี่ยน assy_pack_type ของแต่ละ BOM จากไฟล์ WF size ทุกเดือน บันทึกเป็น Last_Type.xlsx
+    ปกติรวมเฉพาะไฟล์ที่ยังไม่เคยประมวลผลเข้ากับสถานะที่เก็บไว้ (services.last_type_store)
+    เมื่อไฟล์ที่เลือกครอบคลุมทุกไฟล์ในสถานะนั้น ไม่เช่นนั้นคำนวณใหม่จากไฟล์ที่เลือก (ผลจึงไม่ขึ้นกับการรันครั้งก่อน)
+    max_workers: จำนวน process ที่อ่านไฟล์พร้อมกัน (None = ใช้ env PNP_CHANGE_MAX_WORKERS)
+    engine: parser ของ CSV ("c" หรือ "pyarrow", None = ใช้ env WF_CSV_ENGINE)
+    full_refresh: True = คำนวณใหม่จากทุกไฟล์แล้วแทนที่สถานะเดิม (None = ใช้ env PNP_CHANGE_FULL_REFRESH)
+    """
     # เพิ่มรองรับ list ของไฟล์
     if isinstance(input_path_or_file, list):
         all_files = input_path_or_file
@@ -28,127 +190,64 @@ def run_all_years(input_path_or_file, output_dir):
         else:
             print(f"⚠️ ไฟล์ {filename} ไม่มีปีในชื่อ")
 
-    df_list = []
-
-    for year in sorted(files_by_year):
-        for filepath in files_by_year[year]:
-            filename = os.path.basename(filepath)
-            month_match = re.search(r"WF size ([^ ]+)", filename)
-            month = month_match.group(1) if month_match else "Unknown"
-
-            try:
-                if filepath.endswith(('.xls', '.xlsx')):
-                    df = pd.read_excel(filepath, engine="openpyxl" if filepath.endswith('.xlsx') else None)
-                elif filepath.endswith('.csv'):
-                    df = pd.read_csv(filepath)
-                else:
-                    print(f"❌ ไม่รู้จักฟอร์แมต: {filename}")
-                    continue
-            except Exception as e:
-                print(f"❌ อ่านไฟล์ {filename} ผิดพลาด: {e}")
-                continue
-
-            df['month'] = month
-            df['file_year'] = year
-            df_list.append(df)
-
-    if not df_list:
-        print("❌ ไม่มีไฟล์ที่โหลดได้เลย")
-        return None  # หรือ return None, "❌ ไม่มีไฟล์ที่โหลดได้เลย"
-
-    df_all = pd.concat(df_list, ignore_index=True)
+    tasks = [(filepath, year, engine) for year in sorted(files_by_year) for filepath in files_by_year[year]]
 
-    # คอลัมน์ที่ต้องใช้
-    required_cols = ['cust_code', 'package_code', 'product_no', 'bom_no', 'assy_pack_type', 'start_date', 'month']
-    missing = [c for c in required_cols if c not in df_all.columns]
-    if missing:
-        print(f"❌ คอลัมน์หายไป: {missing}")
-        return
+    # โหมดสะสม: ข้ามไฟล์ที่เคยรวมเข้าสถานะแล้ว (เทียบจาก sha256 ของเนื้อไฟล์)
+    if full_refresh is None:
+        full_refresh = os.environ.get(PNP_CHANGE_FULL_REFRESH_ENV, "0") == "1"
+    state, folded = (None, {}) if full_refresh else load_state()
+    hashes = {task[0]: file_hash(task[0])[0] for task in tasks}
+    selected = set(hashes.values())
+    keep_store = False
+    if state is not None and not set(folded) <= selected:
+        # สถานะเดิมมีไฟล์ที่ไม่ได้เลือก (เลือกแค่บางเดือน หรือไฟล์ชื่อเดิมถูกแก้ไขจน sha256 เปลี่ยน)
+        # รวมต่อไม่ได้ ต้องคำนวณใหม่จากไฟล์ที่เลือกเท่านั้น
+        stale = sorted(name for sha, name in folded.items() if sha not in selected)
+        print(f"🔄 สถานะเดิมมีไฟล์ที่ไม่ได้เลือกหรือถูกแก้ไข {len(stale)} ไฟล์ ({', '.join(stale[:3])}{' ...' if len(stale) > 3 else ''})")
+        # ถ้าเลือกแค่บางไฟล์ของสถานะเดิม (ไม่มีไฟล์ใหม่) ไม่ต้องแทนที่สถานะสะสมเดิมด้วยผลของไฟล์ที่น้อยกว่า
+        keep_store = selected < set(folded)
+        state, folded = None, {}
+    if state is not None:
+        tasks = [task for task in tasks if hashes[task[0]] not in folded]
+        print(f"📚 ใช้สถานะเดิม {len(state)} BOM จาก {len(folded)} ไฟล์ มีไฟล์ใหม่ {len(tasks)} ไฟล์")
+    else:
+        print("🔄 คำนวณใหม่จากทุกไฟล์")
 
-    df_all = df_all[required_cols + ['file_year']]
+    workers = resolve_workers(max_workers, PNP_CHANGE_WORKERS_ENV)
+    loaded = parallel_map(
+        _load_wf_file, tasks, workers,
+        on_result=lambda i, total: report_progress("load", f"โหลดไฟล์ {i}/{total}", groups_done=i, groups_total=total),
+    )
+    df_list = [df for df in loaded if df is not None]
 
-    # แปลง start_date เป็น datetime เพื่อเรียงตามวันที่
-    df_all['start_date'] = pd.to_datetime(df_all['start_date'], errors='coerce')
+    if df_list:
+        df_all = prepare_wf_rows(pd.concat(df_list, ignore_index=True))
+        if df_all is None:
+            return
 
-    # จัดเรียงเดือน
-    month_order = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun',
-                   'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']
-    month_map = {m: i for i, m in enumerate(month_order, 1)}
-    df_all['month_short'] = df_all['month'].str[:3]
-    df_all['month_num'] = df_all['month_short'].map(month_map)
-
-    # เรียงตาม BOM → เวลา (ปี → เดือน → วันที่)
-    df_all = df_all.sort_values(by=[
-        'bom_no', 'package_code', 'product_no', 'cust_code',
-        'file_year', 'month_num', 'start_date'
-    ]).reset_index(drop=True)
+        # จัดข้อมูลสำหรับแสดงผล: วิเคราะห์การเปลี่ยนแปลง assy_pack_type
+        summary_df = fold_type_changes(state, df_all, GROUP_COLS)
+        for task, df in zip(tasks, loaded):
+            if df is not None:
+                folded[hashes[task[0]]] = os.path.basename(task[0])
+        if not keep_store:
+            save_state(summary_df, folded)
+    elif state is not None:
+        print("ℹ️ ไม่มีไฟล์เดือนใหม่ ใช้สถานะเดิม")
+        summary_df = state
+    else:
+        print("❌ ไม่มีไฟล์ที่โหลดได้เลย")
+        return None  # หรือ return None, "❌ ไม่มีไฟล์ที่โหลดได้เลย"
 
-    # จัดข้อมูลสำหรับแสดงผล: วิเคราะห์การเปลี่ยนแปลง assy_pack_type
-    group_cols = ['cust_code', 'package_code', 'product_no', 'bom_no']
-    
-    result_list = []
-    
-    for name, group in df_all.groupby(group_cols):
-        group = group.sort_values('start_date').reset_index(drop=True)
-        
-        # หาวันที่แรกสุดและวันที่ล่าสุดของ BOM นั้นๆ
-        first_record = group.iloc[0]   # record แรกสุด (วันที่เก่าสุด)
-        last_record = group.iloc[-1]   # record ล่าสุด (วันที่ใหม่สุด)
-        
-        # ตรวจสอบว่ามีการเปลี่ยนแปลง assy_pack_type หรือไม่
-        unique_types = group['assy_pack_type'].unique()
-        
-        if len(unique_types) == 1:
-            # ไม่มีการเปลี่ยนแปลง assy_pack_type
-            row_data = {
-                'cust_code': first_record['cust_code'],
-                'package_code': first_record['package_code'],
-                'product_no': first_record['product_no'],
-                'bom_no': first_record['bom_no'],
-                'prev_assy_pack_type': first_record['assy_pack_type'],
-                'assy_pack_type': first_record['assy_pack_type'],
-                'prev_start_date': first_record['start_date'],     # วันที่เจอครั้งแรก
-                'start_date': last_record['start_date'],           # วันที่เจอครั้งสุดท้าย
-                'prev_month_name': first_record['start_date'].strftime('%b'),
-                'curr_month_name': last_record['start_date'].strftime('%b'),
-                'change_status': 'No Change'
-            }
-            result_list.append(row_data)
-        else:
-            # มีการเปลี่ยนแปลง assy_pack_type
-            # หา assy_pack_type แรกและสุดท้าย
-            first_assy_type = first_record['assy_pack_type']
-            last_assy_type = last_record['assy_pack_type']
-            
-            row_data = {
-                'cust_code': first_record['cust_code'],
-                'package_code': first_record['package_code'],
-                'product_no': first_record['product_no'],
-                'bom_no': first_record['bom_no'],
-                'prev_assy_pack_type': first_assy_type,           # assy_pack_type แรก
-                'assy_pack_type': last_assy_type,                 # assy_pack_type สุดท้าย
-                'prev_start_date': first_record['start_date'],    # วันที่เจอครั้งแรก
-                'start_date': last_record['start_date'],          # วันที่เจอครั้งสุดท้าย
-                'prev_month_name': first_record['start_date'].strftime('%b'),
-                'curr_month_name': last_record['start_date'].strftime('%b'),
-                'change_status': 'Changed'
-            }
-            result_list.append(row_data)
-    
-    # สร้าง DataFrame จากผลลัพธ์
-    summary_df = pd.DataFrame(result_list)
-    
     # เรียงเดือนให้ถูกต้องด้วย Categorical
-    month_order = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun',
-                   'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']
-    summary_df['prev_month_name'] = pd.Categorical(summary_df['prev_month_name'], categories=month_order, ordered=True)
-    summary_df['curr_month_name'] = pd.Categorical(summary_df['curr_month_name'], categories=month_order, ordered=True)
+    summary_df['prev_month_name'] = pd.Categorical(summary_df['prev_month_name'], categories=MONTH_ORDER, ordered=True)
+    summary_df['curr_month_name'] = pd.Categorical(summary_df['curr_month_name'], categories=MONTH_ORDER, ordered=True)
 
     # เรียงตามวันเวลา
     summary_df = summary_df.sort_values(by=['start_date']).reset_index(drop=True)
 
     # เลือกคอลัมน์ส่งออก
-    output_cols = group_cols + [
+    output_cols = GROUP_COLS + [
         'prev_assy_pack_type', 'assy_pack_type',
         'prev_start_date', 'start_date',
         'prev_month_name', 'curr_month_name',
@@ -159,11 +258,17 @@ def run_all_years(input_path_or_file, output_dir):
     os.makedirs(output_dir, exist_ok=True)
     output_file = os.path.join(output_dir, "Last_Type.xlsx")  # ✅ เปลี่ยนชื่อไฟล์
     
-    # ส่งออก Excel พร้อมจัดความกว้างคอลัมน์
-    with pd.ExcelWriter(output_file, engine='xlsxwriter') as writer:
-        summary_df[output_cols].to_excel(writer, index=False, sheet_name='BOM Summary')
-        worksheet = writer.sheets['BOM Summary']
-        worksheet.set_column('A:K', 15)
+    # ส่งออก Excel พร้อมจัดความกว้างคอลัมน์ (เขียนไฟล์ชั่วคราวแล้ว replace ผู้อ่าน เช่น /api/last_type จะไม่เจอไฟล์ที่เขียนไม่เสร็จ)
+    tmp_file = f"{os.path.splitext(output_file)[0]}.{os.getpid()}.tmp.xlsx"  # pandas ต้องการนามสกุล .xlsx
+    try:
+        with pd.ExcelWriter(tmp_file, engine='xlsxwriter') as writer:
+            summary_df[output_cols].to_excel(writer, index=False, sheet_name='BOM Summary')
+            worksheet = writer.sheets['BOM Summary']
+            worksheet.set_column('A:K', 15)
+        os.replace(tmp_file, output_file)
+    finally:
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
     print(f"✅ Output file saved at: {output_file}")  # เพิ่มบรรทัดนี้
 
     # นับข้อมูล
@@ -179,17 +284,13 @@ def run_all_years(input_path_or_file, output_dir):
 
 # ✅ เก็บฟังก์ชัน lookup_last_type ไว้เพื่อใช้กับเว็บ
 def lookup_last_type(input_bom_file, output_dir):
-    # โหลดไฟล์ Last_Type.xlsx
+    """ค้นหา Last_type ของ BOM ในไฟล์ที่อัปโหลด จาก Last_Type.xlsx ใน output_dir (index อยู่ใน memory จนไฟล์เปลี่ยน)"""
     last_type_path = os.path.join(output_dir, "Last_Type.xlsx")
     if not os.path.exists(last_type_path):
         print(f"❌ ไม่พบไฟล์ {last_type_path}")
         return
 
-    df_last = pd.read_excel(last_type_path)
-    # เลือกเฉพาะคอลัมน์ที่จำเป็น - ✅ ปรับให้ใช้กับโครงสร้างใหม่
-    cols = ['bom_no', 'assy_pack_type']  # ใช้ assy_pack_type แทน Last_type
-    df_last = df_last[cols].drop_duplicates()
-    df_last.rename(columns={'assy_pack_type': 'Last_type'}, inplace=True)  # เปลี่ยนชื่อคอลัมน์
+    index = get_last_type_index(last_type_path)
 
     # โหลดไฟล์ bom_no ที่อัปโหลด
     df_bom = pd.read_excel(input_bom_file) if input_bom_file.endswith('.xlsx') else pd.read_csv(input_bom_file)
@@ -197,13 +298,8 @@ def lookup_last_type(input_bom_file, output_dir):
         print("❌ ไฟล์ที่อัปโหลดไม่มีคอลัมน์ bom_no")
         return
 
-    # รวมข้อมูล (merge) เพื่อดึง Last_type
-    merge_cols = ['bom_no']
-    if 'package_code' in df_bom.columns and 'product_no' in df_bom.columns:
-        merge_cols += ['package_code', 'product_no']
-
-    df_merged = pd.merge(df_bom, df_last, on=merge_cols, how='left')
-    return df_merged
+    # ใช้ bom_no + package_code + product_no เป็นคีย์ถ้าไฟล์มีครบ ไม่เช่นนั้นใช้ bom_no อย่างเดียว
+    return index.lookup(df_bom)
 
-def PNP_CHANGE_TYPE(input_path, output_dir):
-    return run_all_years(input_path, output_dir)
+def PNP_CHANGE_TYPE(input_path, output_dir, max_workers=None, full_refresh=None):
+    return run_all_years(input_path, output_dir, max_workers, full_refresh=full_refresh)
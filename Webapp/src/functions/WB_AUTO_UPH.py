@@ -4,9 +4,60 @@ from scipy.stats import zscore
 import os
 from datetime import datetime
 
+from services.progress import report_progress
+from services.input_cache import read_excel_cached, read_csv_cached
+from services.outlier_engine import remove_outliers_grouped, attach_group_summary
+from services.reference_data import get_reference
+from services.exports import excel_writer
+
+
+def build_wire_per_unit_index(nobump_df):
+    """สร้างตาราง BOM → Wire Per Unit ครั้งเดียว (ใช้แถวแรกของแต่ละ BOM เหมือนการค้นหาเดิม)"""
+    df = nobump_df.copy()
+    df.columns = df.columns.str.strip().str.lower().str.replace(' ', '_').str.replace('-', '_')
+    if 'bom_no' not in df.columns:
+        print("⚠️ Wire data has no bom_no column, Wire Per Unit defaults to 1.0")
+        return pd.Series(dtype=float)
+    df['bom_no'] = df['bom_no'].astype(str).str.strip().str.upper()
+    df = df.drop_duplicates('bom_no', keep='first').set_index('bom_no')
+    no_bump = pd.to_numeric(df['no_bump'], errors='coerce') if 'no_bump' in df.columns else 0
+    num_required = pd.to_numeric(df['number_required'], errors='coerce') if 'number_required' in df.columns else 0
+    wire_per_unit = pd.Series((no_bump / 2) + num_required, index=df.index, dtype=float)
+    # ค่าที่ไม่ถูกต้องหรือไม่เป็นบวกใช้ 1.0
+    return wire_per_unit.where(wire_per_unit > 0, 1.0)
+
+
+def load_wire_reference(wire_data_path):
+    """โหลดไฟล์ Wire Data และ normalize คอลัมน์ (underscore style) คืน (nobump_df, wire_per_unit_index)"""
+    nobump_df = read_excel_cached(wire_data_path)
+    nobump_df.columns = (
+        nobump_df.columns
+        .str.strip()
+        .str.lower()
+        .str.replace(' ', '_')
+        .str.replace('-', '_')
+    )
+    # เพิ่ม mapping robust สำหรับ wire data
+    col_map = {}
+    for col in nobump_df.columns:
+        norm = col.replace('_', '').replace(' ', '').lower()
+        if norm in ['bomno', 'bom', 'bom_no']:
+            col_map[col] = 'bom_no'
+        elif norm in ['numberrequired', 'number_required']:
+            col_map[col] = 'number_required'
+        elif norm in ['nobump', 'no_bump']:
+            col_map[col] = 'no_bump'
+    nobump_df.rename(columns=col_map, inplace=True)
+    # Clean BOM ให้เหมือนกับ UPH
+    if 'bom_no' in nobump_df.columns:
+        nobump_df['bom_no'] = nobump_df['bom_no'].astype(str).str.strip().str.upper()
+    return nobump_df, build_wire_per_unit_index(nobump_df)
+
+
 class WireBondingAnalyzer:
     def __init__(self):
         self.nobump_df = None
+        self.wire_per_unit_index = None
         self.wb_data = None
         self.efficiency_df = None
         self.raw_data = None
@@ -59,29 +110,10 @@ class WireBondingAnalyzer:
             # โหลดข้อมูล Wire Data
             print(f"📊 Loading Wire data from: {os.path.basename(wire_data_path)}")
             try:
-                self.nobump_df = pd.read_excel(wire_data_path)
-                self.nobump_df.columns = (
-                    self.nobump_df.columns
-                    .str.strip()
-                    .str.lower()
-                    .str.replace(' ', '_')
-                    .str.replace('-', '_')
-                )
-                # เพิ่ม mapping robust สำหรับ wire data
-                col_map = {}
-                for col in self.nobump_df.columns:
-                    norm = col.replace('_', '').replace(' ', '').lower()
-                    if norm in ['bomno', 'bom', 'bom_no']:
-                        col_map[col] = 'bom_no'
-                    elif norm in ['numberrequired', 'number_required']:
-                        col_map[col] = 'number_required'
-                    elif norm in ['nobump', 'no_bump']:
-                        col_map[col] = 'no_bump'
-                self.nobump_df.rename(columns=col_map, inplace=True)
-                # Clean BOM ให้เหมือนกับ UPH
-                if 'bom_no' in self.nobump_df.columns:
-                    self.nobump_df['bom_no'] = self.nobump_df['bom_no'].astype(str).str.strip().str.upper()
+                # ใช้ข้อมูลที่โหลดไว้แล้วใน process ถ้าไฟล์ไม่เปลี่ยน
+                self.nobump_df, self.wire_per_unit_index = get_reference("wire_data", wire_data_path, load_wire_reference)
                 print(f"✅ Wire data loaded: {len(self.nobump_df)} rows, columns: {list(self.nobump_df.columns)}")
+                print(f"🔌 Wire Per Unit index: {len(self.wire_per_unit_index)} BOMs")
                 print("Wire data preview:", self.nobump_df.head())
             except Exception as e:
                 print(f"❌ Error loading Wire data: {e}")
@@ -91,9 +123,9 @@ class WireBondingAnalyzer:
             try:
                 ext = os.path.splitext(uph_path)[-1].lower()
                 if ext == '.csv':
-                    self.raw_data = pd.read_csv(uph_path, encoding='utf-8-sig')
+                    self.raw_data = read_csv_cached(uph_path, encoding='utf-8-sig')
                 elif ext in ['.xlsx', '.xls']:
-                    self.raw_data = pd.read_excel(uph_path)
+                    self.raw_data = read_excel_cached(uph_path)
                 elif ext == '.json':
                     self.raw_data = pd.read_json(uph_path)
                 else:
@@ -153,20 +185,17 @@ class WireBondingAnalyzer:
             print(f"❌ Error loading data: {e}")
             return False
     
+    def lookup_wire_per_unit(self, bom_series):
+        """หา Wire Per Unit ของหลาย BOM พร้อมกัน (BOM ที่ไม่พบใช้ 1.0)"""
+        if self.wire_per_unit_index is None:
+            self.wire_per_unit_index = build_wire_per_unit_index(self.nobump_df)
+        keys = pd.Series(bom_series).astype(str).str.strip().str.upper()
+        return keys.map(self.wire_per_unit_index).fillna(1.0).to_numpy(dtype=float)
+    
     def calculate_wire_per_unit(self, bom_no):
         """คำนวณจำนวนสายต่อหน่วย (ใช้ชื่อคอลัมน์แบบ underscore)"""
         try:
-            bom_no = str(bom_no).strip().upper()
-            # Normalize columns in self.nobump_df
-            df = self.nobump_df.copy()
-            df.columns = df.columns.str.strip().str.lower().str.replace(' ', '_').str.replace('-', '_')
-            bom_data = df[df['bom_no'].astype(str).str.strip().str.upper() == bom_no]
-            if bom_data.empty:
-                return 1.0
-            no_bump = float(bom_data['no_bump'].iloc[0]) if 'no_bump' in bom_data.columns and not bom_data['no_bump'].empty else 0
-            num_required = float(bom_data['number_required'].iloc[0]) if 'number_required' in bom_data.columns and not bom_data['number_required'].empty else 0
-            wire_per_unit = (no_bump / 2) + num_required
-            return wire_per_unit if wire_per_unit > 0 else 1.0
+            return float(self.lookup_wire_per_unit([bom_no])[0])
         except Exception as e:
             print(f"Error calculating wire per unit for BOM {bom_no}: {e}")
             return 1.0
@@ -182,53 +211,24 @@ class WireBondingAnalyzer:
             missing_cols = [col for col in required_cols if col not in df.columns]
             if missing_cols:
                 raise KeyError(f"Missing required columns: {missing_cols}")
-            # แบ่งข้อมูลตาม BOM และ Machine Model
-            grouped = df.groupby(['bom_no', 'machine_model'])
-            cleaned_data = []
-            outlier_info = {}
-            for (bom_no, model), group_data in grouped:
-                group_data = group_data.copy()
-                original_count = len(group_data)
-                # ข้ามถ้าข้อมูลน้อยกว่า 15 จุด
-                if len(group_data) < 15:
-                    cleaned_data.append(group_data)
-                    outlier_info[(bom_no, model)] = {
-                        'original_count': original_count,
-                        'removed_count': 0,
-                        'final_count': original_count
-                    }
-                    continue
-                # กระบวนการตัด Outlier แบบอัตโนมัติ
-                current_data = group_data
-                for iteration in range(20):  # จำกัดจำนวนรอบ
-                    # ใช้ Z-Score (±3σ)
-                    z_threshold = 3
-                    z_scores = zscore(current_data['uph'])
-                    z_filtered = current_data[(z_scores >= -z_threshold) & (z_scores <= z_threshold)]
-                    # ตรวจสอบว่ายังมี Outlier หรือไม่
-                    if not self._has_outliers(z_filtered['uph']):
-                        current_data = z_filtered
-                        break
-                    # ใช้ IQR (1.5*IQR)
-                    Q1 = current_data['uph'].quantile(0.25)
-                    Q3 = current_data['uph'].quantile(0.75)
-                    IQR = Q3 - Q1
-                    iqr_filtered = current_data[
-                        (current_data['uph'] >= Q1 - 1.5*IQR) & 
-                        (current_data['uph'] <= Q3 + 1.5*IQR)]
-                    if not self._has_outliers(iqr_filtered['uph']):
-                        current_data = iqr_filtered
-                        break
-                    current_data = iqr_filtered
-                cleaned_data.append(current_data)
-                final_count = len(current_data)
-                # เก็บข้อมูลการตัด outlier
-                outlier_info[(bom_no, model)] = {
-                    'original_count': original_count,
-                    'removed_count': original_count - final_count,
-                    'final_count': final_count
+            # ตัด Outlier ทุกกลุ่ม (BOM × Machine Model) พร้อมกันแบบ vectorized
+            # กลุ่มที่มีข้อมูลน้อยกว่า 15 จุดจะไม่ถูกตัด
+            group_cols = ['bom_no', 'machine_model']
+            keep, summary = remove_outliers_grouped(df, 'uph', group_cols, variant="wire_bond")
+            result_df = attach_group_summary(df, keep, summary, group_cols, [])
+            # เก็บข้อมูลการตัด outlier
+            outlier_info = {
+                (bom_no, model): {
+                    'original_count': int(before),
+                    'removed_count': int(before - after),
+                    'final_count': int(after)
                 }
-            result_df = pd.concat(cleaned_data) if cleaned_data else df
+                for bom_no, model, before, after in zip(
+                    summary['bom_no'], summary['machine_model'],
+                    summary['DataPoints_Before'], summary['DataPoints_After'])
+            }
+            if summary.empty:
+                result_df = df
             return result_df, outlier_info
         except Exception as e:
             print(f"Error in remove_outliers: {e}")
@@ -290,65 +290,60 @@ class WireBondingAnalyzer:
         """คำนวณประสิทธิภาพการทำงาน (รองรับกรองช่วงวันที่)"""
         try:
             print(f"🔄 Starting calculate_efficiency...")
+            report_progress("preprocess", "Preprocessing data", rows=len(self.raw_data) if self.raw_data is not None else None)
             if start_date and end_date:
                 print(f"📅 กำลังประมวลผลข้อมูลช่วงวันที่: {start_date} ถึง {end_date}")
             if not self.preprocess_data(start_date=start_date, end_date=end_date):
                 print(f"❌ Preprocess data failed")
                 return None
             print(f"📊 Preprocessing completed. Data shape: {self.wb_data.shape}")
+            report_progress("outliers", "Removing outliers", rows=len(self.wb_data))
             # ตัด Outlier และเก็บข้อมูลการตัด
             cleaned_data, outlier_info = self.remove_outliers(self.wb_data)
             if cleaned_data.empty:
                 print(f"❌ No data remaining after outlier removal")
                 return None
             print(f"📊 After outlier removal. Data shape: {cleaned_data.shape}")
-            # กลุ่มข้อมูลตาม BOM และรุ่นเครื่อง
-            grouped = cleaned_data.groupby(['bom_no', 'machine_model'])
-            results = []
-            print(f"📊 Processing {len(grouped)} groups...")
-            for i, ((bom_no, model), group) in enumerate(grouped):
-                if i < 5:
-                    print(f"🔍 Processing group {i+1}/{len(grouped)}: BOM={bom_no}, Model={model}")
-                    print(f"   📈 Mean UPH: {group['uph'].mean():.2f}, Count: {len(group)}")
-                    print(f"   🔌 Wire Per Unit: {self.calculate_wire_per_unit(bom_no):.2f}")
-                try:
-                    # คำนวณค่าเฉลี่ย UPH
-                    mean_uph = group['uph'].mean()
-                    count = len(group)
-                    # คำนวณ Wire Per Unit
-                    wire_per_unit = self.calculate_wire_per_unit(bom_no)
-                    # คำนวณประสิทธิภาพ (UPH)
-                    efficiency = mean_uph / wire_per_unit if wire_per_unit > 0 else 0
-                    # ดึงข้อมูลเพิ่มเติม
-                    operation = group['operation'].iloc[0] if 'operation' in group.columns else 'N/A'
-                    optn_code = group['optn_code'].iloc[0] if 'optn_code' in group.columns else 'N/A'
-                    # ดึงข้อมูลการตัด outlier
-                    outlier_data = outlier_info.get((bom_no, model), {
-                        'original_count': count,
-                        'removed_count': 0,
-                        'final_count': count
-                    })
-                    result_entry = {
-                        'BOM': bom_no,
-                        'Model': model,
-                        'Operation': operation,
-                        'Optn_Code': optn_code,
-                        'Wire Per Hour': round(mean_uph, 2),
-                        'Wire_Per_Unit': round(wire_per_unit, 2),
-                        'UPH': round(efficiency, 3),
-                        'Data_Points': count,
-                        'Original_Count': outlier_data['original_count'],
-                        'Outliers_Removed': outlier_data['removed_count']
-                    }
-                    results.append(result_entry)
-                except Exception as group_error:
-                    print(f"   ❌ Error processing group {bom_no}-{model}: {group_error}")
-                    continue
-            if not results:
+            # กลุ่มข้อมูลตาม BOM และรุ่นเครื่อง แล้วคำนวณทุกกลุ่มพร้อมกัน
+            group_cols = ['bom_no', 'machine_model']
+            grouped = cleaned_data.groupby(group_cols)
+            stats = grouped['uph'].agg(['mean', 'size'])
+            print(f"📊 Processing {len(stats)} groups...")
+            report_progress("efficiency", f"Processing {len(stats)} groups", rows=len(cleaned_data), groups_done=0, groups_total=len(stats))
+            # ดึงข้อมูลเพิ่มเติมจากแถวแรกของแต่ละกลุ่ม
+            first_rows = cleaned_data.drop_duplicates(group_cols).set_index(group_cols).reindex(stats.index)
+            operation = first_rows['operation'] if 'operation' in first_rows.columns else 'N/A'
+            optn_code = first_rows['optn_code'] if 'optn_code' in first_rows.columns else 'N/A'
+            # คำนวณ Wire Per Unit และประสิทธิภาพ (UPH)
+            wire_per_unit = self.lookup_wire_per_unit(stats.index.get_level_values('bom_no'))
+            efficiency = np.where(wire_per_unit > 0, stats['mean'].to_numpy() / wire_per_unit, 0)
+            # ดึงข้อมูลการตัด outlier
+            outlier_data = [
+                outlier_info.get(key, {'original_count': count, 'removed_count': 0, 'final_count': count})
+                for key, count in zip(stats.index, stats['size'])
+            ]
+            results = pd.DataFrame({
+                'BOM': stats.index.get_level_values('bom_no'),
+                'Model': stats.index.get_level_values('machine_model'),
+                'Operation': operation if isinstance(operation, str) else operation.to_numpy(),
+                'Optn_Code': optn_code if isinstance(optn_code, str) else optn_code.to_numpy(),
+                'Wire Per Hour': stats['mean'].round(2).to_numpy(),
+                'Wire_Per_Unit': np.round(wire_per_unit, 2),
+                'UPH': np.round(efficiency, 3),
+                'Data_Points': stats['size'].to_numpy(),
+                'Original_Count': [d['original_count'] for d in outlier_data],
+                'Outliers_Removed': [d['removed_count'] for d in outlier_data],
+            })
+            for i, row in results.head(5).iterrows():
+                print(f"🔍 Processing group {i+1}/{len(results)}: BOM={row['BOM']}, Model={row['Model']}")
+                print(f"   📈 Mean UPH: {stats['mean'].iloc[i]:.2f}, Count: {row['Data_Points']}")
+                print(f"   🔌 Wire Per Unit: {wire_per_unit[i]:.2f}")
+            if results.empty:
                 print(f"❌ No results generated")
                 return None
-            self.efficiency_df = pd.DataFrame(results)
+            self.efficiency_df = results
             print(f"✅ Efficiency calculation completed. Generated {len(self.efficiency_df)} results")
+            report_progress("done", "Efficiency calculation completed", rows=len(cleaned_data), groups_done=len(self.efficiency_df), groups_total=len(self.efficiency_df))
             return self.efficiency_df
         except Exception as e:
             print(f"❌ Error in calculate_efficiency: {e}")
@@ -409,7 +404,7 @@ class WireBondingAnalyzer:
             print(f"📝 Starting Excel export...")
             
             try:
-                with pd.ExcelWriter(file_path, engine='openpyxl') as writer:
+                with excel_writer(file_path) as writer:
                     # Sheet 1: ผลลัพธ์ UPH
                     print(f"✏️ Writing UPH_Results sheet...")
                     self.efficiency_df.to_excel(
@@ -448,16 +443,16 @@ class WireBondingAnalyzer:
                         
             except Exception as excel_error:
                 print(f"❌ Excel export error: {excel_error}")
-                print(f"🔄 Trying alternative method with xlsxwriter...")
+                print(f"🔄 Trying alternative method with openpyxl...")
                 
-                # ลองใช้ xlsxwriter แทน
+                # ลองใช้ openpyxl แทน
                 try:
-                    with pd.ExcelWriter(file_path, engine='xlsxwriter') as writer:
+                    with pd.ExcelWriter(file_path, engine='openpyxl') as writer:
                         self.efficiency_df.to_excel(
                             writer, sheet_name='UPH_Results', index=False)
-                    print(f"✅ Excel file created with xlsxwriter")
-                except Exception as xlsxwriter_error:
-                    print(f"❌ xlsxwriter also failed: {xlsxwriter_error}")
+                    print(f"✅ Excel file created with openpyxl")
+                except Exception as openpyxl_error:
+                    print(f"❌ openpyxl also failed: {openpyxl_error}")
                     return False
             
             # ตรวจสอบว่าไฟล์ถูกสร้างจริงและมีขนาดมากกว่า 0
@@ -876,6 +871,8 @@ def run(input_dir, output_dir, uph_filename=None, wire_filename=None, **kwargs):
             raise Exception(f"ไฟล์ผลลัพธ์ว่างเปล่า: {output_path}")
         print(f"✅ WB_AUTO_UPH completed successfully!")
         print(f"📄 Output file: {output_path} (size: {file_size} bytes)")
+        if kwargs.get('return_data'):
+            return output_path, analyzer.efficiency_df
         return output_path
     except Exception as e:
         print(f"❌ WB_AUTO_UPH failed: {str(e)}")
@@ -888,6 +885,7 @@ def WB_AUTO_UPH(input_path, output_dir, start_date=None, end_date=None):
     """
     WB_AUTO_UPH function สำหรับเรียกใช้ผ่าน workflow ปกติ
     รองรับการรับไฟล์จากโฟลเดอร์ data_WB, data_MAP หรือ list ของไฟล์ UPH
+    คืน (path ของไฟล์ผลลัพธ์ หรือ list ของ path, DataFrame ผลลัพธ์ที่ตรงกับไฟล์ผลลัพธ์บนดิสก์)
     """
     try:
 
@@ -899,13 +897,17 @@ def WB_AUTO_UPH(input_path, output_dir, start_date=None, end_date=None):
             if not files:
                 raise Exception("ไม่พบไฟล์ใน list")
             result_paths = []
+            result_frames = []
             for f in files:
                 input_dir = os.path.dirname(f)
                 uph_filename = os.path.basename(f)
-                result_path = run(input_dir, output_dir, uph_filename=uph_filename, start_date=start_date, end_date=end_date)
+                result_path, result_df = run(input_dir, output_dir, uph_filename=uph_filename, start_date=start_date, end_date=end_date, return_data=True)
                 result_paths.append(result_path)
+                result_frames.append(result_df)
             print(f"WB_AUTO_UPH completed. Output: {result_paths}")
-            return result_paths[0] if len(result_paths) == 1 else result_paths
+            # ทุกไฟล์เขียนทับ WB_AUTO_UPH_RESULT.xlsx เดียวกัน ไฟล์บนดิสก์ (ที่ดาวน์โหลด) จึงเป็นผลของไฟล์สุดท้าย
+            # คืน DataFrame ของไฟล์สุดท้ายเพื่อให้หน้าแสดงผลตรงกับไฟล์ที่ดาวน์โหลด
+            return (result_paths[0] if len(result_paths) == 1 else result_paths), result_frames[-1]
 
         # 2. If input_path is a directory, raise an error (do not select any file automatically)
         if isinstance(input_path, str) and os.path.isdir(input_path):
@@ -915,9 +917,9 @@ def WB_AUTO_UPH(input_path, output_dir, start_date=None, end_date=None):
         if os.path.isfile(input_path):
             input_dir = os.path.dirname(input_path)
             uph_filename = os.path.basename(input_path)
-            result_path = run(input_dir, output_dir, uph_filename=uph_filename, start_date=start_date, end_date=end_date)
+            result_path, result_df = run(input_dir, output_dir, uph_filename=uph_filename, start_date=start_date, end_date=end_date, return_data=True)
             print(f"WB_AUTO_UPH completed. Output: {result_path}")
-            return result_path
+            return result_path, result_df
         else:
             raise Exception("input_path ไม่ถูกต้อง: กรุณาระบุไฟล์หรือ list ของไฟล์เท่านั้น")
 
@@ -10,13 +10,31 @@ import matplotlib.pyplot as plt
 import io
 import base64
 
-def load_data_from_source(source):
+from services.progress import report_progress
+from services.input_cache import read_excel_cached, read_csv_cached
+from services.outlier_engine import remove_outliers_grouped, attach_group_summary
+from services.parallel import parallel_map, resolve_workers
+from services.exports import write_excel, save_deferred
+from services.date_metadata import get_date_stats
+from services.api_client import get_api_client
+
+# ตั้งจำนวน worker สำหรับโหลดหลายไฟล์/ตัด outliers แบบขนานผ่าน env นี้ (1 = ปิดโหมดขนาน)
+DA_WORKERS_ENV = "DA_MAX_WORKERS"
+# ข้อมูลที่น้อยกว่านี้ตัด outliers ใน process เดียวเร็วกว่าการส่งข้อมูลไปหลาย process
+PARALLEL_MIN_ROWS = 200000
+
+def load_data_from_source(source, max_workers=None):
     """
     โหลดข้อมูลจากแหล่งต่างๆ (Excel, JSON file, JSON API)
+    ถ้า source เป็น list จะโหลดแต่ละไฟล์พร้อมกันใน process pool แล้วต่อกันตามลำดับเดิม
     """
     # รองรับทั้งกรณี source เป็น list หรือ str
     if isinstance(source, list):
-        df_list = [load_data_from_source(s) for s in source]
+        workers = resolve_workers(max_workers, DA_WORKERS_ENV)
+        df_list = parallel_map(
+            load_data_from_source, source, workers,
+            on_result=lambda i, total: report_progress("load", f"โหลดไฟล์ {i}/{total}", groups_done=i, groups_total=total),
+        )
         return pd.concat(df_list, ignore_index=True)
     
     try:
@@ -26,7 +44,7 @@ def load_data_from_source(source):
         
         if is_url:
             print(f"📡 กำลังเรียกข้อมูลจาก API: {source}")
-            response = requests.get(source, timeout=30)
+            response = get_api_client().get(source, timeout=30)
             response.raise_for_status()
             
             # ตรวจสอบ Content-Type
@@ -50,7 +68,7 @@ def load_data_from_source(source):
             
             if file_ext in ['.xlsx', '.xls']:
                 print(f"📄 กำลังโหลดไฟล์ Excel: {source}")
-                df = pd.read_excel(source)
+                df = read_excel_cached(source)
                 print(f"✅ โหลดไฟล์ Excel สำเร็จ: {len(df)} แถว")
                 
             elif file_ext == '.json':
@@ -62,7 +80,7 @@ def load_data_from_source(source):
                 
             elif file_ext == '.csv':
                 print(f"📄 กำลังโหลดไฟล์ CSV: {source}")
-                df = pd.read_csv(source)
+                df = read_csv_cached(source)
                 print(f"✅ โหลดไฟล์ CSV สำเร็จ: {len(df)} แถว")
                 
             else:
@@ -155,7 +173,7 @@ def load_data_with_config(source, config=None):
             if 'auth' in config:
                 request_params['auth'] = tuple(config['auth'])
             
-            response = requests.get(source, **request_params)
+            response = get_api_client().get(source, **request_params)
             response.raise_for_status()
             
             json_data = response.json()
@@ -256,12 +274,11 @@ def remove_outliers_auto(df_model, max_iter=20):
     current_df['Wire Per Hour'] = 1  # แก้ไข: เพิ่มการกำหนดค่า
     return current_df
 
-def remove_outliers(df):
-    """ตัด outliers ตามกลุ่ม BOM และ Machine Model และเพิ่มคอลัมน์จำนวนข้อมูลก่อน/หลังตัด"""
+def find_group_columns(df):
+    """หาชื่อคอลัมน์ bom_no และ Machine Model ที่ใช้แบ่งกลุ่ม"""
     col_map = {col.lower(): col for col in df.columns}
     
     # หาคอลัมน์ Machine Model
-    model_col = None
     if 'machine model' in col_map:
         model_col = col_map['machine model']
     elif 'machine_model' in col_map:
@@ -270,26 +287,63 @@ def remove_outliers(df):
         raise KeyError("ไม่พบคอลัมน์ Machine Model หรือ Machine_Model ในข้อมูล")
     
     # หาคอลัมน์ bom_no
-    bom_col = None
     if 'bom_no' in col_map:
         bom_col = col_map['bom_no']
     elif 'bom no' in col_map:
         bom_col = col_map['bom no']
     else:
         raise KeyError("ไม่พบคอลัมน์ bom_no ในข้อมูล")
+    return bom_col, model_col
+
+def remove_outliers(df):
+    """ตัด outliers ตามกลุ่ม BOM และ Machine Model และเพิ่มคอลัมน์จำนวนข้อมูลก่อน/หลังตัด"""
+    col_map = {col.lower(): col for col in df.columns}
+    bom_col, model_col = find_group_columns(df)
     
-    result_dfs = []
+    # หาคอลัมน์ UPH
+    if 'uph' not in col_map:
+        raise KeyError("ไม่พบคอลัมน์ UPH ในข้อมูล")
+    uph_col = col_map['uph']
     
-    for (bom_no, machine_model), group_df in df.groupby([bom_col, model_col]):
-        before_count = len(group_df)
-        cleaned_group = remove_outliers_auto(group_df)
-        after_count = len(cleaned_group)
-        # เพิ่มคอลัมน์ใหม่
-        cleaned_group['DataPoints_Before'] = before_count
-        cleaned_group['DataPoints_After'] = after_count
-        result_dfs.append(cleaned_group)
+    # ตัด outliers ทุกกลุ่มพร้อมกันแบบ vectorized (ผลลัพธ์เหมือน remove_outliers_auto ทีละกลุ่ม)
+    group_cols = [bom_col, model_col]
+    keep, summary = remove_outliers_grouped(df, uph_col, group_cols, variant="chained")
+    cleaned = attach_group_summary(df, keep, summary, group_cols,
+                                   ['Outlier_Method', 'DataPoints_Before', 'DataPoints_After'])
+    cleaned[uph_col] = pd.to_numeric(cleaned[uph_col], errors='coerce')
+    cleaned['Wire Per Hour'] = 1
     
-    return pd.concat(result_dfs, ignore_index=True)
+    # เรียงคอลัมน์ให้ DataPoints_Before/After อยู่ท้ายสุดเหมือนเดิม
+    count_cols = ['DataPoints_Before', 'DataPoints_After']
+    cleaned = cleaned[[c for c in cleaned.columns if c not in count_cols] + count_cols]
+    return cleaned.reset_index(drop=True)
+
+def remove_outliers_parallel(df, max_workers=None, min_rows=PARALLEL_MIN_ROWS):
+    """
+    ตัด outliers แบบแบ่งกลุ่ม BOM/Machine Model เป็นชิ้น (shard) ให้แต่ละ core ทำ
+    - shard เป็นช่วงกลุ่มที่ต่อเนื่องกันตามลำดับ groupby และมีจำนวนแถวใกล้เคียงกัน
+    - ต่อผลลัพธ์ตามลำดับ shard จึงได้ผลเหมือน remove_outliers ทุกประการ
+    """
+    workers = resolve_workers(max_workers, DA_WORKERS_ENV)
+    if workers <= 1 or len(df) < min_rows:
+        return remove_outliers(df)
+    
+    group_ids = df.groupby(list(find_group_columns(df)), sort=True).ngroup().to_numpy()
+    sizes = np.bincount(group_ids[group_ids >= 0])
+    if len(sizes) < 2:
+        return remove_outliers(df)
+    # กำหนด shard ให้แต่ละกลุ่มจากสัดส่วนแถวสะสม
+    rows_before = np.cumsum(sizes) - sizes
+    group_shard = (rows_before * workers) // sizes.sum()
+    row_shard = np.where(group_ids >= 0, group_shard[np.maximum(group_ids, 0)], -1)
+    shards = [df[row_shard == i] for i in np.unique(group_shard)]
+    print(f"⚙️ ตัด outliers แบบขนาน: {len(sizes)} กลุ่ม แบ่งเป็น {len(shards)} ส่วน ({workers} workers)")
+    
+    results = parallel_map(
+        remove_outliers, shards, workers,
+        on_result=lambda i, total: report_progress("outliers", f"ตัด outliers ส่วนที่ {i}/{total}", rows=len(df), groups_done=i, groups_total=total),
+    )
+    return pd.concat(results, ignore_index=True)
 
 def time_series_analysis(df):
     """แปลงข้อมูลวันที่ให้อยู่ในรูปแบบที่ใช้งานได้"""
@@ -384,39 +438,50 @@ def calculate_group_average(df, start_date, end_date):
     print(grouped_average)
     return grouped_average
 
-def save_results(df_cleaned, grouped_average, start_date, end_date, output_dir):
-    """บันทึกผลลัพธ์ลงไฟล์"""
+def save_results(df_cleaned, grouped_average, start_date, end_date, output_dir, defer_cleaned=None):
+    """
+    บันทึกผลลัพธ์ลงไฟล์ คืน (path ข้อมูลที่ตัด outliers แล้ว, path ไฟล์ค่าเฉลี่ย)
+    defer_cleaned: เก็บข้อมูลที่ตัด outliers แล้วเป็น Parquet แล้วค่อยสร้าง Excel ตอนดาวน์โหลด
+                   (None = ใช้ env DA_DEFER_CLEANED_EXCEL, ค่าเริ่มต้นเปิด)
+    """
+    if defer_cleaned is None:
+        defer_cleaned = os.environ.get("DA_DEFER_CLEANED_EXCEL", "1") != "0"
     os.makedirs(output_dir, exist_ok=True)
     
     # สร้างชื่อไฟล์ด้วยวันที่และเวลา
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
     date_range = f"{start_date.replace('/', '')}_to_{end_date.replace('/', '')}"
     
-    # บันทึกข้อมูลที่ตัด outliers แล้ว
-    cleaned_file = os.path.join(output_dir, f"cleaned_data_{date_range}_{timestamp}.xlsx")
-    df_cleaned.to_excel(cleaned_file, index=False)
-    print(f"บันทึกข้อมูลที่ตัด outliers แล้ว: {cleaned_file}")
-    
-    # บันทึกค่าเฉลี่ยตามกลุ่ม
+    # บันทึกค่าเฉลี่ยตามกลุ่มก่อน (ไฟล์เล็กที่ใช้แสดงผล)
     average_file = os.path.join(output_dir, f"group_average_{date_range}_{timestamp}.xlsx")
-    grouped_average.to_excel(average_file, index=False)
+    write_excel(grouped_average, average_file)
     print(f"บันทึกค่าเฉลี่ยตามกลุ่ม: {average_file}")
     
+    # บันทึกข้อมูลที่ตัด outliers แล้ว
+    cleaned_base = os.path.join(output_dir, f"cleaned_data_{date_range}_{timestamp}")
+    if defer_cleaned:
+        cleaned_file = save_deferred(df_cleaned, cleaned_base)
+    else:
+        cleaned_file = write_excel(df_cleaned, f"{cleaned_base}.xlsx")
+    print(f"บันทึกข้อมูลที่ตัด outliers แล้ว: {cleaned_file}")
+    
     return cleaned_file, average_file
 
-def process_die_attack_data(source):
+def process_die_attack_data(source, max_workers=None):
     """ประมวลผลข้อมูล Die Attack - รองรับ JSON API"""
     print("=== เริ่มต้นการประมวลผลข้อมูล Die Attack ===")
     
     # อ่านข้อมูลจากแหล่งต่างๆ
     try:
-        df = load_data_from_source(source)
+        df = load_data_from_source(source, max_workers)
         print(f"ข้อมูลเริ่มต้น: {len(df)} แถว")
+        report_progress("load", "โหลดข้อมูลเสร็จ", rows=len(df))
     except Exception as e:
         raise Exception(f"ไม่สามารถโหลดข้อมูลได้: {str(e)}")
     
     # ขั้นตอนที่ 1: แปลงข้อมูลวันที่
     print("\n1. แปลงข้อมูลวันที่...")
+    report_progress("parse_dates", "1. แปลงข้อมูลวันที่...", rows=len(df))
     df = time_series_analysis(df)
     
     # ขั้นตอนที่ 2: ใช้ช่วงวันที่ทั้งหมด (อัตโนมัติ)
@@ -425,6 +490,7 @@ def process_die_attack_data(source):
     
     # ขั้นตอนที่ 3: กรองข้อมูลตามวันที่
     print("\n3. กรองข้อมูลตามวันที่...")
+    report_progress("filter_dates", "3. กรองข้อมูลตามวันที่...", rows=len(df))
     df_filtered = filter_data_by_date(df, start_date, end_date)
     
     if df_filtered is None:
@@ -432,34 +498,39 @@ def process_die_attack_data(source):
     
     # ขั้นตอนที่ 4: ตัด outliers
     print("\n4. ตัด outliers...")
-    df_cleaned = remove_outliers(df_filtered)
+    report_progress("outliers", "4. ตัด outliers...", rows=len(df_filtered))
+    df_cleaned = remove_outliers_parallel(df_filtered, max_workers)
     df_cleaned = df_cleaned.reset_index(drop=True)
     
     print(f"ข้อมูลหลังตัด outliers: {len(df_cleaned)} แถว")
     
     # ขั้นตอนที่ 5: คำนวณค่าเฉลี่ยตามกลุ่ม
     print("\n5. คำนวณค่าเฉลี่ยตามกลุ่ม...")
+    report_progress("group_average", "5. คำนวณค่าเฉลี่ยตามกลุ่ม...", rows=len(df_cleaned))
     grouped_average = calculate_group_average(df_cleaned, start_date, end_date)
     
     print("\n=== การประมวลผลเสร็จสิ้น ===")
+    report_progress("done", "การประมวลผลเสร็จสิ้น", rows=len(df_cleaned), groups_done=len(grouped_average), groups_total=len(grouped_average))
     print(f"ข้อมูลสุดท้าย: {len(df_cleaned)} แถว")
     print(f"จำนวนกลุ่ม: {len(grouped_average)} กลุ่ม")
     
     return df_cleaned, grouped_average, start_date, end_date
 
-def process_die_attack_data_with_date_range(file_path, start_date, end_date):
+def process_die_attack_data_with_date_range(file_path, start_date, end_date, max_workers=None):
     """ประมวลผลข้อมูล Die Attack ด้วยช่วงวันที่ที่กำหนด"""
     print("=== เริ่มต้นการประมวลผลข้อมูล Die Attack (ช่วงวันที่กำหนด) ===")
     
     # อ่านข้อมูลจากแหล่งต่างๆ (รองรับ Excel, CSV, JSON, API)
     try:
-        df = load_data_from_source(file_path)
+        df = load_data_from_source(file_path, max_workers)
         print(f"ข้อมูลเริ่มต้น: {len(df)} แถว")
+        report_progress("load", "โหลดข้อมูลเสร็จ", rows=len(df))
     except Exception as e:
         raise Exception(f"ไม่สามารถโหลดข้อมูลได้: {str(e)}")
     
     # ขั้นตอนที่ 1: แปลงข้อมูลวันที่
     print("\n1. แปลงข้อมูลวันที่...")
+    report_progress("parse_dates", "1. แปลงข้อมูลวันที่...", rows=len(df))
     df = time_series_analysis(df)
     
     # ขั้นตอนที่ 2: แปลงวันที่จาก YYYY-MM-DD เป็น YYYY/MM/DD
@@ -469,6 +540,7 @@ def process_die_attack_data_with_date_range(file_path, start_date, end_date):
     
     # ขั้นตอนที่ 3: กรองข้อมูลตามวันที่
     print("\n3. กรองข้อมูลตามวันที่...")
+    report_progress("filter_dates", "3. กรองข้อมูลตามวันที่...", rows=len(df))
     df_filtered = filter_data_by_date(df, formatted_start_date, formatted_end_date)
     
     if df_filtered is None:
@@ -476,16 +548,19 @@ def process_die_attack_data_with_date_range(file_path, start_date, end_date):
     
     # ขั้นตอนที่ 4: ตัด outliers
     print("\n4. ตัด outliers...")
-    df_cleaned = remove_outliers(df_filtered)
+    report_progress("outliers", "4. ตัด outliers...", rows=len(df_filtered))
+    df_cleaned = remove_outliers_parallel(df_filtered, max_workers)
     df_cleaned = df_cleaned.reset_index(drop=True)
     
     print(f"ข้อมูลหลังตัด outliers: {len(df_cleaned)} แถว")
     
     # ขั้นตอนที่ 5: คำนวณค่าเฉลี่ยตามกลุ่ม
     print("\n5. คำนวณค่าเฉลี่ยตามกลุ่ม...")
+    report_progress("group_average", "5. คำนวณค่าเฉลี่ยตามกลุ่ม...", rows=len(df_cleaned))
     grouped_average = calculate_group_average(df_cleaned, formatted_start_date, formatted_end_date)
     
     print("\n=== การประมวลผลเสร็จสิ้น ===")
+    report_progress("done", "การประมวลผลเสร็จสิ้น", rows=len(df_cleaned), groups_done=len(grouped_average), groups_total=len(grouped_average))
     print(f"ข้อมูลสุดท้าย: {len(df_cleaned)} แถว")
     print(f"จำนวนกลุ่ม: {len(grouped_average)} กลุ่ม")
     
@@ -493,98 +568,56 @@ def process_die_attack_data_with_date_range(file_path, start_date, end_date):
 
 
 def preview_date_range(file_path):
-    """แสดงข้อมูลวันที่ในไฟล์ก่อนประมวลผล"""
+    """แสดงข้อมูลวันที่ในไฟล์ก่อนประมวลผล (อ่านจาก sidecar index ถ้าไฟล์ไม่เปลี่ยน)"""
     try:
         print("📅 กำลังตรวจสอบช่วงวันที่ในไฟล์...")
-        
-        # อ่านไฟล์ข้อมูล
-        ext = os.path.splitext(file_path)[-1].lower()
-        if ext in [".xlsx", ".xls"]:
-            df = pd.read_excel(file_path, engine="openpyxl")
-        elif ext == ".csv":
-            df = pd.read_csv(file_path)
-        elif ext == ".json":
-            df = pd.read_json(file_path)
-        else:
-            raise ValueError("ไม่รองรับไฟล์ประเภทนี้")
-        print(f"📄 ไฟล์มีข้อมูลทั้งหมด: {len(df):,} แถว")
-        
-        # หาคอลัมน์วันที่
-        date_cols = []
-        for col_name in df.columns:
-            if any(keyword in col_name.lower() for keyword in ['date', 'time', 'วัน', 'เวลา']):
-                date_cols.append(col_name)
-        
-        if not date_cols:
-            print("⚠️ ไม่พบคอลัมน์วันที่ในข้อมูล")
+        info = get_date_stats(file_path)
+        if info is None:
+            print("⚠️ ไม่พบคอลัมน์วันที่หรือข้อมูลวันที่ที่ถูกต้องในไฟล์")
             return None
         
-        date_col = date_cols[0]
-        print(f"🗓️ ใช้คอลัมน์วันที่: '{date_col}'")
-        
-        # แปลงข้อมูลวันที่
-        df['temp_date'] = pd.to_datetime(df[date_col], errors='coerce')
-        
-        # กรองข้อมูลที่แปลงวันที่ได้
-        valid_dates = df.dropna(subset=['temp_date'])
-        invalid_count = len(df) - len(valid_dates)
-        
-        if len(valid_dates) == 0:
-            print("❌ ไม่มีข้อมูลวันที่ที่ถูกต้องในไฟล์")
-            return None
-        
-        # หาวันที่เริ่มต้นและสิ้นสุด
-        min_date = valid_dates['temp_date'].min()
-        max_date = valid_dates['temp_date'].max()
-        
-        # แสดงผลลัพธ์
+        print(f"🗓️ ใช้คอลัมน์วันที่: '{info['date_column']}'")
         print(f"\n📊 สรุปข้อมูลวันที่:")
-        print(f"  🗓️ วันที่เริ่มต้น: {min_date.strftime('%Y-%m-%d')} (ค.ศ.)")
-        print(f"  🗓️ วันที่สิ้นสุด: {max_date.strftime('%Y-%m-%d')} (ค.ศ.)")
-        print(f"  📈 จำนวนวัน: {(max_date - min_date).days + 1} วัน")
-        print(f"  ✅ ข้อมูลวันที่ถูกต้อง: {len(valid_dates):,} แถว")
+        print(f"  🗓️ วันที่เริ่มต้น: {info['min_date']} (ค.ศ.)")
+        print(f"  🗓️ วันที่สิ้นสุด: {info['max_date']} (ค.ศ.)")
+        print(f"  📈 จำนวนวัน: {info['total_days']} วัน")
+        print(f"  ✅ ข้อมูลวันที่ถูกต้อง: {info['valid_records']:,} แถว")
         
-        if invalid_count > 0:
-            print(f"  ⚠️ ข้อมูลวันที่ไม่ถูกต้อง: {invalid_count:,} แถว")
+        if info['invalid_records'] > 0:
+            print(f"  ⚠️ ข้อมูลวันที่ไม่ถูกต้อง: {info['invalid_records']:,} แถว")
         
         # แสดงตัวอย่างข้อมูลตามช่วงเวลา
+        monthly_counts = list(info['monthly_distribution'].items())
         print(f"\n📋 การกระจายข้อมูลตามเดือน:")
-        monthly_counts = valid_dates.groupby(valid_dates['temp_date'].dt.to_period('M')).size()
-        for period, count in monthly_counts.head(10).items():
+        for period, count in monthly_counts[:10]:
             print(f"  📅 {period}: {count:,} แถว")
         
         if len(monthly_counts) > 10:
             print(f"  ... และอีก {len(monthly_counts) - 10} เดือน")
         
-        return {
-            'min_date': min_date.strftime('%Y-%m-%d'),
-            'max_date': max_date.strftime('%Y-%m-%d'),
-            'total_days': (max_date - min_date).days + 1,
-            'valid_records': len(valid_dates),
-            'invalid_records': invalid_count,
-            'date_column': date_col,
-            'monthly_distribution': {str(period): count for period, count in monthly_counts.to_dict().items()}
-        }
+        return info
         
     except Exception as e:
         print(f"❌ เกิดข้อผิดพลาดในการตรวจสอบวันที่: {str(e)}")
         return None
 
-def DA_AUTO_UPH(file_path, temp_root, start_date=None, end_date=None):
+def DA_AUTO_UPH(file_path, temp_root, start_date=None, end_date=None, max_workers=None):
     try:
         if start_date and end_date:
             start_date_fmt = start_date.replace("-", "/")
             end_date_fmt = end_date.replace("-", "/")
-            df_cleaned, grouped_average, used_start_date, used_end_date = process_die_attack_data_with_date_range(file_path, start_date_fmt, end_date_fmt)
+            df_cleaned, grouped_average, used_start_date, used_end_date = process_die_attack_data_with_date_range(file_path, start_date_fmt, end_date_fmt, max_workers)
         else:
-            df_cleaned, grouped_average, used_start_date, used_end_date = process_die_attack_data(file_path)
+            df_cleaned, grouped_average, used_start_date, used_end_date = process_die_attack_data(file_path, max_workers)
         cleaned_file, average_file = save_results(df_cleaned, grouped_average, used_start_date, used_end_date, temp_root)
         print("DEBUG: average_file path =", average_file)
         print(f"✅ ช่วงวันที่ที่ประมวลผลจริง: {used_start_date} ถึง {used_end_date}")
         if not os.path.exists(average_file):
             print("❌ ไม่พบไฟล์ average_file:", average_file)
             return None
-        return average_file
+        # คืน DataFrame ที่เพิ่งบันทึกไปด้วย เพื่อให้หน้าแสดงผลไม่ต้องอ่าน Excel กลับมา
+        # และ cleaned_data ให้ดาวน์โหลดเป็น xlsx/csv/parquet ได้ภายหลัง
+        return average_file, grouped_average, {"cleaned_data": cleaned_file}
     except Exception as e:
         print(f"❌ DA_AUTO_UPH error: {e}")
         return None
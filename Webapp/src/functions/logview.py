@@ -5,8 +5,14 @@ import numpy as np
 from pathlib import Path
 import time
 from datetime import datetime  
-import tempfile
-import shutil
+import re
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+
+from services.progress import report_progress
+from services.input_cache import read_excel_cached
+from services.reference_data import get_reference
+from services.parallel import parallel_map, resolve_workers
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 
@@ -24,98 +30,150 @@ def find_input_files(input_pattern: str):
         files = list(set(os.path.abspath(f) for f in files))
     else:
         files = glob.glob(input_pattern)
-    return files
+    # เรียงชื่อไฟล์เพื่อให้ลำดับการประมวลผลและผลลัพธ์เหมือนกันทุกครั้ง
+    return sorted(files)
+
+# ตั้งจำนวน worker สำหรับประมวลผลหลายไฟล์ log พร้อมกันผ่าน env นี้ (1 = ทีละไฟล์)
+LOGVIEW_WORKERS_ENV = "LOGVIEW_MAX_WORKERS"
+
+# step ที่ pipeline ใช้ (PRO/CUC สำหรับความเร็ว, ERR*/DMC/DMW สำหรับ MC error) แถวอื่นไม่ต้องเก็บ
+KEEP_STEPS = ('PRO', 'CUC', 'DMC', 'DMW')
+KEEP_STEP_PREFIX = 'ERR'
+# จำนวนตัวอักษรที่อ่านต่อครั้ง (จำกัด memory สำหรับ log ขนาดใหญ่)
+PARSE_CHUNK_CHARS = 32 * 1024 * 1024
+FRAME_PATTERN = r'(FU|FR|FA|FW|FN|FJ|F1|F2|F3|F4|F5|F6|F7|F8|F9|F0)(\w{4})'
+# บรรทัด "<timestamp>\t<step>\t<values>..." เฉพาะ step ที่ใช้ (หาใน C ทั้ง chunk ไม่ต้องวนทีละบรรทัด)
+LOG_LINE_RE = re.compile(
+    r'^[^\S\n]*([^\t\n]*)\t(' + '|'.join(KEEP_STEPS) + '|' + KEEP_STEP_PREFIX + r'[^\t\n]*)\t([^\n]*)$',
+    re.MULTILINE,
+)
+
+def _parse_log_chunk(text):
+    """แยก timestamp, step และค่าต่างๆ ของบรรทัดที่ต้องการใน text ชุดหนึ่งด้วย regex + vectorized string ops"""
+    matches = LOG_LINE_RE.findall(text)
+    if not matches:
+        return pd.DataFrame()
+    parts = pd.DataFrame(matches, columns=['timestamp', 'step', 'rest'])
+    # ตัดช่องว่างท้ายบรรทัด แล้วใช้เฉพาะช่องที่ 3 (ถ้าเหลือว่างแปลว่าบรรทัดมีไม่ถึง 3 ช่อง)
+    rest = parts['rest'].str.rstrip()
+    values = rest.str.split('\t', n=1).str[0]
+    # timestamp ต้องมีรูปแบบ "<date> <time>" (มีช่องว่างเดียว)
+    keep = (rest != '') & (parts['timestamp'].str.count(' ') == 1)
+    parts, values = parts[keep], values[keep]
+    if parts.empty:
+        return pd.DataFrame()
+    date_time = parts['timestamp'].str.split(' ', expand=True)
+    time_part = date_time[1].str.replace('AM', '', regex=False).str.replace('PM', '', regex=False).str.strip()
+    df = pd.DataFrame({'date': date_time[0], 'time': time_part, 'step': parts['step']})
+    return pd.concat([df, values.str.split(',', expand=True)], axis=1).reset_index(drop=True)
 
-def load_and_parse_file(input_file: str) -> pd.DataFrame:
+def load_and_parse_file(input_file: str, chunk_chars: int = PARSE_CHUNK_CHARS) -> pd.DataFrame:
+    """
+    อ่านไฟล์ log (tab-separated) ทีละ chunk และเก็บเฉพาะ step ที่ใช้ (PRO, CUC, ERR*, DMC, DMW)
+    คอลัมน์: date, time, step, frame, G, No_strip, value_1.. (ค่าที่ไม่มีเป็น '')
+    """
+    chunks = []
     try:
         with open(input_file, 'r', encoding='latin-1') as file:
-            lines = file.readlines()
+            while True:
+                # อ่านต่อจนจบบรรทัดเพื่อไม่ให้บรรทัดถูกตัดกลาง chunk
+                text = file.read(chunk_chars)
+                if not text:
+                    break
+                text += file.readline()
+                parsed = _parse_log_chunk(text)
+                if not parsed.empty:
+                    chunks.append(parsed)
     except Exception as e:
         print(f"Error reading {input_file}: {e}")
         return pd.DataFrame()
-    rows = []
-    max_values_len = 0
-    for line in lines:
-        parts = line.strip().split('\t')
-        if len(parts) < 3:
-            continue
-        timestamp, data_type, data_values = parts[0], parts[1], parts[2]
-        try:
-            date_part, time_part = timestamp.split(' ')
-            time_part = time_part.replace('AM', '').replace('PM', '').strip()
-        except ValueError:
-            continue
-        values = data_values.split(',')
-        if len(values) > max_values_len:
-            max_values_len = len(values)
-        row = [date_part, time_part, data_type] + values
-        rows.append(row)
-    if not rows:
+    if not chunks:
         return pd.DataFrame()
-    max_len = 6 + max_values_len
-    for row in rows:
-        row += [''] * (max_len - len(row))
+    df = pd.concat(chunks, ignore_index=True)
+    max_values_len = max(col for col in df.columns if isinstance(col, int)) + 1
+    # ค่าลำดับที่ 1-3 คือ frame, G, No_strip ที่เหลือเป็น value_1.. (เติม '' ให้ครบ max_values_len)
     columns = ['date', 'time', 'step', 'frame', 'G', 'No_strip'] + [f'value_{i}' for i in range(1, max_values_len + 1)]
-    df = pd.DataFrame(rows, columns=columns)
-    pattern = r'(FU|FR|FA|FW|FN|FJ|F1|F2|F3|F4|F5|F6|F7|F8|F9|F0)(\w{4})'
-    df['frame'] = df['frame'].astype(str)
-    df['frame'] = df['frame'].str.extract(pattern).fillna('').agg(''.join, axis=1)
+    df = df.rename(columns=dict(zip(range(max_values_len), columns[3:])))
+    for col in columns:
+        if col not in df.columns:
+            df[col] = ''
+    df = df[columns].fillna('')
+    frame = df['frame'].astype(str).str.extract(FRAME_PATTERN)
+    df['frame'] = frame[0].fillna('') + frame[1].fillna('')
     return df
 
 def extract_pro_and_speed(df: pd.DataFrame) -> pd.DataFrame:
     if df.empty:
         return pd.DataFrame()
-    df_pro = df[df['step'] == 'PRO'].copy()
+    is_pro = (df['step'] == 'PRO').to_numpy()
+    df_pro = df[is_pro].copy()
     if df_pro.empty:
         return pd.DataFrame()
-    df_pro['speed'] = None
-    for idx in df_pro.index:
-        speed_value = None
-        pos = df.index.get_loc(idx)
-        for j in range(pos + 1, len(df)):
-            if df.loc[df.index[j], 'step'] == 'CUC':
-                if 'value_5' in df.columns and len(df.columns) > df.columns.get_loc('value_5'):
-                    speed_value = df.loc[df.index[j], 'value_5']
-                break
-        df_pro.at[idx, 'speed'] = speed_value
-    df_pro['speed'] = pd.to_numeric(df_pro['speed'], errors='coerce')
-    df_pro['speed'] = df_pro['speed'] / 10 / 25.4
-    df_pro['speed'] = df_pro['speed'].apply(lambda x: int(x) if x % 1 == 0 else round(x, 2))
+    # speed ของ PRO แต่ละแถว = value_5 ของ CUC แถวถัดไปแถวแรก (หาด้วย searchsorted ทีเดียว)
+    speed = pd.Series(np.nan, index=df_pro.index, dtype=object)
+    if 'value_5' in df.columns:
+        cuc_positions = np.flatnonzero((df['step'] == 'CUC').to_numpy())
+        next_cuc = np.searchsorted(cuc_positions, np.flatnonzero(is_pro), side='right')
+        found = next_cuc < len(cuc_positions)
+        cuc_values = df['value_5'].to_numpy()[cuc_positions]
+        speed[found] = cuc_values[next_cuc[found]]
+    speed = pd.to_numeric(speed, errors='coerce') / 10 / 25.4
+    # ค่าที่เป็นจำนวนเต็มเก็บเป็น int ที่เหลือปัด 2 ตำแหน่ง
+    df_pro['speed'] = speed.where(speed % 1 == 0, speed.round(2))
+    if df_pro['speed'].notna().all() and (df_pro['speed'] % 1 == 0).all():
+        df_pro['speed'] = df_pro['speed'].astype(np.int64)
     return df_pro
 
+ERROR_STEPS = ['ERRSET', 'ERRRCV', 'ERRCLR', 'DMC', 'DMW']
+
 def mark_errors(df: pd.DataFrame, df_pro: pd.DataFrame) -> pd.DataFrame:
     if df.empty or df_pro.empty:
         return df_pro
     df_pro['MC'] = None
-    pro_indices = df.index[df['step'] == 'PRO'].tolist()
-    for i in range(1, len(pro_indices)):
-        current_idx = pro_indices[i]
-        prev_idx = pro_indices[i - 1]
-        start_idx = min(prev_idx, current_idx)
-        end_idx = max(prev_idx, current_idx)
-        df_slice = df.loc[start_idx:end_idx]
-        error_steps = ['ERRSET', 'ERRRCV', 'ERRCLR', 'DMC', 'DMW']
-        has_error = df_slice['step'].isin(error_steps).any()
-        if has_error and prev_idx in df_pro.index:
-            df_pro.at[prev_idx, 'MC'] = 'MC error'
+    # แบ่ง log เป็นช่วงตาม PRO (segment k = PRO แถวที่ k ถึงก่อน PRO ถัดไป) แล้วเช็ค error ทีละช่วงพร้อมกัน
+    is_pro = (df['step'] == 'PRO').to_numpy()
+    segment = np.cumsum(is_pro)
+    n_pro = int(segment[-1])
+    has_error = np.bincount(segment[df['step'].isin(ERROR_STEPS).to_numpy()], minlength=n_pro + 1) > 0
+    # PRO แถวสุดท้ายไม่มีช่วงถัดไปให้เทียบ จึงไม่ถูก mark
+    has_error[n_pro] = False
+    marked = df.index[is_pro][has_error[1:]]
+    df_pro.loc[df_pro.index.isin(marked), 'MC'] = 'MC error'
     return df_pro
 
+def _insert_separator_rows(df: pd.DataFrame, before=None, after=None, fill_none=False) -> pd.DataFrame:
+    """
+    แทรกแถวว่างก่อน (before) / หลัง (after) แถวที่ระบุ ด้วยการ reindex ครั้งเดียว
+    fill_none=True ให้คอลัมน์ object ของแถวว่างเป็น None แทน NaN
+    """
+    n = len(df)
+    before = np.zeros(n, dtype=bool) if before is None else np.asarray(before, dtype=bool)
+    after = np.zeros(n, dtype=bool) if after is None else np.asarray(after, dtype=bool)
+    # ตำแหน่งใหม่ของแต่ละแถว = ตำแหน่งเดิม + จำนวนแถวว่างที่แทรกไว้ก่อนหน้า
+    inserted = np.cumsum(before) + np.concatenate(([0], np.cumsum(after)[:-1]))
+    take = np.full(n + int(before.sum()) + int(after.sum()), -1)
+    take[np.arange(n) + inserted] = np.arange(n)
+    result = df.reset_index(drop=True).reindex(take).reset_index(drop=True)
+    if fill_none:
+        blank = take == -1
+        object_cols = [col for col in result.columns if result[col].dtype == object]
+        if blank.any() and object_cols:
+            result.loc[blank, object_cols] = None
+    return result
+
+def _is_first_strip(value):
+    try:
+        return float(value) == 1
+    except (ValueError, TypeError):
+        return False
+
 def insert_blank_rows(df_pro: pd.DataFrame) -> pd.DataFrame:
     if df_pro.empty:
         return df_pro
-    new_rows = []
-    for i in range(len(df_pro)):
-        row = df_pro.iloc[i]
-        new_rows.append(row)
-        try:
-            first_strip = float(row['No_strip']) == 1
-        except (ValueError, TypeError):
-            first_strip = False
-        if first_strip:
-            empty_row = pd.Series([None] * len(df_pro.columns), index=df_pro.columns)
-            new_rows.append(empty_row)
-    df_with_blank = pd.DataFrame(new_rows).reset_index(drop=True)
-    return df_with_blank
+    # แทรกแถวว่างหลังแถวที่ No_strip = 1 (แปลงค่าเฉพาะค่าที่ไม่ซ้ำ)
+    codes, uniques = pd.factorize(df_pro['No_strip'])
+    first_strip = np.array([_is_first_strip(value) for value in uniques] + [False])[codes]
+    return _insert_separator_rows(df_pro, after=first_strip, fill_none=True)
 
 def calculate_time_diff(df: pd.DataFrame) -> pd.DataFrame:
     if df.empty:
@@ -131,37 +189,21 @@ def calculate_time_diff(df: pd.DataFrame) -> pd.DataFrame:
     return df
 
 def assign_subgroups_and_insert_empty_rows(df, column_strip='No_strip', frame_group='frame'):
-    subgroup_id = 0
-    subgroups = []
-    prev_val = None
-    for val in df[column_strip]:
-        if pd.isna(val):
-            subgroups.append(np.nan)
-            prev_val = None
-            continue
-        if prev_val is None:
-            subgroup_id += 1
-        elif val > prev_val:
-            subgroup_id += 1
-        subgroups.append(subgroup_id)
-        prev_val = val
-    df['subgroup_id'] = subgroups
-    result_rows = []
-    subgroup_keys = df['subgroup_id'].dropna().unique()
-    for group in subgroup_keys:
-        group_df = df[df['subgroup_id'] == group].reset_index(drop=True)
-        result_rows.append(group_df.iloc[[0]])
-        for i in range(1, len(group_df)):
-            prev_frame = group_df.loc[i - 1, frame_group]
-            curr_frame = group_df.loc[i, frame_group]
-            if prev_frame != curr_frame:
-                empty_row = pd.DataFrame({col: [np.nan] for col in df.columns})
-                result_rows.append(empty_row)
-            result_rows.append(group_df.iloc[[i]])
-        empty_row = pd.DataFrame({col: [np.nan] for col in df.columns})
-        result_rows.append(empty_row)
-    result_df = pd.concat(result_rows, ignore_index=True).reset_index(drop=True)
-    return result_df
+    # subgroup ใหม่เริ่มเมื่อ No_strip เพิ่มขึ้นจากแถวก่อน หรือแถวก่อนหน้าว่าง (NaN ไม่มี subgroup)
+    strip = df[column_strip]
+    prev_strip = strip.shift(1)
+    valid = strip.notna().to_numpy()
+    new_group = valid & (prev_strip.isna() | (strip > prev_strip)).to_numpy()
+    df['subgroup_id'] = np.where(valid, np.cumsum(new_group), np.nan)
+
+    # เก็บเฉพาะแถวที่มี subgroup แทรกแถวว่างเมื่อ frame เปลี่ยนภายใน subgroup และหลังจบแต่ละ subgroup
+    rows = df[valid]
+    subgroup = rows['subgroup_id'].to_numpy()
+    frame = rows[frame_group].to_numpy()
+    same_group = np.concatenate(([False], subgroup[1:] == subgroup[:-1]))
+    frame_changed = np.concatenate(([False], frame[1:] != frame[:-1]))
+    last_in_group = np.concatenate((subgroup[1:] != subgroup[:-1], [True]))
+    return _insert_separator_rows(rows, before=same_group & frame_changed, after=last_in_group)
 
 def mark_outlier_subgroups(df, subgroup_col='subgroup_id', no_strip_col='No_strip'):
     outlier_groups = []
@@ -175,27 +217,19 @@ def detect_outliers_combined(df, group_col='frame', value_col='seconds', no_stri
                              iqr_factor=1, zscore_threshold=2, min_diff_seconds=90):
     df['is_outlier'] = False
     df_filtered = df[~((df[no_strip_col] == 2) & (df[no_strip_col].shift(-1) == 1))]
-    for group_name, group in df_filtered.groupby(group_col):
-        values = group[value_col].dropna().values
-        if len(values) == 0:
-            continue
-        median = np.median(values)
-        q1 = np.percentile(values, 25)
-        q3 = np.percentile(values, 75)
-        iqr = q3 - q1
-        upper_bound = q3 + iqr_factor * iqr
-        mean = np.mean(values)
-        std = np.std(values)
-        for idx in group.index:
-            val = df.loc[idx, value_col]
-            if pd.isna(val):
-                continue
-            if val > upper_bound and abs(val - median) > min_diff_seconds:
-                df.at[idx, 'is_outlier'] = True
-            elif std > 0:
-                z_score = (val - mean) / std
-                if z_score > zscore_threshold and abs(val - mean) > min_diff_seconds:
-                    df.at[idx, 'is_outlier'] = True
+    # สถิติของแต่ละ frame (median, Q1, Q3, mean, std) คำนวณทีเดียวด้วย groupby-transform
+    grouped = df_filtered.groupby(group_col)[value_col]
+    median = grouped.transform('median')
+    q1 = grouped.transform('quantile', 0.25)
+    q3 = grouped.transform('quantile', 0.75)
+    mean = grouped.transform('mean')
+    std = grouped.transform('std', ddof=0)
+    upper_bound = q3 + iqr_factor * (q3 - q1)
+    values = df_filtered[value_col]
+    iqr_outlier = (values > upper_bound) & ((values - median).abs() > min_diff_seconds)
+    z_outlier = (std > 0) & ((values - mean) / std > zscore_threshold) & ((values - mean).abs() > min_diff_seconds)
+    is_outlier = iqr_outlier | z_outlier
+    df.loc[is_outlier.index[is_outlier.to_numpy()], 'is_outlier'] = True
     return df
 
 def add_avg_exclude_outliers_by_frame(
@@ -209,21 +243,23 @@ def add_avg_exclude_outliers_by_frame(
     df['avg_ex_outliers'] = pd.NA
     df['count_avg'] = pd.NA
     df['count_outliers'] = pd.NA
-    for frame_val in df[group_col].dropna().unique():
-        group_df = df[df[group_col] == frame_val]
-        good_values = group_df[(group_df[outlier_col] != True) & (group_df[outlier_subgroup_col] != True) & (group_df[outlier_mc] != 'MC error')][value_col].dropna()
-        if len(good_values) < 5:
-            continue
-        avg_val = good_values.mean()
-        count_avg_val = len(good_values)
-        count_all = group_df[value_col].count()
-        count_outliers = count_all - count_avg_val
-        idx = df[df[group_col] == frame_val].index
-        if len(idx) > 0:
-            first_idx = idx[0]
-            df.at[first_idx, 'avg_ex_outliers'] = round(avg_val, 2)
-            df.at[first_idx, 'count_avg'] = count_avg_val
-            df.at[first_idx, 'count_outliers'] = count_outliers
+    # ค่าที่ใช้หาค่าเฉลี่ย = ไม่ใช่ outlier, ไม่อยู่ใน subgroup ที่ผิดปกติ และไม่ใช่ MC error
+    good = (df[outlier_col] != True) & (df[outlier_subgroup_col] != True) & (df[outlier_mc] != 'MC error')
+    frames = df[group_col]
+    good_values = df[value_col].where(good)
+    stats = pd.DataFrame({
+        'avg': good_values.groupby(frames, sort=False).mean(),
+        'count_avg': good_values.groupby(frames, sort=False).count(),
+        'count_all': df[value_col].groupby(frames, sort=False).count(),
+        'first_idx': df.index.to_series().groupby(frames, sort=False).first(),
+    })
+    # frame ที่มีค่าดีน้อยกว่า 5 ค่าไม่คำนวณ ผลลัพธ์ใส่ไว้ที่แถวแรกของ frame
+    stats = stats[stats['count_avg'] >= 5]
+    if not stats.empty:
+        first_idx = stats['first_idx'].to_numpy()
+        df.loc[first_idx, 'avg_ex_outliers'] = stats['avg'].round(2).to_numpy()
+        df.loc[first_idx, 'count_avg'] = stats['count_avg'].to_numpy()
+        df.loc[first_idx, 'count_outliers'] = (stats['count_all'] - stats['count_avg']).to_numpy()
     return df
 
 def summarize_by_frame(df):
@@ -232,7 +268,87 @@ def summarize_by_frame(df):
     }).reset_index()
     return summary
 
-def process_single_file_complete(input_file: str, output_dir: str):
+def analyze_log_file(input_file: str):
+    """รัน pipeline ของไฟล์ log หนึ่งไฟล์ใน memory คืน (df_final, summary) หรือ raise ValueError ถ้าไม่มีข้อมูล"""
+    df = load_and_parse_file(input_file)
+    if df.empty:
+        raise ValueError(f"ไม่สามารถโหลดข้อมูลจาก {input_file}")
+    
+    df_pro = extract_pro_and_speed(df)
+    if df_pro.empty:
+        raise ValueError(f"ไม่พบข้อมูล PRO ในไฟล์ {input_file}")
+    
+    df_pro = mark_errors(df, df_pro)
+    
+    # เลือกคอลัมน์ที่ต้องการ
+    available_value_cols = [col for col in df_pro.columns if col.startswith('value_')]
+    value_cols = available_value_cols[:1] if available_value_cols else []
+    selected_cols = ['date', 'time', 'step', 'package', 'frame', 'No_strip'] + value_cols + ['speed','MC']
+    existing_cols = [col for col in selected_cols if col in df_pro.columns]
+    df_pro = df_pro[existing_cols]
+    
+    # ประมวลผลข้อมูล
+    df_with_blank = insert_blank_rows(df_pro)
+    df_time = calculate_time_diff(df_with_blank)
+    
+    # แปลงชนิดข้อมูล
+    for col in ['frame', 'speed','value_1']:
+        if col in df_time.columns:
+            if col == 'frame':
+                df_time[col] = df_time[col].astype(str).str.strip()
+            else:
+                df_time[col] = pd.to_numeric(df_time[col], errors='coerce')
+    
+    if 'No_strip' in df_time.columns:
+        df_time['No_strip'] = pd.to_numeric(df_time['No_strip'], errors='coerce')
+    
+    df_filtered = df_time[df_time['frame'].notna()]
+    if df_filtered.empty:
+        raise ValueError(f"ไม่พบข้อมูล frame ที่ใช้งานได้ในไฟล์ {input_file}")
+    
+    # วิเคราะห์ข้อมูล
+    df_analyzed = assign_subgroups_and_insert_empty_rows(df_filtered, 'No_strip', 'frame')
+    df_analyzed = mark_outlier_subgroups(df_analyzed, 'subgroup_id', 'No_strip')
+    df_analyzed = detect_outliers_combined(df_analyzed, 'frame', 'seconds', 'No_strip')
+    df_analyzed = add_avg_exclude_outliers_by_frame(df_analyzed, value_col='seconds', group_col='frame')
+    
+    # จัดการ Error columns
+    if 'outlier_subgroup' in df_analyzed.columns and 'is_outlier' in df_analyzed.columns and 'MC' in df_analyzed.columns:
+        df_analyzed['Error'] = (df_analyzed['outlier_subgroup'] | df_analyzed['is_outlier'] | (df_analyzed['MC'] == 'MC error'))
+    elif 'outlier_subgroup' in df_analyzed.columns and 'is_outlier' in df_analyzed.columns:
+        df_analyzed['Error'] = df_analyzed['outlier_subgroup'] | df_analyzed['is_outlier']
+    else:
+        df_analyzed['Error'] = False
+    
+    # ลบคอลัมน์ที่ไม่ต้องการ
+    df_analyzed.drop(columns=['outlier_subgroup', 'is_outlier','MC'], inplace=True, errors='ignore')
+    df_analyzed['Error'] = df_analyzed['Error'].apply(lambda x: "MC ERROR" if x else "")
+    df_analyzed.drop(columns=['subgroup_id'], inplace=True, errors='ignore')
+    df_analyzed['sec/strip'] = df_analyzed['avg_ex_outliers']
+    
+    # สร้าง Summary
+    summary = summarize_by_frame(df_analyzed)
+    df_final = df_analyzed.drop(columns=['avg_ex_outliers'])
+    return df_final, summary
+
+def write_processed_workbook(output_file, df_final, summary):
+    """บันทึกผลของไฟล์ log หนึ่งไฟล์เป็น Excel (sheet Processed_Data และ Summary)"""
+    try:
+        with pd.ExcelWriter(output_file) as writer:
+            df_final.to_excel(writer, index=False, sheet_name='Processed_Data')
+            summary.to_excel(writer, index=False, sheet_name='Summary')
+    except Exception as e:
+        print(f" ❌ บันทึกไฟล์ {output_file} ไม่สำเร็จ: {e}")
+        raise
+    return str(output_file)
+
+def process_single_file_complete(input_file: str, output_dir: str, in_memory: bool = False, excel_executor=None):
+    """
+    ประมวลผลไฟล์ log หนึ่งไฟล์ คืน (success, message)
+    - ปกติ: บันทึก Excel แล้วคืน path ของไฟล์
+    - in_memory=True: คืน dict ที่มี sec_strip (frame, speed, sec/strip) ให้ขั้นตอนรวมผลใช้ต่อทันที
+      และส่งงานบันทึก Excel ให้ excel_executor ทำเบื้องหลัง (None = ไม่บันทึก Excel)
+    """
     print(f"กำลังประมวลผล: {input_file}")
     input_path = Path(input_file)
     output_path = Path(output_dir)
@@ -243,102 +359,125 @@ def process_single_file_complete(input_file: str, output_dir: str):
     output_file = output_path / f"{input_path.stem}_{timestamp}.xlsx"
     
     try:
-        df = load_and_parse_file(input_file)
-        if df.empty:
-            return False, f"ไม่สามารถโหลดข้อมูลจาก {input_file}"
-        
-        df_pro = extract_pro_and_speed(df)
-        if df_pro.empty:
-            return False, f"ไม่พบข้อมูล PRO ในไฟล์ {input_file}"
-        
-        df_pro = mark_errors(df, df_pro)
-        
-        # เลือกคอลัมน์ที่ต้องการ
-        available_value_cols = [col for col in df_pro.columns if col.startswith('value_')]
-        value_cols = available_value_cols[:1] if available_value_cols else []
-        selected_cols = ['date', 'time', 'step', 'package', 'frame', 'No_strip'] + value_cols + ['speed','MC']
-        existing_cols = [col for col in selected_cols if col in df_pro.columns]
-        df_pro = df_pro[existing_cols]
-        
-        # ประมวลผลข้อมูล
-        df_with_blank = insert_blank_rows(df_pro)
-        df_time = calculate_time_diff(df_with_blank)
-        
-        # แปลงชนิดข้อมูล
-        for col in ['frame', 'speed','value_1']:
-            if col in df_time.columns:
-                if col == 'frame':
-                    df_time[col] = df_time[col].astype(str).str.strip()
-                else:
-                    df_time[col] = pd.to_numeric(df_time[col], errors='coerce')
-        
-        if 'No_strip' in df_time.columns:
-            df_time['No_strip'] = pd.to_numeric(df_time['No_strip'], errors='coerce')
+        df_final, summary = analyze_log_file(input_file)
         
-        df_filtered = df_time[df_time['frame'].notna()]
-        if df_filtered.empty:
-            return False, f"ไม่พบข้อมูล frame ที่ใช้งานได้ในไฟล์ {input_file}"
+        if not in_memory:
+            # บันทึกไฟล์ Excel
+            write_processed_workbook(output_file, df_final, summary)
+            return True, str(output_file)
         
-        # วิเคราะห์ข้อมูล
-        df_analyzed = assign_subgroups_and_insert_empty_rows(df_filtered, 'No_strip', 'frame')
-        df_analyzed = mark_outlier_subgroups(df_analyzed, 'subgroup_id', 'No_strip')
-        df_analyzed = detect_outliers_combined(df_analyzed, 'frame', 'seconds', 'No_strip')
-        df_analyzed = add_avg_exclude_outliers_by_frame(df_analyzed, value_col='seconds', group_col='frame')
-        
-        # จัดการ Error columns
-        if 'outlier_subgroup' in df_analyzed.columns and 'is_outlier' in df_analyzed.columns and 'MC' in df_analyzed.columns:
-            df_analyzed['Error'] = (df_analyzed['outlier_subgroup'] | df_analyzed['is_outlier'] | (df_analyzed['MC'] == 'MC error'))
-        elif 'outlier_subgroup' in df_analyzed.columns and 'is_outlier' in df_analyzed.columns:
-            df_analyzed['Error'] = df_analyzed['outlier_subgroup'] | df_analyzed['is_outlier']
-        else:
-            df_analyzed['Error'] = False
-        
-        # ลบคอลัมน์ที่ไม่ต้องการ
-        df_analyzed.drop(columns=['outlier_subgroup', 'is_outlier','MC'], inplace=True, errors='ignore')
-        df_analyzed['Error'] = df_analyzed['Error'].apply(lambda x: "MC ERROR" if x else "")
-        df_analyzed.drop(columns=['subgroup_id'], inplace=True, errors='ignore')
-        df_analyzed['sec/strip'] = df_analyzed['avg_ex_outliers']
-        
-        # สร้าง Summary
-        summary = summarize_by_frame(df_analyzed)
-        df_final = df_analyzed.drop(columns=['avg_ex_outliers'])
-        
-        # บันทึกไฟล์ Excel
-        with pd.ExcelWriter(output_file) as writer:
-            df_final.to_excel(writer, index=False, sheet_name='Processed_Data')
-            summary.to_excel(writer, index=False, sheet_name='Summary')
-        
-        return True, str(output_file)
+        excel_future = None
+        if excel_executor is not None:
+            excel_future = excel_executor.submit(write_processed_workbook, output_file, df_final, summary)
+        return True, {
+            'input_file': input_file,
+            'name': output_file.stem,
+            'output_file': str(output_file) if excel_executor is not None else None,
+            'excel_future': excel_future,
+            'sec_strip': df_final[['frame', 'speed', 'sec/strip']].copy(),
+        }
         
+    except ValueError as e:
+        return False, str(e)
     except Exception as e:
         return False, f"เกิดข้อผิดพลาดในการประมวลผล {input_file}: {str(e)}"
 
-def process_multiple_files_complete(input_pattern: str, output_dir: str):
+def wait_excel_writes(results):
+    """
+    รอให้งานบันทึก Excel เบื้องหลังของทุกไฟล์เสร็จ (ผลจาก process_single_file_complete แบบ in_memory)
+    ไฟล์ที่บันทึกไม่สำเร็จจะได้ output_file = None คืนจำนวนไฟล์ที่ล้มเหลว
+    """
+    failed = 0
+    for result in results:
+        if not isinstance(result, dict):
+            continue
+        future = result.pop('excel_future', None)
+        if future is None:
+            continue
+        try:
+            future.result()
+        except Exception as e:
+            print(f" ❌ บันทึก Excel ของ {result['name']} ไม่สำเร็จ: {e}")
+            result['output_file'] = None
+            failed += 1
+    if failed:
+        print(f" ⚠️ บันทึกไฟล์ Excel รายไฟล์ไม่สำเร็จ {failed} ไฟล์")
+    return failed
+
+def _process_file_task(task):
+    """ประมวลผลไฟล์เดียวใน worker process (ไฟล์ Excel ของไฟล์นั้นเขียนใน worker เองเพื่อไม่ต้องส่ง df กลับมา)"""
+    file_path, output_dir, in_memory, write_excel = task
+    if in_memory and write_excel:
+        with ThreadPoolExecutor(max_workers=1) as excel_executor:
+            success, result = process_single_file_complete(file_path, output_dir, in_memory, excel_executor)
+        # future ส่งข้าม process ไม่ได้ จึงรอผลใน worker เลย
+        if success:
+            wait_excel_writes([result])
+        return success, result
+    return process_single_file_complete(file_path, output_dir, in_memory)
+
+def process_multiple_files_complete(input_pattern: str, output_dir: str, in_memory: bool = False, excel_executor=None, max_workers=None):
+    """
+    ประมวลผลทุกไฟล์ที่ตรงกับ pattern คืน list ผลลัพธ์ของไฟล์ที่สำเร็จ (path หรือ dict เมื่อ in_memory=True)
+    - max_workers > 1 (หรือ env LOGVIEW_MAX_WORKERS) ประมวลผลแต่ละไฟล์พร้อมกันใน process pool
+    - ผลลัพธ์เรียงตามลำดับไฟล์เสมอไม่ว่าจะใช้กี่ worker
+    """
     files = find_input_files(input_pattern)
     if not files:
         print(f" ไม่พบไฟล์ที่ตรงกับ pattern: {input_pattern}")
-        return
-    print(f" พบไฟล์ทั้งหมด {len(files)} ไฟล์")
+        return []
+    workers = min(resolve_workers(max_workers, LOGVIEW_WORKERS_ENV), len(files))
+    print(f" พบไฟล์ทั้งหมด {len(files)} ไฟล์ ({workers} workers)")
     print("=" * 60)
     successful = 0
     failed = 0
+    results = []
     start_time = time.time()
-    for i, file_path in enumerate(files, 1):
-        print(f"[{i}/{len(files)}] ", end="")
-        success, message = process_single_file_complete(file_path, output_dir)
+    report_progress("process_files", f"พบไฟล์ทั้งหมด {len(files)} ไฟล์", groups_done=0, groups_total=len(files))
+    
+    def on_result(i, total):
+        report_progress("process_files", f"[{i}/{total}] {os.path.basename(files[i - 1])}", groups_done=i, groups_total=total)
+    
+    if workers <= 1:
+        outcomes = []
+        for i, file_path in enumerate(files, 1):
+            print(f"[{i}/{len(files)}] ", end="")
+            outcomes.append(process_single_file_complete(file_path, output_dir, in_memory, excel_executor))
+            on_result(i, len(files))
+    else:
+        tasks = [(file_path, output_dir, in_memory, excel_executor is not None) for file_path in files]
+        outcomes = parallel_map(_process_file_task, tasks, workers, on_result=on_result)
+    
+    for i, (file_path, (success, message)) in enumerate(zip(files, outcomes), 1):
         if success:
-            print(f" สำเร็จ: {message}")
+            print(f"[{i}/{len(files)}] สำเร็จ: {message['name'] if in_memory else message}")
             successful += 1
+            results.append(message)
         else:
-            print(f" ล้มเหลว: {message}")
+            print(f"[{i}/{len(files)}] ล้มเหลว: {message}")
             failed += 1
     end_time = time.time()
     print("\n" + "=" * 60)
     print(f" ใช้เวลา: {end_time - start_time:.2f} วินาที")
     print(f" ผลลัพธ์: สำเร็จ {successful} ไฟล์, ล้มเหลว {failed} ไฟล์")
+    return results
 
 # ---------- 2. รวม Summary ----------
 
+def prepare_sec_strip(df):
+    """แปลงชนิดคอลัมน์ frame/speed/sec/strip และเก็บเฉพาะแถวที่มีทั้ง speed และ sec/strip"""
+    df = df.copy()
+    df['frame'] = df['frame'].astype(str)
+    df['speed'] = pd.to_numeric(df['speed'], errors='coerce')
+    df['sec/strip'] = pd.to_numeric(df['sec/strip'], errors='coerce')
+    return df[df['sec/strip'].notna() & df['speed'].notna()]
+
+def sec_strip_by_frame_speed(df):
+    """ค่าเฉลี่ย sec/strip ต่อ frame × speed โดยใช้ชื่อแถวแบบ '<frame>_speed<speed>'"""
+    summary = df.groupby(['frame', 'speed'])['sec/strip'].mean()
+    summary.index = summary.index.map(lambda x: f"{x[0]}_speed{x[1]}")
+    return summary
+
 def load_sec_strip_by_frame(filepath, sheet_name='Processed_Data'):
     print(f"         📄 อ่านไฟล์: {os.path.basename(filepath)}")
     
@@ -368,13 +507,9 @@ def load_sec_strip_by_frame(filepath, sheet_name='Processed_Data'):
     
     print(f"         ✅ มีครบทุกคอลัมน์ที่ต้องการ")
     
-    df['frame'] = df['frame'].astype(str)
-    df['speed'] = pd.to_numeric(df['speed'], errors='coerce')
-    df['sec/strip'] = pd.to_numeric(df['sec/strip'], errors='coerce')
-    
     # นับจำนวนข้อมูลก่อนกรอง
     before_filter = len(df)
-    df = df[df['sec/strip'].notna() & df['speed'].notna()]
+    df = prepare_sec_strip(df)
     after_filter = len(df)
     
     print(f"         📊 ข้อมูลก่อนกรอง: {before_filter} แถว")
@@ -412,8 +547,7 @@ def summarize_sec_strip(files_folder, file_list):
                 failed_files += 1
                 continue
                 
-            summary = df.groupby(['frame', 'speed'])['sec/strip'].mean()
-            summary.index = summary.index.map(lambda x: f"{x[0]}_speed{x[1]}")
+            summary = sec_strip_by_frame_speed(df)
             file_key = os.path.splitext(filename)[0]
             data[file_key] = summary
             
@@ -437,6 +571,31 @@ def summarize_sec_strip(files_folder, file_list):
     
     return result_df
 
+def summarize_sec_strip_frames(results):
+    """
+    สร้าง summary แบบเดียวกับ summarize_sec_strip จากผลลัพธ์ใน memory
+    (dict จาก process_single_file_complete(..., in_memory=True)) โดยไม่ต้องอ่าน Excel กลับมา
+    """
+    data = {}
+    for result in results:
+        df = result['sec_strip']
+        # frame ว่างจะกลายเป็น NaN เมื่อผ่าน Excel จึงแปลงให้เหมือนกันเพื่อให้ชื่อแถวตรงกับเดิม
+        df = df.assign(frame=df['frame'].replace('', np.nan))
+        df = prepare_sec_strip(df)
+        if df.empty:
+            print(f"      ⚠️  ไม่มีข้อมูล sec/strip: {result['name']}")
+            continue
+        data[result['name']] = sec_strip_by_frame_speed(df)
+    
+    print(f"   📊 สรุป: ใช้ข้อมูล {len(data)} จาก {len(results)} ไฟล์")
+    if not data:
+        print(f"   ❌ ไม่มีข้อมูลใดๆ จากไฟล์ทั้งหมด")
+        return pd.DataFrame()
+    
+    result_df = pd.DataFrame(data).sort_index()
+    print(f"   ✅ สร้าง result DataFrame: {result_df.shape}")
+    return result_df
+
 def save_summary(df, output_path):
     df.index.name = "FRAME_STOCK"
     df.to_excel(output_path, index=True)
@@ -461,6 +620,39 @@ def filtered_mean(lst):
         return float('nan')
     return sum(filtered) / len(filtered)
 
+def _row_percentile(sorted_matrix, counts, q):
+    """percentile แบบ linear (สูตรเดียวกับ np.percentile) ของแต่ละแถว จากเมทริกซ์ที่เรียงแล้วและ NaN อยู่ท้ายแถว"""
+    virtual = (np.maximum(counts, 1) - 1) * (q / 100)
+    lower = np.floor(virtual).astype(np.int64)
+    upper = np.minimum(lower + 1, np.maximum(counts - 1, 0))
+    a = np.take_along_axis(sorted_matrix, lower[:, None], axis=1)[:, 0]
+    b = np.take_along_axis(sorted_matrix, upper[:, None], axis=1)[:, 0]
+    t = virtual - lower
+    return np.where(t >= 0.5, b - (b - a) * (1 - t), a + (b - a) * t)
+
+def filtered_mean_rows(matrix):
+    """
+    filtered_mean ของทุกแถวในเมทริกซ์ 2 มิติพร้อมกัน (ข้าม NaN แบบเดียวกับ row.dropna())
+    ผลเหมือน filtered_mean ทุกหลัก: ตัดค่าที่เกิน Q3 + 1.5*IQR แล้วรวมค่าตามลำดับคอลัมน์
+    """
+    matrix = np.asarray(matrix, dtype=float)
+    if matrix.ndim != 2 or matrix.shape[1] == 0:
+        return np.full(len(matrix), np.nan)
+    valid = ~np.isnan(matrix)
+    counts = valid.sum(axis=1)
+    ordered = np.sort(matrix, axis=1)
+    q1 = _row_percentile(ordered, counts, 25)
+    q3 = _row_percentile(ordered, counts, 75)
+    upper_bound = q3 + 1.5 * (q3 - q1)
+    keep = valid & (matrix <= upper_bound[:, None])
+    # บวกทีละคอลัมน์ (เรียงซ้ายไปขวา) ให้ได้ผลเท่ากับ sum() ของ list เดิม
+    total = np.zeros(len(matrix))
+    for j in range(matrix.shape[1]):
+        total += np.where(keep[:, j], matrix[:, j], 0.0)
+    kept = keep.sum(axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(kept > 0, total / kept, np.nan)
+
 # กำหนด mapping เงื่อนไข Package group → Lead frame
 MAPPING = {
     ('QFN', '5.0'): 'Copper ',
@@ -468,13 +660,14 @@ MAPPING = {
     ('QFN', '3.0'): 'Full PPF',
 }
 
+def load_package_reference(package_path, sheet_name="Export Worksheet"):
+    """โหลดไฟล์ export package and frame stock (ใช้ผ่าน get_reference เพื่อโหลดครั้งเดียวต่อ process)"""
+    return read_excel_cached(package_path, sheet_name=sheet_name)
+
 def analyze_and_export_csv(summary_path, package_path, output_csv):
     df = pd.read_excel(summary_path)
     df2 = pd.read_excel(package_path)
-    df['non_null_values'] = df.loc[:, df.columns != 'FRAME_STOCK'].apply(
-        lambda row: row.dropna().tolist(), axis=1)
-    df = df[['FRAME_STOCK', 'non_null_values']]
-    df['TIME/STRIP'] = df['non_null_values'].apply(filtered_mean)
+    df['TIME/STRIP'] = filtered_mean_rows(df.loc[:, df.columns != 'FRAME_STOCK'].to_numpy(dtype=float))
     df = df[['FRAME_STOCK', 'TIME/STRIP']]
     df['SPEED'] = df['FRAME_STOCK'].astype(str).str[-3:]
     df['X'] = df['FRAME_STOCK'].astype(str).str[0:6]
@@ -500,7 +693,7 @@ def analyze_and_export_csv_from_df(summary_df, package_path, output_csv):
     
     # โหลดข้อมูล package
     print(f"📁 โหลดข้อมูล package จาก: {package_path}")
-    df2 = pd.read_excel(package_path, sheet_name="Export Worksheet")
+    df2 = get_reference("package", package_path, load_package_reference)
     
     # ตรวจสอบคอลัมน์ที่มีอยู่ในไฟล์ package
     print("🔍 ตรวจสอบคอลัมน์ที่มีอยู่ในไฟล์ package...")
@@ -518,10 +711,7 @@ def analyze_and_export_csv_from_df(summary_df, package_path, output_csv):
     
     # ประมวลผลข้อมูล
     print("🔄 กำลังประมวลผลข้อมูล...")
-    df['non_null_values'] = df.loc[:, df.columns != 'FRAME_STOCK'].apply(
-        lambda row: row.dropna().tolist(), axis=1)
-    df = df[['FRAME_STOCK', 'non_null_values']]
-    df['TIME/STRIP'] = df['non_null_values'].apply(filtered_mean)
+    df['TIME/STRIP'] = filtered_mean_rows(df.loc[:, df.columns != 'FRAME_STOCK'].to_numpy(dtype=float))
     df = df[['FRAME_STOCK', 'TIME/STRIP']]
     df['SPEED (IPS)'] = df['FRAME_STOCK'].astype(str).str[-3:]
     df['X'] = df['FRAME_STOCK'].astype(str).str[0:6]
@@ -612,7 +802,79 @@ def analyze_and_export_csv_from_df(summary_df, package_path, output_csv):
     
     return df_final
 
-def group_and_average_across_frames_unique_frame(df_merged):
+def _print_group_details(work, stats, grouping_cols):
+    """แสดงรายละเอียดการตัด outliers ของแต่ละกลุ่ม (ใช้เมื่อ verbose=True)"""
+    details = stats.set_index(grouping_cols)
+    for group_key, group_df in work.groupby(grouping_cols):
+        key = group_key if isinstance(group_key, tuple) else (group_key,)
+        row = details.loc[key if len(key) > 1 else key[0]]
+        group_name = " | ".join([f"{col}={val}" for col, val in zip(grouping_cols, key)])
+        values = group_df['value'].dropna().tolist()
+        print(f"{'✅' if row['before'] >= 2 else '❌'} กลุ่ม: {group_name}")
+        print(f"   📊 Frame Stock ทั้งหมด: {len(group_df)} ตัว")
+        print(f"   📊 มีข้อมูล TIME/STRIP: {len(values)} ค่า")
+        if row['before'] >= 2:
+            print(f"   📈 ช่วงปกติ: {round(row['lower'], 2)} - {round(row['upper'], 2)}")
+            print(f"   ✅ ข้อมูลที่ใช้: {int(row['kept'])} ค่า → {group_df['kept'].dropna().tolist()}")
+            outliers = group_df.loc[group_df['value'].notna() & group_df['kept'].isna(), 'value'].tolist()
+            if outliers:
+                print(f"   ❌ Outliers ที่ตัดออก: {len(outliers)} ค่า → {outliers}")
+                print(f"   📊 เปอร์เซ็นต์ที่ตัด: {round(len(outliers)/len(values)*100, 1)}%")
+        else:
+            print(f"   📋 FRAME_STOCK ที่มีข้อมูล: {group_df.loc[group_df['value'].notna(), 'FRAME_STOCK'].tolist()}")
+        print(f"   🎯 ค่าเฉลี่ยสุดท้าย: {row['group_avg']}")
+        print(f"   📊 จำนวน: {len(values)}/{int(row['After_Outlier'])} (มีข้อมูล/หลังตัด)")
+        print()
+
+def _group_mean(values, keys):
+    """
+    ค่าเฉลี่ยรายกลุ่มของค่าที่ไม่เป็น NaN ให้ผลตรงกับ np.mean ทุกหลัก
+    (groupby.mean ใช้ Kahan summation ซึ่งต่างกันในหลักสุดท้ายได้เมื่อมีตั้งแต่ 3 ค่า ทำให้ round(2) ได้ค่าต่างจากเดิม)
+    """
+    grouped = values.groupby(keys)
+    mean = grouped.mean()
+    many = (grouped.transform('count') >= 3).to_numpy()
+    if many.any():
+        exact = values[many].groupby([key[many] for key in keys]).agg(lambda v: np.mean(v.dropna().to_numpy()))
+        mean.loc[exact.index] = exact
+    return mean
+
+def _group_quantile(values, keys, q):
+    """
+    quantile ของแต่ละกลุ่มแบบ transform (คืนค่าให้ทุกแถว) ด้วยสูตร linear ของ np.percentile ทุกหลัก
+    เพื่อให้ค่าที่อยู่บนขอบ IQR พอดีถูกตัด/ไม่ถูกตัดเหมือนเดิม
+    """
+    grouped = values.groupby(keys)
+    codes = grouped.ngroup().fillna(-1).to_numpy(dtype=np.int64)
+    vals = values.to_numpy(dtype=float)
+    rows = np.flatnonzero((codes >= 0) & ~np.isnan(vals))
+    rows = rows[np.lexsort((vals[rows], codes[rows]))]
+    n = np.bincount(codes[rows], minlength=grouped.ngroups)
+    starts = np.cumsum(n) - n
+    has = n > 0
+    virtual = (n[has] - 1) * q
+    lower = np.floor(virtual).astype(np.int64)
+    upper = np.minimum(lower + 1, n[has] - 1)
+    a = vals[rows[starts[has] + lower]]
+    b = vals[rows[starts[has] + upper]]
+    t = virtual - lower
+    quantile = np.full(len(n), np.nan)
+    quantile[has] = np.where(t >= 0.5, b - (b - a) * (1 - t), a + (b - a) * t)
+    result = np.full(len(codes), np.nan)
+    result[codes >= 0] = quantile[codes[codes >= 0]]
+    return pd.Series(result, index=values.index)
+
+def _as_count_column(counts):
+    """จำนวนที่เป็น 0 ให้เป็น NaN และคงเป็น int ถ้าไม่มี NaN (เหมือนผลของ apply เดิม)"""
+    counts = counts.where(counts > 0)
+    return counts.astype('int64') if counts.notna().all() else counts
+
+def group_and_average_across_frames_unique_frame(df_merged, verbose=False):
+    """
+    รวม FRAME_STOCK ที่ซ้ำกัน แล้วแทน TIME/STRIP ด้วยค่าเฉลี่ยของกลุ่ม
+    (Package size, Package group, Frame type, Unit/strip, SPEED) หลังตัด outliers ด้วย IQR
+    verbose=True แสดงรายละเอียดรายกลุ่ม/รายแถว (ช้าเมื่อมี FRAME_STOCK จำนวนมาก)
+    """
     print("🔄 กำลังจัดกลุ่มและคำนวณค่าเฉลี่ย...")
     
     # รายการคอลัมน์ที่ต้องการสำหรับจัดกลุ่ม
@@ -632,64 +894,22 @@ def group_and_average_across_frames_unique_frame(df_merged):
     
     print(f"📊 ข้อมูลเริ่มต้น: {df_merged.shape[0]} แถว")
     
-    # ✅ วิธีที่ดีที่สุด: รวมข้อมูลแทนการลบ duplicate
+    # ✅ รวมข้อมูล FRAME_STOCK ที่ซ้ำ: TIME/STRIP ใช้ค่าเฉลี่ย คอลัมน์อื่นใช้ค่าแรกที่ไม่เป็น NaN
     print("🔄 รวมข้อมูล FRAME_STOCK ที่ซ้ำกัน...")
+    duplicated = df_merged.duplicated(subset=['FRAME_STOCK'], keep=False)
+    if duplicated.any():
+        print(f"⚠️  พบ FRAME_STOCK ที่ซ้ำกัน: {df_merged.loc[duplicated, 'FRAME_STOCK'].nunique()} ตัว")
+        if verbose:
+            for frame, frame_data in df_merged[duplicated].groupby('FRAME_STOCK', sort=False)['TIME/STRIP']:
+                print(f"   - {frame}: {len(frame_data)} แถว → TIME/STRIP: {frame_data.dropna().tolist()}")
     
-    # ตรวจสอบ duplicate ก่อน
-    duplicated_frames = df_merged[df_merged.duplicated(subset=['FRAME_STOCK'], keep=False)]
-    if not duplicated_frames.empty:
-        print(f"⚠️  พบ FRAME_STOCK ที่ซ้ำกัน: {duplicated_frames['FRAME_STOCK'].nunique()} ตัว")
-        duplicate_analysis = {}
-        for frame in duplicated_frames['FRAME_STOCK'].unique():
-            frame_data = duplicated_frames[duplicated_frames['FRAME_STOCK'] == frame]
-            time_values = frame_data['TIME/STRIP'].dropna().tolist()
-            duplicate_analysis[frame] = {
-                'count': len(frame_data),
-                'time_values': time_values,
-                'non_null_count': len(time_values)
-            }
-            print(f"   - {frame}: {len(frame_data)} แถว → TIME/STRIP: {time_values}")
-    
-    # ✅ รวมข้อมูลโดยใช้กลยุทธ์ที่ดีที่สุด
-    def smart_aggregation(group):
-        # สำหรับ TIME/STRIP: ใช้ค่าเฉลี่ยของค่าที่ไม่เป็น NaN
-        time_values = group['TIME/STRIP'].dropna()
-        if len(time_values) > 0:
-            time_result = time_values.mean()
-        else:
-            time_result = np.nan
-        
-        # สำหรับคอลัมน์อื่นๆ: ใช้ค่าแรกที่ไม่เป็น NaN
-        result = {}
-        for col in df_merged.columns:
-            if col == 'TIME/STRIP':
-                result[col] = time_result
-            elif col == 'FRAME_STOCK':
-                result[col] = group[col].iloc[0]  # ใช้ค่าเดิม
-            else:
-                # ใช้ค่าแรกที่ไม่เป็น NaN
-                non_null_values = group[col].dropna()
-                if len(non_null_values) > 0:
-                    result[col] = non_null_values.iloc[0]
-                else:
-                    result[col] = group[col].iloc[0]
-        
-        return pd.Series(result)
-    
-    # รวมข้อมูลตาม FRAME_STOCK
-    df_unique = df_merged.groupby('FRAME_STOCK').apply(smart_aggregation).reset_index(drop=True)
+    by_frame = df_merged.groupby('FRAME_STOCK')
+    df_unique = by_frame.first()
+    df_unique['TIME/STRIP'] = _group_mean(df_merged['TIME/STRIP'], [df_merged['FRAME_STOCK']])
+    df_unique = df_unique.reset_index()[list(df_merged.columns)]
     
     print(f"📊 ข้อมูลหลังรวม: {df_unique.shape[0]} แถว")
     
-    # แสดงการเปลี่ยนแปลง TIME/STRIP
-    if not duplicated_frames.empty:
-        print("📊 การรวม TIME/STRIP สำหรับ FRAME_STOCK ที่ซ้ำ:")
-        for frame, info in duplicate_analysis.items():
-            if info['non_null_count'] > 1:
-                new_value = df_unique[df_unique['FRAME_STOCK'] == frame]['TIME/STRIP'].iloc[0]
-                if not pd.isna(new_value):
-                    print(f"   - {frame}: {info['time_values']} → {round(new_value, 2)} (เฉลี่ยจาก {info['non_null_count']} ค่า)")
-    
     # ✅ ติดตาม FRAME_STOCK ที่ไม่มีข้อมูล TIME/STRIP
     frames_without_time = df_unique[df_unique['TIME/STRIP'].isna()]['FRAME_STOCK'].tolist()
     if frames_without_time:
@@ -699,218 +919,134 @@ def group_and_average_across_frames_unique_frame(df_merged):
         if len(frames_without_time) > 5:
             print(f"   ... และอีก {len(frames_without_time) - 5} ตัว")
     
-    # ประมวลผลต่อไป...
-    group_avg_map = {}
-    group_before_map = {}
-    group_after_map = {}
-    total_groups = 0
-    processed_groups = 0
-    total_outliers_removed = 0
-    excluded_frames = []
-    excluded_reasons = []
-    
+    # ตัด outliers ด้วย IQR ของแต่ละกลุ่ม (กลุ่มที่มีค่าน้อยกว่า 2 ค่าไม่ตัด)
     print("🔍 วิเคราะห์กลุ่มข้อมูล...")
-    print("=" * 80)
+    values = df_unique['TIME/STRIP']
+    group_keys = [df_unique[col] for col in grouping_cols]
+    q1 = _group_quantile(values, group_keys, 0.25)
+    q3 = _group_quantile(values, group_keys, 0.75)
+    lower = q1 - 1.5 * (q3 - q1)
+    upper = q3 + 1.5 * (q3 - q1)
+    work = df_unique[grouping_cols + ['FRAME_STOCK']].assign(
+        value=values, kept=values.where(values.between(lower, upper)), lower=lower, upper=upper,
+    )
+    stats = work.groupby(grouping_cols).agg(
+        before=('value', 'count'),
+        kept=('kept', 'count'),
+        lower=('lower', 'first'),
+        upper=('upper', 'first'),
+    )
+    group_keys = [work[col] for col in grouping_cols]
+    stats['avg_all'] = _group_mean(work['value'], group_keys)
+    stats['avg_kept'] = _group_mean(work['kept'], group_keys)
+    stats = stats.reset_index()
+    
+    # ค่าเดียวใช้ค่านั้นเลย, ตัดแล้วเหลือข้อมูลใช้ค่าเฉลี่ยหลังตัด, ทุกค่าเป็น outliers ใช้ค่าเฉลี่ยดิบ
+    filtered = (stats['before'] >= 2) & (stats['kept'] > 0)
+    stats['group_avg'] = np.select(
+        [stats['before'] == 1, filtered, stats['before'] >= 2],
+        [stats['avg_all'], stats['avg_kept'].round(2), stats['avg_all'].round(2)],
+        np.nan,
+    )
+    stats['Before_Outlier'] = stats['before']
+    stats['After_Outlier'] = np.where(filtered, stats['kept'], stats['before'])
+    
+    if verbose:
+        print("=" * 80)
+        _print_group_details(work, stats, grouping_cols)
     
-    for group_key, group_df in df_unique.groupby(grouping_cols):
-        total_groups += 1
-        group_name = " | ".join([f"{col}={val}" for col, val in zip(grouping_cols, group_key)])
-        total_frames_in_group = len(group_df)
-        
-        # นับเฉพาะข้อมูลที่มีค่า TIME/STRIP
-        values = group_df['TIME/STRIP'].dropna().tolist()
-        frames_with_data = group_df[group_df['TIME/STRIP'].notna()]['FRAME_STOCK'].tolist()
-        frames_without_data = group_df[group_df['TIME/STRIP'].isna()]['FRAME_STOCK'].tolist()
-
-        # ✅ ใช้ len(values) เพื่อนับเฉพาะที่มีข้อมูล
-        group_before_map[group_key] = len(values)
-    
-        # บันทึก FRAME_STOCK ที่ไม่มีข้อมูล TIME/STRIP
-        for frame in frames_without_data:
-            excluded_frames.append(frame)
-            excluded_reasons.append(f"กลุ่ม: {group_name} | เหตุผล: ไม่มีข้อมูล TIME/STRIP")
-
-        # ✅ แก้ไข: ไม่ให้ Before_Outlier และ After_Outlier เป็น 0
-        if len(values) < 2:
-            print(f"❌ กลุ่ม: {group_name}")
-            print(f"   📊 Frame Stock ทั้งหมด: {total_frames_in_group} ตัว")
-            print(f"   📊 มีข้อมูล TIME/STRIP: {len(values)} ค่า")
-            print(f"   📋 FRAME_STOCK ที่มีข้อมูล: {frames_with_data}")
-            if frames_without_data:
-                print(f"   ❌ FRAME_STOCK ที่ไม่มีข้อมูล: {frames_without_data}")
-            
-            # กำหนดค่าเฉลี่ยแม้มีข้อมูลน้อย
-            if len(values) == 1:
-                group_avg_map[group_key] = values[0]
-                group_after_map[group_key] = 1  # ✅ ใช้ค่าเดียวที่มี
-                print(f"   ✅ ใช้ค่าเดียว: {values[0]}")
-            elif len(values) == 0:
-                group_avg_map[group_key] = np.nan
-                group_after_map[group_key] = np.nan  # ✅ เปลี่ยนจาก 0 เป็น NaN
-                print(f"   ⚠️  ไม่มีข้อมูล: ใช้ NaN")
-            else:
-                group_avg_map[group_key] = np.mean(values)
-                group_after_map[group_key] = len(values)  # ✅ ใช้จำนวนข้อมูลจริง
-                print(f"   ✅ ใช้ค่าเฉลี่ยโดยไม่กรอง: {np.mean(values)}")
-            
-            print(f"   📊 จำนวน: {len(values)}/{group_after_map[group_key]} (มีข้อมูล/หลังตัด)")
-            print()
-            
-        else:
-            # กรองข้อมูล outliers
-            q1 = np.percentile(values, 25)
-            q3 = np.percentile(values, 75)
-            iqr = q3 - q1
-            lower = q1 - 1.5 * iqr
-            upper = q3 + 1.5 * iqr
-            
-            filtered = [v for v in values if lower <= v <= upper]
-            outliers = [v for v in values if v < lower or v > upper]
-            
-            if filtered:
-                avg_val = round(np.mean(filtered), 2)
-                group_avg_map[group_key] = avg_val
-                group_after_map[group_key] = len(filtered)  # ✅ ใช้จำนวนข้อมูลที่เหลือหลังกรอง
-                processed_groups += 1
-                total_outliers_removed += len(outliers)
-                
-                print(f"✅ กลุ่ม: {group_name}")
-                print(f"   📊 Frame Stock ทั้งหมด: {total_frames_in_group} ตัว")
-                print(f"   📊 มีข้อมูล TIME/STRIP: {len(values)} ค่า")
-                print(f"   📈 ช่วงปกติ: {round(lower, 2)} - {round(upper, 2)}")
-                print(f"   ✅ ข้อมูลที่ใช้: {len(filtered)} ค่า → {filtered}")
-                
-                if outliers:
-                    print(f"   ❌ Outliers ที่ตัดออก: {len(outliers)} ค่า → {outliers}")
-                    print(f"   📊 เปอร์เซ็นต์ที่ตัด: {round(len(outliers)/len(values)*100, 1)}%")
-                else:
-                    print(f"   ✨ ไม่มี outliers")
-                
-                print(f"   🎯 ค่าเฉลี่ยสุดท้าย: {avg_val}")
-                print(f"   📊 จำนวน: {len(values)}/{len(filtered)} (มีข้อมูล/หลังตัด)")
-                print()
-            else:
-                print(f"⚠️  กลุ่ม: {group_name}")
-                print(f"   📊 Frame Stock ทั้งหมด: {total_frames_in_group} ตัว")
-                print(f"   📊 ข้อมูลทั้งหมด: {len(values)} ค่า → {values}")
-                print(f"   ❌ ทุกค่าเป็น outliers")
-                print(f"   📈 ช่วงปกติ: {round(lower, 2)} - {round(upper, 2)}")
-                
-                group_avg_map[group_key] = round(np.mean(values), 2)
-                group_after_map[group_key] = len(values)  # ✅ เปลี่ยนจาก 0 เป็น len(values) เพราะใช้ค่าเฉลี่ยดิบ
-                print(f"   ⚠️  ใช้ค่าเฉลี่ยดิบ: {round(np.mean(values), 2)}")
-                print(f"   📊 จำนวน: {len(values)}/{len(values)} (มีข้อมูล/หลังตัด)")
-                print()
-
     # แสดงสรุป
+    total_groups = len(stats)
+    processed_groups = int(filtered.sum())
+    total_outliers_removed = int((stats['before'] - stats['kept'])[filtered].sum())
     print("=" * 80)
     print(f"📈 สรุปการประมวลผล:")
     print(f"   🔢 กลุ่มทั้งหมด: {total_groups} กลุ่ม")
     print(f"   ✅ กลุ่มที่ประมวลผลได้: {processed_groups} กลุ่ม")
     print(f"   ❌ กลุ่มที่ข้ามไป: {total_groups - processed_groups} กลุ่ม")
     print(f"   🗑️  Outliers ที่ตัดออกทั้งหมด: {total_outliers_removed} ค่า")
-    print(f"   📊 อัตราสำเร็จ: {round(processed_groups/total_groups*100, 1)}%")
+    if total_groups:
+        print(f"   📊 อัตราสำเร็จ: {round(processed_groups/total_groups*100, 1)}%")
+    
+    # แนบผลของกลุ่มกลับเข้าแต่ละแถว (แถวที่คอลัมน์จัดกลุ่มเป็น NaN ไม่อยู่ในกลุ่มใด คงค่าเดิม)
+    print("🔄 กำลังอัปเดตค่า TIME/STRIP...")
+    result_cols = ['group_avg', 'Before_Outlier', 'After_Outlier']
+    df_unique = df_unique.merge(stats[grouping_cols + result_cols], on=grouping_cols, how='left', indicator=True)
+    in_group = (df_unique.pop('_merge') == 'both').to_numpy()
     
     # แสดงรายงาน FRAME_STOCK ที่ไม่ถูกนำมาคิด
-    if excluded_frames:
-        print(f"\n❌ FRAME_STOCK ที่ไม่ถูกนำมาคิด: {len(excluded_frames)} ตัว")
-        print("=" * 80)
-        for i, (frame, reason) in enumerate(zip(excluded_frames, excluded_reasons), 1):
-            print(f"   {i:2d}. {frame} → {reason}")
-        print("=" * 80)
+    excluded = df_unique.loc[in_group & df_unique['TIME/STRIP'].isna().to_numpy(), 'FRAME_STOCK']
+    if not excluded.empty:
+        print(f"\n❌ FRAME_STOCK ที่ไม่ถูกนำมาคิด (ไม่มีข้อมูล TIME/STRIP): {len(excluded)} ตัว")
+        if verbose:
+            for i, frame in enumerate(excluded, 1):
+                print(f"   {i:2d}. {frame}")
     else:
         print(f"\n✅ FRAME_STOCK ทุกตัวถูกนำมาคิดแล้ว")
     
-    # ฟังก์ชันสำหรับ apply
-    def assign_before_count(row):
-        key = tuple(row[col] for col in grouping_cols)
-        count = group_before_map.get(key, np.nan)
-        # ✅ ไม่ให้เป็น 0 - ใช้ NaN แทน
-        return count if pd.notna(count) and count > 0 else np.nan
-
-    def assign_after_count(row):
-        key = tuple(row[col] for col in grouping_cols)
-        count = group_after_map.get(key, np.nan)
-        # ✅ ไม่ให้เป็น 0 - ใช้ NaN แทน
-        return count if pd.notna(count) and count > 0 else np.nan
-
-    def assign_avg(row):
-        key = tuple(row[col] for col in grouping_cols)
-        original_value = row['TIME/STRIP']
-        new_value = group_avg_map.get(key, original_value)
-        
-        if pd.notna(original_value) and pd.notna(new_value) and abs(original_value - new_value) > 0.01:
-            change_type = "📈" if new_value > original_value else "📉"
-            diff = abs(new_value - original_value)
-            before_count = group_before_map.get(key, np.nan)
-            after_count = group_after_map.get(key, np.nan)
-            print(f"   {change_type} {row['FRAME_STOCK']}: {original_value} → {new_value} (เปลี่ยน {round(diff, 2)}) [{before_count}/{after_count}]")
-            
-        return new_value
-
-    print("🔄 กำลังอัปเดตค่า TIME/STRIP...")
-    df_unique['TIME/STRIP'] = df_unique.apply(assign_avg, axis=1)
-
+    new_values = df_unique['group_avg'].where(in_group, df_unique['TIME/STRIP'])
+    if verbose:
+        changed = (new_values - df_unique['TIME/STRIP']).abs() > 0.01
+        for frame, old, new, before, after in zip(
+                df_unique.loc[changed, 'FRAME_STOCK'], df_unique.loc[changed, 'TIME/STRIP'], new_values[changed],
+                df_unique.loc[changed, 'Before_Outlier'], df_unique.loc[changed, 'After_Outlier']):
+            change_type = "📈" if new > old else "📉"
+            print(f"   {change_type} {frame}: {old} → {new} (เปลี่ยน {round(abs(new - old), 2)}) [{before}/{after}]")
+    df_unique['TIME/STRIP'] = new_values
+    
     print("📊 เพิ่มคอลัมน์จำนวนข้อมูลก่อนและหลังตัด...")
-    df_unique['Before_Outlier'] = df_unique.apply(assign_before_count, axis=1)
-    df_unique['After_Outlier'] = df_unique.apply(assign_after_count, axis=1)
-
+    df_unique['Before_Outlier'] = _as_count_column(df_unique['Before_Outlier'])
+    df_unique['After_Outlier'] = _as_count_column(df_unique['After_Outlier'])
+    df_unique = df_unique.drop(columns=['group_avg'])
+    
     print("✅ เสร็จสิ้นการจัดกลุ่มและคำนวณค่าเฉลี่ย")
     return df_unique
 
-def LOGVIEW(input_path, output_dir):
+def LOGVIEW(input_path, output_dir, write_excel=None, max_workers=None):
     """
-    ฟังก์ชันหลักสำหรับประมวลผลไฟล์ LOGVIEW
+    ฟังก์ชันหลักสำหรับประมวลผลไฟล์ LOGVIEW คืน (path ของ Summary CSV, DataFrame ผลลัพธ์)
+    write_excel: บันทึกไฟล์ Excel ของแต่ละ log หรือไม่ (None = ใช้ env LOGVIEW_WRITE_EXCEL, ค่าเริ่มต้นเปิด)
+    max_workers: จำนวน process ที่ประมวลผลไฟล์ log พร้อมกัน (None = ใช้ env LOGVIEW_MAX_WORKERS)
     """
     print(f"🚀 เริ่มประมวลผล LOGVIEW")
     print(f"📁 Input: {input_path}")
     print(f"📁 Output: {output_dir}")
     
-    # 1. ประมวลผลไฟล์ input และเก็บชื่อไฟล์ .xlsx ที่สร้างใหม่
+    # 1. ประมวลผลไฟล์ input ใน memory ส่วนไฟล์ Excel รายไฟล์ (ถ้าเปิดไว้) บันทึกเบื้องหลัง
     print("📊 ขั้นตอนที่ 1: ประมวลผลไฟล์ input...")
-    before_files = set(f for f in os.listdir(output_dir) if f.lower().endswith('.xlsx'))
+    if write_excel is None:
+        write_excel = os.environ.get("LOGVIEW_WRITE_EXCEL", "1") != "0"
+    os.makedirs(output_dir, exist_ok=True)
     
-    with tempfile.TemporaryDirectory() as temp_dir:
-        # ประมวลผลในไฟล์ชั่วคราว
-        process_multiple_files_complete(input_path, temp_dir)
-        # หาไฟล์ใหม่ที่สร้างขึ้น
-        temp_files = set(f for f in os.listdir(temp_dir) if f.lower().endswith('.xlsx'))
+    with ExitStack() as stack:
+        excel_executor = stack.enter_context(ThreadPoolExecutor(max_workers=1)) if write_excel else None
+        results = process_multiple_files_complete(input_path, output_dir, in_memory=True, excel_executor=excel_executor, max_workers=max_workers)
+        # ก่อนออกจาก LOGVIEW (ทุกทาง) รอไฟล์ Excel ที่บันทึกเบื้องหลังให้เสร็จและแจ้งไฟล์ที่ล้มเหลว
+        stack.callback(wait_excel_writes, results)
         
-        if not temp_files:
-            print(" ไม่พบไฟล์ .xlsx ใหม่")
+        if not results:
+            print(" ไม่มีไฟล์ที่ประมวลผลสำเร็จ")
             return
-
-        print(f" สร้างไฟล์ใหม่ {len(temp_files)} ไฟล์")
-        
-        # คัดลอกไฟล์จาก temp_dir ไปยัง output_dir
-        import shutil
-        new_files = []
-        for filename in temp_files:
-            src = os.path.join(temp_dir, filename)
-            dst = os.path.join(output_dir, filename)
-            shutil.copy2(src, dst)
-            new_files.append(filename)
-            print(f"   ✅ คัดลอก: {filename}")
-    
-    # ตรวจสอบไฟล์ที่คัดลอกมาแล้ว
-    if not new_files:
-        print(" ไม่สามารถคัดลอกไฟล์ได้")
-        return
-
-    # 2. สร้าง summary DataFrame
-    print("📊 ขั้นตอนที่ 2: สร้าง summary...")
-    try:
-        summary_df = summarize_sec_strip(output_dir, new_files)
-        print(f"   ✅ ข้อมูล summary: {summary_df.shape}")
+        print(f" ประมวลผลสำเร็จ {len(results)} ไฟล์")
         
-        if summary_df.empty:
-            print("   ❌ Summary DataFrame ว่างเปล่า")
-            return
+        # 2. สร้าง summary DataFrame
+        print("📊 ขั้นตอนที่ 2: สร้าง summary...")
+        try:
+            summary_df = summarize_sec_strip_frames(results)
+            print(f"   ✅ ข้อมูล summary: {summary_df.shape}")
             
-    except Exception as e:
-        print(f"   ❌ เกิดข้อผิดพลาดในการสร้าง summary: {str(e)}")
-        return
-    
+            if summary_df.empty:
+                print("   ❌ Summary DataFrame ว่างเปล่า")
+                return
+                
+        except Exception as e:
+            print(f"   ❌ เกิดข้อผิดพลาดในการสร้าง summary: {str(e)}")
+            return
+        
+        return _export_logview_summary(summary_df, output_dir)
+
+def _export_logview_summary(summary_df, output_dir):
+    """ขั้นตอนที่ 3-4 ของ LOGVIEW: ตรวจสอบไฟล์ package แล้วสร้าง Summary CSV จาก summary_df (คืน path, DataFrame)"""
     # 3. ตรวจสอบไฟล์ package
     print("📊 ขั้นตอนที่ 3: ตรวจสอบไฟล์ package...")
     package_path = os.path.join(BASE_DIR, "..", "data_MAP", "export package and frame stock Rev.06.xlsx")
@@ -940,7 +1076,7 @@ def LOGVIEW(input_path, output_dir):
         print(f"   📄 ไฟล์ผลลัพธ์: {output_csv}")
         print(f"   📊 ข้อมูลสุดท้าย: {final_df.shape[0]} แถว")
         if os.path.exists(output_csv):
-            return output_csv
+            return output_csv, final_df
         else:
             print(f"   ❌ ไม่พบไฟล์ผลลัพธ์: {output_csv}")
             return None
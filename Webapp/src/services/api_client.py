@@ -0,0 +1,123 @@
+import os
+import time
+import threading
+from collections import OrderedDict
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# RTMS ApiAutoUph (ตั้งค่าผ่าน env ได้ เช่น ชี้ไปที่ stub server ตอนทดสอบ)
+API_BASE_URL = os.environ.get("RTMS_API_BASE_URL") or "http://th3sroeeeng4/RTMSAPI/ApiAutoUph/api"
+API_TIMEOUT = float(os.environ.get("RTMS_API_TIMEOUT", 30))
+API_RETRIES = int(os.environ.get("RTMS_API_RETRIES", 3))
+API_BACKOFF = float(os.environ.get("RTMS_API_BACKOFF", 0.5))
+# อายุของ response ที่เก็บไว้ (วินาที) 0 = ไม่เก็บ
+API_CACHE_TTL = float(os.environ.get("RTMS_API_CACHE_TTL", 600))
+API_CACHE_MAX_ENTRIES = 128
+API_POOL_SIZE = 8
+
+
+class ApiClient:
+    """
+    HTTP client ที่ใช้ requests.Session ร่วมกัน (connection pool + keep-alive)
+    มี timeout, retry แบบ backoff และเก็บ response ที่สำเร็จไว้ตาม URL + params เป็นเวลา cache_ttl วินาที
+    """
+
+    def __init__(self, base_url=None, timeout=None, retries=None, backoff=None, cache_ttl=None):
+        self.base_url = (base_url or API_BASE_URL).rstrip("/")
+        self.timeout = API_TIMEOUT if timeout is None else timeout
+        self.cache_ttl = API_CACHE_TTL if cache_ttl is None else cache_ttl
+        self.session = requests.Session()
+        retry = Retry(
+            total=API_RETRIES if retries is None else retries,
+            backoff_factor=API_BACKOFF if backoff is None else backoff,
+            status_forcelist=(429, 500, 502, 503, 504),
+            allowed_methods=frozenset(["GET"]),
+            raise_on_status=False,  # retry ครบแล้วคืน response สุดท้ายให้ผู้เรียกตรวจ status เอง
+        )
+        adapter = HTTPAdapter(pool_connections=API_POOL_SIZE, pool_maxsize=API_POOL_SIZE, max_retries=retry)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def url_for(self, endpoint):
+        """endpoint ที่เป็น URL เต็มใช้ตามนั้น ไม่เช่นนั้นต่อท้าย base_url"""
+        if endpoint.startswith(("http://", "https://")):
+            return endpoint
+        return f"{self.base_url}/{endpoint.lstrip('/')}"
+
+    @staticmethod
+    def _cache_key(url, params):
+        items = sorted((str(k), str(v)) for k, v in (params or {}).items() if v not in (None, ""))
+        return url, tuple(items)
+
+    def _cached(self, key):
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is None:
+                return None
+            if time.time() - entry[0] > self.cache_ttl:
+                del self._cache[key]
+                return None
+            self._cache.move_to_end(key)
+            return entry[1]
+
+    def _store(self, key, response):
+        with self._lock:
+            self._cache[key] = (time.time(), response)
+            self._cache.move_to_end(key)
+            while len(self._cache) > API_CACHE_MAX_ENTRIES:
+                self._cache.popitem(last=False)
+
+    def get(self, endpoint, params=None, use_cache=True, **kwargs):
+        """
+        GET endpoint (หรือ URL เต็ม) คืน requests.Response
+        - response JSON ที่สำเร็จ (200) ถูกเก็บไว้ใช้ซ้ำจนหมดอายุ (ไม่เก็บเมื่อส่ง headers/auth หรือ option อื่นเพิ่ม)
+        - timeout ใช้ค่าเริ่มต้นของ client ถ้าไม่ระบุ
+        """
+        url = self.url_for(endpoint)
+        timeout = kwargs.pop("timeout", self.timeout)
+        cacheable = use_cache and self.cache_ttl > 0 and not kwargs
+        key = self._cache_key(url, params)
+        if cacheable:
+            response = self._cached(key)
+            if response is not None:
+                print(f"⚡ ใช้ข้อมูล API จากแคช: {response.url}")
+                return response
+
+        response = self.session.get(url, params=params, timeout=timeout, **kwargs)
+        # เก็บเฉพาะข้อมูล JSON ที่สำเร็จ (หน้า HTML เช่น Swagger/login ไม่ใช่ข้อมูลจริง)
+        if cacheable and response.status_code == 200 and "application/json" in response.headers.get("Content-Type", ""):
+            self._store(key, response)
+        return response
+
+    def clear_cache(self):
+        with self._lock:
+            count = len(self._cache)
+            self._cache.clear()
+        return count
+
+    def cache_status(self):
+        now = time.time()
+        with self._lock:
+            return [
+                {"url": url, "params": dict(params), "age_seconds": round(now - stored_at, 1)}
+                for (url, params), (stored_at, _) in self._cache.items()
+            ]
+
+
+_client = None
+_client_pid = None
+_client_lock = threading.Lock()
+
+
+def get_api_client():
+    """client ร่วมของ process (worker process ที่ fork มาจะสร้าง session ของตัวเอง)"""
+    global _client, _client_pid
+    with _client_lock:
+        if _client is None or _client_pid != os.getpid():
+            _client = ApiClient()
+            _client_pid = os.getpid()
+        return _client
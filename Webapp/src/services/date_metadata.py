@@ -0,0 +1,132 @@
+import os
+import json
+import threading
+
+import pandas as pd
+
+from services.input_cache import read_excel_cached, read_cached_columns
+
+# สถิติวันที่ของไฟล์ input (ช่วงวันที่ + จำนวนแถวรายเดือน) เก็บเป็น sidecar index ตาม path+mtime+ขนาดไฟล์
+# หน้าเลือกฟังก์ชันจึงไม่ต้องอ่านไฟล์ใหม่ทุกครั้งที่ render
+INDEX_PATH = os.environ.get("DATE_METADATA_INDEX") or os.path.join(os.getcwd(), "temp", "date_metadata.json")
+INDEX_VERSION = 1
+DATE_KEYWORDS = ['date', 'time', 'วัน', 'เวลา']
+
+_lock = threading.Lock()
+
+
+def _load_index():
+    try:
+        with open(INDEX_PATH, "r", encoding="utf-8") as f:
+            index = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    return index if index.get("version") == INDEX_VERSION else {}
+
+
+def _save_index(index):
+    os.makedirs(os.path.dirname(INDEX_PATH), exist_ok=True)
+    tmp_path = f"{INDEX_PATH}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(index, f, ensure_ascii=False)
+    os.replace(tmp_path, INDEX_PATH)
+
+
+def find_date_column(columns):
+    """คอลัมน์แรกที่ชื่อมีคำว่า date/time/วัน/เวลา (None ถ้าไม่พบ)"""
+    for col_name in columns:
+        if any(keyword in str(col_name).lower() for keyword in DATE_KEYWORDS):
+            return col_name
+    return None
+
+
+def _read_date_values(file_path):
+    """คืน (คอลัมน์วันที่, ค่าในคอลัมน์นั้น) โดยอ่านเฉพาะคอลัมน์วันที่เท่าที่ทำได้"""
+    ext = os.path.splitext(file_path)[-1].lower()
+    if ext == ".json":
+        df = pd.read_json(file_path)
+        date_col = find_date_column(df.columns)
+        return date_col, (df[date_col] if date_col is not None else None)
+    if ext in [".xlsx", ".xls"]:
+        date_col = find_date_column(pd.read_excel(file_path, nrows=0).columns)
+        if date_col is None:
+            return None, None
+        # ใช้แคชของไฟล์ที่ parse แล้วถ้ามี ไม่เช่นนั้นอ่านทั้งไฟล์ผ่านแคช (ตอนประมวลผลจริงจะได้ไม่ต้อง parse ซ้ำ)
+        cached = read_cached_columns(file_path, [date_col], "read_excel")
+        if cached is not None:
+            return date_col, cached[date_col]
+        return date_col, read_excel_cached(file_path)[date_col]
+    if ext == ".csv":
+        date_col = find_date_column(pd.read_csv(file_path, nrows=0).columns)
+        if date_col is None:
+            return None, None
+        cached = read_cached_columns(file_path, [date_col], "read_csv")
+        if cached is not None:
+            return date_col, cached[date_col]
+        return date_col, pd.read_csv(file_path, usecols=[date_col])[date_col]
+    raise ValueError("ไม่รองรับไฟล์ประเภทนี้")
+
+
+def compute_date_stats(file_path):
+    """สถิติวันที่ของไฟล์ (รูปแบบเดียวกับ preview_date_range) คืน None ถ้าไม่มีคอลัมน์/ข้อมูลวันที่"""
+    date_col, values = _read_date_values(file_path)
+    if date_col is None:
+        return None
+    dates = pd.to_datetime(values, errors='coerce')
+    valid_dates = dates.dropna()
+    if len(valid_dates) == 0:
+        return None
+    min_date = valid_dates.min()
+    max_date = valid_dates.max()
+    monthly_counts = valid_dates.groupby(valid_dates.dt.to_period('M')).size()
+    return {
+        'min_date': min_date.strftime('%Y-%m-%d'),
+        'max_date': max_date.strftime('%Y-%m-%d'),
+        'total_days': (max_date - min_date).days + 1,
+        'valid_records': int(len(valid_dates)),
+        'invalid_records': int(len(dates) - len(valid_dates)),
+        'date_column': str(date_col),
+        'monthly_distribution': {str(period): int(count) for period, count in monthly_counts.items()},
+    }
+
+
+def get_date_stats(file_path):
+    """สถิติวันที่จาก sidecar index ถ้าไฟล์ไม่เปลี่ยน ไม่เช่นนั้นคำนวณใหม่แล้วบันทึก"""
+    stat = os.stat(file_path)
+    key = os.path.abspath(file_path)
+    with _lock:
+        entry = _load_index().get("files", {}).get(key)
+    if entry and entry["mtime"] == stat.st_mtime and entry["size"] == stat.st_size:
+        return entry["stats"]
+
+    stats = compute_date_stats(file_path)
+    with _lock:
+        index = _load_index() or {"version": INDEX_VERSION, "files": {}}
+        index["files"][key] = {"mtime": stat.st_mtime, "size": stat.st_size, "stats": stats}
+        _save_index(index)
+    return stats
+
+
+def combine_date_stats(stats_list):
+    """รวมสถิติของหลายไฟล์เป็นช่วงวันที่เดียว (ไม่นับไฟล์ที่ไม่มีข้อมูลวันที่)"""
+    stats_list = [s for s in stats_list if s]
+    if not stats_list:
+        return None
+    if len(stats_list) == 1:
+        return stats_list[0]
+    min_date = min(s['min_date'] for s in stats_list)
+    max_date = max(s['max_date'] for s in stats_list)
+    monthly = {}
+    for s in stats_list:
+        for period, count in s['monthly_distribution'].items():
+            monthly[period] = monthly.get(period, 0) + count
+    columns = list(dict.fromkeys(s['date_column'] for s in stats_list))
+    return {
+        'min_date': min_date,
+        'max_date': max_date,
+        'total_days': (pd.Timestamp(max_date) - pd.Timestamp(min_date)).days + 1,
+        'valid_records': sum(s['valid_records'] for s in stats_list),
+        'invalid_records': sum(s['invalid_records'] for s in stats_list),
+        'date_column': ", ".join(columns),
+        'monthly_distribution': dict(sorted(monthly.items())),
+    }
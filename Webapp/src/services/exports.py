@@ -0,0 +1,123 @@
+import os
+import threading
+from datetime import date, datetime
+
+import numpy as np
+import pandas as pd
+
+from services.result_view import save_result_data, read_result_data
+
+# รูปแบบไฟล์ที่ดาวน์โหลดได้ สร้างจากข้อมูลผลลัพธ์ (Parquet/pickle) เมื่อมีการขอครั้งแรก
+EXPORT_FORMATS = ("xlsx", "csv", "parquet")
+EXCEL_MAX_ROWS = 1048576
+EXCEL_CHUNK_ROWS = 20000
+
+_lock = threading.Lock()
+
+
+def excel_writer(path):
+    """ExcelWriter สำหรับเขียนหลาย sheet: ใช้ xlsxwriter (เร็วกว่า) ถ้ามี ไม่เช่นนั้นใช้ openpyxl"""
+    try:
+        import xlsxwriter  # noqa: F401
+    except ImportError:
+        return pd.ExcelWriter(path, engine="openpyxl")
+    return pd.ExcelWriter(path, engine="xlsxwriter")
+
+
+def _is_missing(value):
+    """ค่าว่างแบบ scalar (None, NaN, NaT, pd.NA) ค่าอื่นเช่น list ไม่นับเป็นค่าว่าง"""
+    return value is None or value is pd.NA or value is pd.NaT or (np.isscalar(value) and pd.isna(value))
+
+
+def _excel_column(series):
+    """แปลงค่าในคอลัมน์ให้ xlsxwriter เขียนได้ (ช่องว่างแทน NaN/NaT/pd.NA แบบเดียวกับ to_excel)"""
+    if pd.api.types.is_datetime64_any_dtype(series):
+        values = series.dt.to_pydatetime().astype(object)
+    elif pd.api.types.is_float_dtype(series):
+        values = series.to_numpy(dtype=object)
+        values[np.isposinf(series.to_numpy())] = "inf"
+        values[np.isneginf(series.to_numpy())] = "-inf"
+    elif pd.api.types.is_bool_dtype(series) or pd.api.types.is_integer_dtype(series):
+        return series.astype(object).where(series.notna(), None).tolist()
+    else:
+        values = series.to_numpy(dtype=object)
+    return [None if _is_missing(v) else v for v in values]
+
+
+def write_excel(df, path, sheet_name="Sheet1"):
+    """
+    เขียน DataFrame เป็น Excel ทีละแถวด้วย xlsxwriter โหมด constant_memory (ใช้ memory คงที่ไม่ขึ้นกับจำนวนแถว)
+    ผลลัพธ์เหมือน df.to_excel(path, index=False) ถ้าไม่มี xlsxwriter ใช้ to_excel ปกติ
+    """
+    try:
+        import xlsxwriter
+    except ImportError:
+        df.to_excel(path, sheet_name=sheet_name, index=False)
+        return path
+    if len(df) + 1 > EXCEL_MAX_ROWS:
+        raise ValueError(f"ข้อมูลมี {len(df)} แถว เกินจำนวนแถวสูงสุดของ Excel")
+
+    workbook = xlsxwriter.Workbook(path, {"constant_memory": True})
+    try:
+        worksheet = workbook.add_worksheet(sheet_name)
+        header_format = workbook.add_format({"bold": True, "border": 1, "align": "center", "valign": "top"})
+        datetime_format = workbook.add_format({"num_format": "yyyy-mm-dd hh:mm:ss"})
+        date_format = workbook.add_format({"num_format": "yyyy-mm-dd"})
+        worksheet.write_row(0, 0, [str(c) for c in df.columns], header_format)
+
+        # constant_memory ต้องเขียนเรียงทีละแถว (pandas เขียนทีละคอลัมน์จึงใช้โหมดนี้ไม่ได้)
+        # แปลงค่าทีละช่วงแถวเพื่อไม่ให้สร้าง object ของทั้งตารางพร้อมกัน
+        for start in range(0, len(df), EXCEL_CHUNK_ROWS):
+            chunk = df.iloc[start:start + EXCEL_CHUNK_ROWS]
+            columns = [_excel_column(chunk.iloc[:, i]) for i in range(chunk.shape[1])]
+            for row_idx, row in enumerate(zip(*columns), start=start + 1):
+                for col_idx, value in enumerate(row):
+                    if value is None:
+                        continue
+                    if isinstance(value, datetime):
+                        worksheet.write_datetime(row_idx, col_idx, value, datetime_format)
+                    elif isinstance(value, date):
+                        worksheet.write_datetime(row_idx, col_idx, value, date_format)
+                    else:
+                        worksheet.write(row_idx, col_idx, value)
+    finally:
+        workbook.close()
+    return path
+
+
+def save_deferred(df, base_path):
+    """เก็บ DataFrame ไว้เป็น Parquet (หรือ pickle) เพื่อสร้างไฟล์ Excel/CSV ภายหลังเมื่อมีการดาวน์โหลด"""
+    return save_result_data(df, base_path)
+
+
+def _write_format(df, path, fmt):
+    if fmt == "xlsx":
+        write_excel(df, path)
+    elif fmt == "csv":
+        df.to_csv(path, index=False)
+    else:
+        df.to_parquet(path, index=False)
+
+
+def materialize(data_path, fmt):
+    """
+    คืน path ของไฟล์รูปแบบ fmt ที่สร้างจาก data_path (ใช้ไฟล์เดิมถ้าสร้างไว้แล้วและใหม่กว่าข้อมูล)
+    ไฟล์ถูกสร้างข้างๆ data_path ชื่อเดียวกันแต่เปลี่ยนนามสกุล
+    """
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"ไม่รองรับรูปแบบไฟล์: {fmt}")
+    if data_path.endswith(f".{fmt}"):
+        return data_path
+    out_path = f"{os.path.splitext(data_path)[0]}.{fmt}"
+    with _lock:
+        if os.path.exists(out_path) and os.path.getmtime(out_path) >= os.path.getmtime(data_path):
+            return out_path
+        print(f"📝 สร้างไฟล์ {fmt} จาก {os.path.basename(data_path)}...")
+        tmp_path = f"{out_path}.{os.getpid()}.tmp"
+        try:
+            _write_format(read_result_data(data_path), tmp_path, fmt)
+            os.replace(tmp_path, out_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+    return out_path
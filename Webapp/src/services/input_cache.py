@@ -0,0 +1,167 @@
+import os
+import json
+import hashlib
+import threading
+
+import pandas as pd
+
+# แคช DataFrame ที่ parse แล้วจากไฟล์ Excel/CSV เก็บเป็นไฟล์ binary แบบ columnar (Parquet)
+# ใน temp/input_cache เพื่อให้การรันครั้งถัดไปบนไฟล์เดิมไม่ต้องผ่าน openpyxl อีก
+CACHE_DIR = os.environ.get("INPUT_CACHE_DIR") or os.path.join(os.getcwd(), "temp", "input_cache")
+MAX_CACHE_BYTES = int(os.environ.get("INPUT_CACHE_MAX_MB", 512)) * 1024 * 1024
+CACHE_VERSION = 1
+
+_hash_lock = threading.Lock()
+
+
+def _index_path():
+    return os.path.join(CACHE_DIR, "file_hashes.json")
+
+
+def _load_hash_index():
+    try:
+        with open(_index_path(), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_hash_index(index):
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    tmp_path = f"{_index_path()}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(index, f)
+    os.replace(tmp_path, _index_path())
+
+
+def file_hash(path):
+    """sha256 ของเนื้อไฟล์ (จำค่าไว้ตาม path+mtime+size เพื่อไม่ต้อง hash ซ้ำถ้าไฟล์ไม่เปลี่ยน)"""
+    stat = os.stat(path)
+    abs_path = os.path.abspath(path)
+    with _hash_lock:
+        index = _load_hash_index()
+        entry = index.get(abs_path)
+        if entry and entry["mtime"] == stat.st_mtime and entry["size"] == stat.st_size:
+            return entry["sha256"], stat.st_mtime
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(chunk)
+        index[abs_path] = {"mtime": stat.st_mtime, "size": stat.st_size, "sha256": digest.hexdigest()}
+        _save_hash_index(index)
+        return digest.hexdigest(), stat.st_mtime
+
+
+def _cache_key(path, reader_name, options):
+    sha, mtime = file_hash(path)
+    raw = json.dumps([CACHE_VERSION, sha, mtime, reader_name, options], sort_keys=True, default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def _find_cached(key):
+    for ext in (".parquet", ".pkl"):
+        path = os.path.join(CACHE_DIR, key + ext)
+        if os.path.exists(path):
+            return path
+    return None
+
+
+def _read_cached(path):
+    if path.endswith(".parquet"):
+        return pd.read_parquet(path)
+    return pd.read_pickle(path)
+
+
+def _write_cached(key, df):
+    """บันทึกเป็น Parquet ถ้าทำได้ ถ้าไม่ได้ (ไม่มี pyarrow หรือคอลัมน์ชนิดผสม) ใช้ pickle แทน"""
+    path = os.path.join(CACHE_DIR, key + ".parquet")
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        df.to_parquet(tmp_path, index=True)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        path = os.path.join(CACHE_DIR, key + ".pkl")
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        df.to_pickle(tmp_path)
+    os.replace(tmp_path, path)
+    return path
+
+
+def evict(max_bytes=None):
+    """ลบไฟล์แคชที่ใช้ล่าสุดนานที่สุด (LRU ตาม mtime) จนขนาดรวมไม่เกิน max_bytes"""
+    max_bytes = MAX_CACHE_BYTES if max_bytes is None else max_bytes
+    if not os.path.isdir(CACHE_DIR):
+        return 0
+    entries = []
+    for name in os.listdir(CACHE_DIR):
+        if name.endswith((".parquet", ".pkl")):
+            path = os.path.join(CACHE_DIR, name)
+            stat = os.stat(path)
+            entries.append((stat.st_mtime, stat.st_size, path))
+    total = sum(size for _, size, _ in entries)
+    removed = 0
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+            total -= size
+            removed += 1
+        except OSError:
+            continue
+    return removed
+
+
+def cached_read(path, reader, reader_name=None, **kwargs):
+    """
+    อ่านไฟล์ผ่านแคช: ถ้าเคย parse ไฟล์เดียวกัน (hash + mtime + options เดียวกัน) จะอ่านจากแคชแทน
+    reader คือฟังก์ชันอ่านไฟล์จริง เช่น pd.read_excel
+    """
+    reader_name = reader_name or getattr(reader, "__name__", str(reader))
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        key = _cache_key(path, reader_name, kwargs)
+        cached = _find_cached(key)
+        if cached:
+            df = _read_cached(cached)
+            os.utime(cached)  # อัปเดตเวลาใช้งานล่าสุดสำหรับ LRU
+            print(f"⚡ ใช้ข้อมูลจากแคช: {os.path.basename(path)} ({len(df)} แถว)")
+            return df
+    except Exception as e:
+        print(f"⚠️ อ่านแคชไม่สำเร็จ ({os.path.basename(path)}): {e}")
+        key = None
+
+    df = reader(path, **kwargs)
+    if key is not None and isinstance(df, pd.DataFrame):
+        try:
+            _write_cached(key, df)
+            evict()
+        except Exception as e:
+            print(f"⚠️ บันทึกแคชไม่สำเร็จ ({os.path.basename(path)}): {e}")
+    return df
+
+
+def read_cached_columns(path, columns, reader_name, **kwargs):
+    """
+    อ่านเฉพาะบางคอลัมน์จากแคชของไฟล์ที่เคย parse แล้ว (ไม่ parse ไฟล์จริง)
+    คืน None ถ้ายังไม่มีแคชหรืออ่านไม่ได้
+    """
+    try:
+        cached = _find_cached(_cache_key(path, reader_name, kwargs))
+        if not cached:
+            return None
+        if cached.endswith(".parquet"):
+            return pd.read_parquet(cached, columns=list(columns))
+        return _read_cached(cached)[list(columns)]
+    except Exception:
+        return None
+
+
+def read_excel_cached(path, **kwargs):
+    return cached_read(path, pd.read_excel, "read_excel", **kwargs)
+
+
+def read_csv_cached(path, **kwargs):
+    return cached_read(path, pd.read_csv, "read_csv", **kwargs)
+
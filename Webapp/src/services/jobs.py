@@ -0,0 +1,213 @@
+import os
+import sys
+import json
+import time
+import uuid
+import threading
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+
+from services.runner import execute_function_with_data, publish_outputs
+from services.result_view import save_result_data
+from services.progress import JsonlProgressSink, progress_sink, read_events
+
+# สถานะของงาน (job) ที่รองรับ
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+FINISHED_STATES = (JOB_DONE, JOB_FAILED)
+
+DEFAULT_MAX_WORKERS = 2
+
+
+def _job_file(jobs_dir, job_id):
+    return os.path.join(jobs_dir, f"{job_id}.json")
+
+
+def events_file(jobs_dir, job_id):
+    return os.path.join(jobs_dir, f"{job_id}.events.jsonl")
+
+
+def job_output_dir(jobs_dir, job_id):
+    """โฟลเดอร์ผลลัพธ์ของงาน: งานที่รันพร้อมกันจึงไม่เขียนทับไฟล์ผลลัพธ์ชื่อเดียวกัน (เช่น WB_AUTO_UPH_RESULT.xlsx)"""
+    return os.path.join(jobs_dir, job_id)
+
+
+def read_job(jobs_dir, job_id):
+    """อ่านสถานะงานจากไฟล์ (คืน None ถ้าไม่พบ)"""
+    path = _job_file(jobs_dir, job_id)
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def write_job(jobs_dir, job):
+    """บันทึกสถานะงานลงไฟล์แบบ atomic (เขียนไฟล์ชั่วคราวแล้ว replace)"""
+    job["updated_at"] = time.time()
+    path = _job_file(jobs_dir, job["id"])
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(job, f, ensure_ascii=False, default=str)
+    os.replace(tmp_path, path)
+    return job
+
+
+def update_job(jobs_dir, job_id, **fields):
+    job = read_job(jobs_dir, job_id) or {"id": job_id}
+    job.update(fields)
+    return write_job(jobs_dir, job)
+
+
+def _pid_alive(pid):
+    """ตรวจสอบว่า process ที่เป็นเจ้าของงานยังทำงานอยู่หรือไม่"""
+    if not pid:
+        return False
+    if sys.platform == "win32":
+        import ctypes
+        handle = ctypes.windll.kernel32.OpenProcess(0x1000, False, pid)  # PROCESS_QUERY_LIMITED_INFORMATION
+        if not handle:
+            return False
+        ctypes.windll.kernel32.CloseHandle(handle)
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _run_job(jobs_dir, job_id, func_name, file_path, temp_root, start_date, end_date, operation, full_refresh=False):
+    """
+    ฟังก์ชันที่รันใน worker process: เรียกฟังก์ชันวิเคราะห์และคืนผลลัพธ์
+    ผลลัพธ์อยู่ใน job_output_dir ส่วน temp_root รับเฉพาะไฟล์ใน PUBLISHED_OUTPUTS ที่ส่วนอื่นของเว็บใช้ต่อ
+    """
+    update_job(jobs_dir, job_id, state=JOB_RUNNING, started_at=time.time(), worker_pid=os.getpid())
+    # ฟังก์ชันเขียนผลลัพธ์ลงโฟลเดอร์ของงานเอง path ที่บันทึกไว้ในงานจึงไม่ถูกงานอื่นเขียนทับหลังงานจบ
+    output_dir = job_output_dir(jobs_dir, job_id)
+    os.makedirs(output_dir, exist_ok=True)
+    try:
+        with progress_sink(JsonlProgressSink(events_file(jobs_dir, job_id))):
+            export_file_path, result_df, artifacts = execute_function_with_data(
+                func_name, file_path, output_dir, start_date, end_date, operation, full_refresh
+            )
+    except Exception as e:
+        print(f"❌ Job {job_id} ({func_name}) error: {e}")
+        return {
+            "export_file_path": None,
+            "error": f"เกิดข้อผิดพลาดในการเรียกใช้ฟังก์ชัน {func_name}: {e}",
+            "traceback": traceback.format_exc(),
+        }
+    if not export_file_path:
+        return {
+            "export_file_path": None,
+            "error": f"ฟังก์ชัน {func_name} ไม่ได้สร้างไฟล์ผลลัพธ์ กรุณาตรวจสอบข้อมูลที่เลือก",
+        }
+    try:
+        publish_outputs(func_name, output_dir, temp_root)
+    except Exception as e:
+        print(f"⚠️ คัดลอกไฟล์ผลลัพธ์ของ job {job_id} ไปที่ {temp_root} ไม่สำเร็จ: {e}")
+    result_data_path = None
+    if result_df is not None:
+        # เก็บ DataFrame ผลลัพธ์แบบ columnar ไว้คู่กับงาน หน้าแสดงผลจะได้ไม่ต้อง parse ไฟล์ Excel/CSV กลับมา
+        try:
+            result_data_path = save_result_data(result_df, os.path.join(jobs_dir, f"{job_id}.result"))
+        except Exception as e:
+            print(f"⚠️ บันทึกข้อมูลผลลัพธ์ของ job {job_id} ไม่สำเร็จ: {e}")
+    return {"export_file_path": export_file_path, "result_data_path": result_data_path, "artifacts": artifacts, "error": None}
+
+
+class JobManager:
+    """
+    จัดการงานประมวลผลเบื้องหลัง (queued → running → done/failed)
+    - รันฟังก์ชันใน process pool ที่จำกัดจำนวน worker
+    - เก็บสถานะงานเป็นไฟล์ JSON ใน jobs_dir เพื่อให้ผลลัพธ์ไม่หายเมื่อ restart
+    """
+
+    def __init__(self, jobs_dir, max_workers=None):
+        self.jobs_dir = jobs_dir
+        self.max_workers = max_workers or int(os.environ.get("JOB_MAX_WORKERS", DEFAULT_MAX_WORKERS))
+        self._executor = None
+        self._futures = {}
+        self._lock = threading.Lock()
+        os.makedirs(self.jobs_dir, exist_ok=True)
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+            return self._executor
+
+    def submit(self, func_name, file_path, temp_root, start_date=None, end_date=None, operation=None, full_refresh=False):
+        """ส่งงานเข้าคิวและคืน job id ทันที"""
+        job_id = uuid.uuid4().hex
+        write_job(self.jobs_dir, {
+            "id": job_id,
+            "state": JOB_QUEUED,
+            "func_name": func_name,
+            "operation": operation,
+            "file_path": file_path,
+            "start_date": start_date,
+            "end_date": end_date,
+            "full_refresh": full_refresh,
+            "owner_pid": os.getpid(),
+            "created_at": time.time(),
+            "export_file_path": None,
+            "error": None,
+        })
+        future = self._get_executor().submit(
+            _run_job, self.jobs_dir, job_id, func_name, file_path, temp_root, start_date, end_date, operation, full_refresh
+        )
+        self._futures[job_id] = future
+        future.add_done_callback(lambda f, job_id=job_id: self._on_done(job_id, f))
+        return job_id
+
+    def _on_done(self, job_id, future):
+        try:
+            outcome = future.result()
+        except Exception as e:
+            # worker process ตายหรือ pickle ผลลัพธ์ไม่ได้
+            outcome = {"export_file_path": None, "error": f"worker error: {e}"}
+        state = JOB_DONE if outcome.get("export_file_path") else JOB_FAILED
+        update_job(self.jobs_dir, job_id, state=state, finished_at=time.time(), **outcome)
+        self._futures.pop(job_id, None)
+
+    def get(self, job_id):
+        """คืนสถานะงานล่าสุด (งานที่ค้างจาก process ที่ตายไปแล้วจะถูกตั้งเป็น failed)"""
+        job = read_job(self.jobs_dir, job_id)
+        if job is None:
+            return None
+        if job.get("state") not in FINISHED_STATES and job_id not in self._futures:
+            if not _pid_alive(job.get("owner_pid")):
+                job = update_job(
+                    self.jobs_dir, job_id, state=JOB_FAILED, finished_at=time.time(),
+                    error="งานถูกยกเลิกเนื่องจาก server ถูก restart ระหว่างประมวลผล",
+                )
+        return job
+
+    def wait(self, job_id, timeout=None, poll_interval=0.5):
+        """รอจนงานเสร็จหรือหมดเวลา แล้วคืนสถานะล่าสุด"""
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            job = self.get(job_id)
+            if job is None or job.get("state") in FINISHED_STATES:
+                return job
+            if deadline is not None and time.time() >= deadline:
+                return job
+            time.sleep(poll_interval)
+
+    def events(self, job_id, offset=0):
+        """progress event ของงานตั้งแต่ลำดับ offset"""
+        return read_events(events_file(self.jobs_dir, job_id), offset)
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=wait)
+                self._executor = None
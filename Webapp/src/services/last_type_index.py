@@ -0,0 +1,81 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from services.reference_data import get_reference
+
+# ไฟล์ผลลัพธ์ของ PNP_CHANGE_TYPE ที่รันจากหน้าเว็บ (output_dir = temp) ใช้เป็นค่าเริ่มต้นของ /api/last_type
+LAST_TYPE_OUTPUT = os.environ.get("LAST_TYPE_OUTPUT") or os.path.join(os.getcwd(), "temp", "Last_Type.xlsx")
+
+# คีย์ที่ใช้ค้นหา: bom_no อย่างเดียว หรือ bom_no + package_code + product_no
+BOM_KEY = ('bom_no',)
+COMPOSITE_KEY = ('bom_no', 'package_code', 'product_no')
+
+
+def _key_text(series):
+    """แปลงค่าคีย์เป็นข้อความเพื่อให้ BOM จาก Excel (ตัวเลข), CSV และ JSON (ข้อความ) เทียบกันได้"""
+    if pd.api.types.is_float_dtype(series):
+        values = series.dropna()
+        if (values % 1 == 0).all():
+            series = series.astype('Int64')
+    return series.astype(str).str.strip()
+
+
+def _key_index(df, key_cols):
+    if len(key_cols) == 1:
+        return pd.Index(_key_text(df[key_cols[0]]))
+    return pd.MultiIndex.from_arrays([_key_text(df[col]) for col in key_cols])
+
+
+class LastTypeIndex:
+    """
+    index ของ Last_type ตาม BOM ที่สร้างครั้งเดียวจากผลของ PNP_CHANGE_TYPE แล้วค้นหาเป็นชุดด้วย reindex
+    (BOM ที่มีหลาย Last_type จะได้หลายแถวเหมือน merge แบบเดิม)
+    """
+
+    def __init__(self, df_last):
+        df_last = df_last.rename(columns={'assy_pack_type': 'Last_type'})
+        self.rows = len(df_last)
+        self.maps = {}
+        for key_cols in (BOM_KEY, COMPOSITE_KEY):
+            if all(col in df_last.columns for col in key_cols):
+                pairs = df_last[list(key_cols) + ['Last_type']].drop_duplicates()
+                types = pd.Series(pairs['Last_type'].to_numpy(), index=_key_index(pairs, key_cols))
+                # คีย์ → list ของ Last_type ตามลำดับที่เจอ (index ไม่ซ้ำ จึงค้นหาด้วย hash ได้ทันที)
+                self.maps[key_cols] = types.groupby(level=list(range(len(key_cols))), sort=False).agg(list)
+
+    def __len__(self):
+        return self.rows
+
+    def key_for(self, columns):
+        """ใช้คีย์รวมเมื่อข้อมูลที่ค้นหามี package_code และ product_no และ index รองรับ"""
+        if COMPOSITE_KEY in self.maps and all(col in columns for col in COMPOSITE_KEY):
+            return COMPOSITE_KEY
+        return BOM_KEY
+
+    def lookup(self, df_keys):
+        """คืน df_keys พร้อมคอลัมน์ Last_type (ไม่พบ = NaN)"""
+        key_cols = self.key_for(df_keys.columns)
+        found = self.maps[key_cols].reindex(_key_index(df_keys, key_cols)).to_numpy()
+        repeats = np.array([len(v) if isinstance(v, list) else 1 for v in found], dtype=np.int64)
+        result = df_keys.iloc[np.repeat(np.arange(len(df_keys)), repeats)].reset_index(drop=True)
+        result['Last_type'] = [t for v in found for t in (v if isinstance(v, list) else [np.nan])]
+        return result
+
+
+def _load_index(path):
+    return LastTypeIndex(pd.read_excel(path))
+
+
+def get_last_type_index(path=None):
+    """
+    index ที่อยู่ใน memory ของ process (โหลดใหม่อัตโนมัติเมื่อไฟล์ต้นทางเปลี่ยน)
+    path: ไฟล์ Last_Type.xlsx หรือ None = ผลลัพธ์ล่าสุดของ PNP_CHANGE_TYPE (LAST_TYPE_OUTPUT)
+    ใช้ไฟล์ผลลัพธ์แทนสถานะสะสม เพราะสถานะอาจครอบคลุมไฟล์มากกว่าที่เลือกในการรันล่าสุด
+    คืน None ถ้ายังไม่มีข้อมูล
+    """
+    path = path or LAST_TYPE_OUTPUT
+    if not os.path.exists(path):
+        return None
+    return get_reference("last_type", path, _load_index)
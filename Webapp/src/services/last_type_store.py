@@ -0,0 +1,75 @@
+import os
+import json
+import threading
+
+import pandas as pd
+
+# สถานะสะสมของ PNP_CHANGE_TYPE: 1 แถวต่อ BOM (type/วันที่แรกและล่าสุด, สถานะการเปลี่ยน)
+# เก็บเป็นไฟล์ columnar (Parquet) พร้อม manifest ของไฟล์รายเดือนที่รวมเข้าไปแล้ว (ตาม sha256 ของไฟล์)
+STORE_DIR = os.environ.get("LAST_TYPE_STORE_DIR") or os.path.join(os.getcwd(), "temp", "last_type_store")
+STORE_VERSION = 1
+
+_lock = threading.Lock()
+
+
+def _manifest_path():
+    return os.path.join(STORE_DIR, "manifest.json")
+
+
+def _read_manifest():
+    try:
+        with open(_manifest_path(), "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if manifest.get("version") != STORE_VERSION:
+        return None
+    return manifest
+
+
+def read_state_file(path):
+    return pd.read_parquet(path) if path.endswith(".parquet") else pd.read_pickle(path)
+
+
+def load_state():
+    """
+    คืน (state, folded)
+    - state: DataFrame สถานะของทุก BOM หรือ None ถ้ายังไม่มี
+    - folded: {sha256: ชื่อไฟล์} ของไฟล์ที่รวมเข้า state แล้ว
+    """
+    with _lock:
+        manifest = _read_manifest()
+        if not manifest:
+            return None, {}
+        path = os.path.join(STORE_DIR, manifest["state_file"])
+        try:
+            state = read_state_file(path)
+        except Exception as e:
+            print(f"⚠️ อ่านสถานะ Last_Type ไม่สำเร็จ จะคำนวณใหม่ทั้งหมด: {e}")
+            return None, {}
+        return state, manifest.get("files", {})
+
+
+def save_state(state, folded):
+    """บันทึกสถานะ (Parquet ถ้าทำได้ ไม่เช่นนั้น pickle) แล้วจึงเขียน manifest ที่ชี้ไปยังไฟล์นั้น"""
+    with _lock:
+        os.makedirs(STORE_DIR, exist_ok=True)
+        name = "state.parquet"
+        tmp_path = os.path.join(STORE_DIR, f"{name}.{os.getpid()}.tmp")
+        try:
+            state.to_parquet(tmp_path, index=False)
+        except Exception:
+            # คอลัมน์ key ที่มีชนิดผสม (เช่นตัวเลขจาก Excel + ข้อความจาก CSV) เขียน Parquet ไม่ได้
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            name = "state.pkl"
+            tmp_path = os.path.join(STORE_DIR, f"{name}.{os.getpid()}.tmp")
+            state.to_pickle(tmp_path)
+        os.replace(tmp_path, os.path.join(STORE_DIR, name))
+
+        manifest = {"version": STORE_VERSION, "state_file": name, "rows": len(state), "files": folded}
+        tmp_manifest = f"{_manifest_path()}.{os.getpid()}.tmp"
+        with open(tmp_manifest, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, ensure_ascii=False)
+        os.replace(tmp_manifest, _manifest_path())
+
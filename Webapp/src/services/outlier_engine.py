@@ -0,0 +1,211 @@
+import numpy as np
+import pandas as pd
+
+from services.progress import report_progress
+
+# รูปแบบการตัด outliers ที่รองรับ
+# - "chained":   แบบ DA_AUTO_UPH / PNP_AUTO_UPH (Z-Score ddof=1 → IQR บนข้อมูลหลัง Z-Score,
+#                เช็คว่ายังมี outlier ด้วยกฎ IQR, ติดป้าย Outlier_Method)
+# - "wire_bond": แบบ WireBondingAnalyzer (scipy zscore ddof=0 และ IQR บนข้อมูลรอบปัจจุบัน,
+#                เช็คว่ายังมี outlier ด้วย |z| > 3)
+VARIANTS = ("chained", "wire_bond")
+
+LABEL_FEW_POINTS = 'ไม่ตัด (ข้อมูลน้อย)'
+
+
+def _lerp(a, b, t):
+    """linear interpolation แบบเดียวกับ numpy.percentile (ให้ค่าตรงกับ Series.quantile)"""
+    diff = b - a
+    return np.where(t >= 0.5, b - diff * (1 - t), a + diff * t)
+
+
+class _Segments:
+    """
+    ข้อมูลที่เรียงตามกลุ่มไว้ครั้งเดียว แล้วคำนวณสถิติของทุกกลุ่มพร้อมกันบนแถวที่ยัง active
+    ด้วย bincount/segment index แทนการวนลูปทีละกลุ่ม
+    """
+
+    def __init__(self, codes, values, n_groups, zero_std_eps=None):
+        self.codes = codes
+        self.values = values
+        self.n_groups = n_groups
+        self.zero_std_eps = zero_std_eps
+        starts = np.flatnonzero(np.r_[True, codes[1:] != codes[:-1]]) if len(codes) else np.array([], dtype=np.int64)
+        # ค่าอ้างอิงต่อกลุ่ม: ลบออกก่อนหาค่าเฉลี่ยเพื่อให้กลุ่มที่ค่าเท่ากันทั้งหมดได้ std = 0 พอดี
+        self.ref = np.fmax.reduceat(values, starts) if len(codes) else np.array([])
+        # ลำดับแถวที่เรียงตามค่าภายในกลุ่ม ใช้หา quantile
+        self.by_value = np.lexsort((values, codes))
+
+    def counts(self, active):
+        return np.bincount(self.codes[active], minlength=self.n_groups)
+
+    def mean_std(self, active, ddof):
+        codes = self.codes[active]
+        shifted = self.values[active] - self.ref[codes]
+        n = np.bincount(codes, minlength=self.n_groups)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            offset = np.bincount(codes, weights=shifted, minlength=self.n_groups) / n
+            dev = shifted - offset[codes]
+            var = np.bincount(codes, weights=dev * dev, minlength=self.n_groups) / (n - ddof)
+        var[n - ddof <= 0] = np.nan
+        return self.ref + offset, np.sqrt(var)
+
+    def zscore(self, active, ddof):
+        """z-score ของทุกแถว (แถวที่ไม่ active ได้ NaN)"""
+        mean, std = self.mean_std(active, ddof)
+        if self.zero_std_eps is not None:
+            # เหมือน scipy.stats.zscore: กลุ่มที่ std ≈ 0 ได้ z เป็น NaN
+            std = np.where(std <= np.abs(self.zero_std_eps * mean), np.nan, std)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            z = (self.values - mean[self.codes]) / std[self.codes]
+        z[~active] = np.nan
+        return z, std
+
+    def quartiles(self, active):
+        """Q1, Q3 ของแต่ละกลุ่ม (linear interpolation แบบ Series.quantile)"""
+        positions = self.by_value[active[self.by_value]]
+        n = np.bincount(self.codes[positions], minlength=self.n_groups)
+        starts = np.concatenate(([0], np.cumsum(n)[:-1]))
+        has = n > 0
+        result = []
+        for q in (0.25, 0.75):
+            quantile = np.full(self.n_groups, np.nan)
+            virtual = (n[has] - 1) * q
+            lower = np.floor(virtual).astype(np.int64)
+            upper = np.minimum(lower + 1, n[has] - 1)
+            a = self.values[positions[starts[has] + lower]]
+            b = self.values[positions[starts[has] + upper]]
+            quantile[has] = _lerp(a, b, virtual - lower)
+            result.append(quantile)
+        return result[0], result[1]
+
+    def iqr_inside(self, active):
+        """แถวที่อยู่ในช่วง [Q1 - 1.5*IQR, Q3 + 1.5*IQR] ของกลุ่มตัวเอง"""
+        q1, q3 = self.quartiles(active)
+        iqr = q3 - q1
+        lower = (q1 - 1.5 * iqr)[self.codes]
+        upper = (q3 + 1.5 * iqr)[self.codes]
+        return active & (self.values >= lower) & (self.values <= upper)
+
+    def any_per_group(self, mask):
+        return np.bincount(self.codes[mask], minlength=self.n_groups) > 0
+
+    def has_zscore_outlier(self, active):
+        """เหมือน WireBondingAnalyzer._has_outliers: มีอย่างน้อย 3 จุดและมี |z| > 3"""
+        z, _ = self.zscore(active, ddof=0)
+        with np.errstate(invalid="ignore"):
+            outlier = np.abs(z) > 3
+        return (self.counts(active) >= 3) & self.any_per_group(outlier)
+
+
+def remove_outliers_grouped(df, value_col, group_cols, variant="chained", max_iter=20, min_points=15):
+    """
+    ตัด outliers แบบวนลูป Z-Score/IQR ให้ทุกกลุ่ม (เช่น BOM × Machine Model) พร้อมกันในรอบเดียว
+
+    Returns:
+        keep (pd.Series[bool]): แถวที่เหลือหลังตัด (index เดียวกับ df)
+        summary (pd.DataFrame): 1 แถวต่อกลุ่ม มี group_cols, Outlier_Method,
+                                DataPoints_Before, DataPoints_After
+    """
+    if variant not in VARIANTS:
+        raise ValueError(f"ไม่รู้จักรูปแบบการตัด outliers: {variant}")
+
+    group_ids = df.groupby(group_cols, sort=True).ngroup().to_numpy(dtype=float)
+    in_group = ~np.isnan(group_ids)
+    values_all = pd.to_numeric(df[value_col], errors='coerce').to_numpy(dtype=float)
+
+    # เรียงแถวตามกลุ่มครั้งเดียว (คงลำดับเดิมภายในกลุ่ม) ใช้ได้ทุกรอบ
+    rows = np.flatnonzero(in_group)
+    codes = group_ids[rows].astype(np.int64)
+    order = np.argsort(codes, kind="stable")
+    rows, codes = rows[order], codes[order]
+    values = values_all[rows]
+    n_groups = int(codes.max()) + 1 if len(codes) else 0
+    zero_std_eps = np.finfo(float).eps if variant == "wire_bond" else None
+    seg = _Segments(codes, values, n_groups, zero_std_eps)
+
+    before = np.bincount(codes, minlength=n_groups)
+    labels = np.empty(n_groups, dtype=object)
+    is_nan = np.isnan(values)
+
+    if variant == "chained":
+        # แถวที่ UPH แปลงเป็นตัวเลขไม่ได้ถูกตัดทิ้งก่อน (เหมือน dropna เดิม)
+        current = ~is_nan
+    else:
+        current = np.ones(len(values), dtype=bool)
+    final = current.copy()
+    running = seg.counts(current) >= min_points
+    labels[~running] = LABEL_FEW_POINTS
+
+    if variant == "wire_bond":
+        # scipy zscore ให้ NaN ทั้งกลุ่มถ้ามีค่า NaN → กลุ่มนั้นถูกตัดทั้งหมดตั้งแต่ Z-Score รอบแรก
+        nan_groups = seg.any_per_group(is_nan) & running
+        final[nan_groups[codes]] = False
+        labels[nan_groups] = 'Z-Score Loop ×1'
+        running &= ~nan_groups
+
+    for i in range(max_iter):
+        if not running.any():
+            break
+        active = current & running[codes]
+        report_progress("outliers", f"รอบที่ {i+1}", rows=int(active.sum()),
+                        groups_done=int(n_groups - running.sum()), groups_total=n_groups)
+
+        if variant == "chained":
+            z, std = seg.zscore(active, ddof=1)
+            z_keep = active & (((z >= -3) & (z <= 3)) | (std == 0)[codes])
+            iqr_keep = seg.iqr_inside(z_keep)
+            z_done = running & ~seg.any_per_group(z_keep & ~iqr_keep)
+            iqr_check = seg.iqr_inside(iqr_keep)
+            iqr_done = running & ~z_done & ~seg.any_per_group(iqr_keep & ~iqr_check)
+        else:
+            z, _ = seg.zscore(active, ddof=0)
+            z_keep = active & (z >= -3) & (z <= 3)
+            z_done = running & ~seg.has_zscore_outlier(z_keep)
+            iqr_keep = seg.iqr_inside(active)
+            iqr_done = running & ~z_done & ~seg.has_zscore_outlier(iqr_keep)
+
+        z_rows = z_done[codes]
+        iqr_rows = iqr_done[codes]
+        final[z_rows] = z_keep[z_rows]
+        final[iqr_rows] = iqr_keep[iqr_rows]
+        labels[z_done] = f'Z-Score Loop ×{i+1}'
+        labels[iqr_done] = f'IQR Loop ×{i+1}'
+
+        running &= ~(z_done | iqr_done)
+        still = running[codes]
+        current[still] = iqr_keep[still]
+        final[still] = iqr_keep[still]
+
+    labels[running] = f'IQR-Z-Score Loop ×{max_iter}+'
+
+    keep = np.zeros(len(df), dtype=bool)
+    keep[rows[final]] = True
+    after = np.bincount(codes[final], minlength=n_groups)
+
+    keys = df.iloc[rows].groupby(codes, sort=True)[group_cols].first().reset_index(drop=True)
+    summary = keys.assign(
+        Outlier_Method=labels,
+        DataPoints_Before=before,
+        DataPoints_After=after,
+    )
+    report_progress("outliers", "ตัด outliers เสร็จ", rows=int(keep.sum()),
+                    groups_done=n_groups, groups_total=n_groups)
+    return pd.Series(keep, index=df.index), summary
+
+
+def attach_group_summary(df, keep, summary, group_cols, columns):
+    """
+    คืนเฉพาะแถวที่เหลือ เรียงตามกลุ่ม (ลำดับเดียวกับ groupby) และแนบคอลัมน์สรุปของกลุ่ม
+    columns: รายชื่อคอลัมน์จาก summary ที่ต้องการแนบ
+    """
+    kept = df[keep.to_numpy()]
+    group_ids = kept.groupby(group_cols, sort=True).ngroup().to_numpy()
+    order = np.argsort(group_ids, kind="stable")
+    kept = kept.iloc[order].copy()
+    # ngroup ของแถวที่เหลืออาจข้ามกลุ่มที่ถูกตัดหมด จึง map ผ่าน key ของกลุ่มแทน
+    lookup = summary.set_index(group_cols)
+    index = pd.MultiIndex.from_frame(kept[group_cols]) if len(group_cols) > 1 else pd.Index(kept[group_cols[0]])
+    for col in columns:
+        kept[col] = lookup[col].reindex(index).to_numpy()
+    return kept
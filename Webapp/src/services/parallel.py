@@ -0,0 +1,41 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+# จำนวน worker เริ่มต้นสำหรับงานแบบขนาน (ตั้งค่าได้ผ่าน env PARALLEL_WORKERS)
+DEFAULT_MAX_WORKERS = 4
+
+
+def resolve_workers(max_workers=None, env_name="PARALLEL_WORKERS"):
+    """
+    หาจำนวน worker ที่จะใช้: ค่าที่ส่งมา > env > ค่าเริ่มต้น (ไม่เกินจำนวน core ของเครื่อง)
+    คืน 1 หมายถึงให้รันแบบปกติใน process เดิม
+    """
+    if max_workers is None:
+        max_workers = os.environ.get(env_name) or min(DEFAULT_MAX_WORKERS, os.cpu_count() or 1)
+    return max(1, int(max_workers))
+
+
+def parallel_map(func, items, max_workers=None, on_result=None):
+    """
+    เรียก func กับทุก item ใน process pool แล้วคืนผลลัพธ์ตามลำดับของ items เสมอ
+    (ผลลัพธ์จึงเหมือนกันทุกครั้งไม่ว่าจะใช้กี่ worker)
+    - func ต้องเป็นฟังก์ชันระดับโมดูลเพื่อให้ส่งข้าม process ได้
+    - on_result(i, total) ถูกเรียกใน process หลักเมื่อแต่ละ item เสร็จ (ใช้รายงานความคืบหน้า)
+    """
+    items = list(items)
+    workers = min(resolve_workers(max_workers), len(items))
+    if workers <= 1:
+        results = []
+        for i, item in enumerate(items, 1):
+            results.append(func(item))
+            if on_result:
+                on_result(i, len(items))
+        return results
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        results = []
+        for i, result in enumerate(executor.map(func, items), 1):
+            results.append(result)
+            if on_result:
+                on_result(i, len(items))
+        return results
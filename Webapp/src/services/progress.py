@@ -0,0 +1,94 @@
+import os
+import json
+import time
+from contextlib import contextmanager
+
+# sink ปัจจุบันที่รับ progress event (None = ไม่ส่ง event ไปไหน ใช้แค่ print เดิม)
+_sink = None
+_stage_started = {}
+_last_emit = {}
+
+# เว้นระยะขั้นต่ำระหว่าง event ของ stage เดียวกัน เพื่อไม่ให้เขียนไฟล์ทุกกลุ่ม
+MIN_INTERVAL = 0.25
+
+
+class JsonlProgressSink:
+    """เขียน progress event ต่อท้ายไฟล์ JSON Lines (1 บรรทัดต่อ 1 event)"""
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    def __call__(self, event):
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(event, ensure_ascii=False, default=str) + "\n")
+
+
+def set_progress_sink(sink):
+    global _sink
+    _sink = sink
+    _stage_started.clear()
+    _last_emit.clear()
+
+
+@contextmanager
+def progress_sink(sink):
+    """ตั้ง sink ชั่วคราวระหว่างรันงาน แล้วคืนค่าเดิมเมื่อจบ"""
+    previous = _sink
+    set_progress_sink(sink)
+    try:
+        yield sink
+    finally:
+        set_progress_sink(previous)
+
+
+def report_progress(stage, message=None, rows=None, groups_done=None, groups_total=None):
+    """
+    ส่ง progress event ของ pipeline
+    - stage: ชื่อขั้นตอน เช่น 'load', 'outliers', 'group_average'
+    - rows: จำนวนแถวที่ประมวลผล ณ ขั้นตอนนี้
+    - groups_done / groups_total: ความคืบหน้าของการวนกลุ่ม (ใช้คำนวณ rate และ ETA)
+    """
+    if _sink is None:
+        return
+    now = time.time()
+    started = _stage_started.setdefault(stage, now)
+    finished = groups_total is not None and groups_done is not None and groups_done >= groups_total
+    if groups_done is not None and not finished and now - _last_emit.get(stage, 0) < MIN_INTERVAL:
+        return
+    _last_emit[stage] = now
+
+    elapsed = now - started
+    event = {
+        "stage": stage,
+        "message": message,
+        "rows": rows,
+        "groups_done": groups_done,
+        "groups_total": groups_total,
+        "elapsed": round(elapsed, 2),
+        "time": now,
+    }
+    if groups_done and groups_total and elapsed > 0:
+        rate = groups_done / elapsed
+        event["groups_per_sec"] = round(rate, 2)
+        event["eta_seconds"] = round((groups_total - groups_done) / rate, 1)
+    try:
+        _sink(event)
+    except Exception as e:
+        print(f"⚠️ ไม่สามารถส่ง progress event: {e}")
+
+
+def read_events(path, offset=0):
+    """อ่าน event จากไฟล์ JSON Lines เริ่มที่ลำดับ offset คืน list ของ (ลำดับ, event)"""
+    if not os.path.exists(path):
+        return []
+    events = []
+    with open(path, "r", encoding="utf-8") as f:
+        for i, line in enumerate(f):
+            if i < offset or not line.endswith("\n"):
+                continue
+            try:
+                events.append((i, json.loads(line)))
+            except ValueError:
+                continue
+    return events
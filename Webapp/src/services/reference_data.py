@@ -0,0 +1,99 @@
+import os
+import re
+import time
+import threading
+
+# ข้อมูลอ้างอิง (master file) ที่โหลดแล้วเก็บไว้ใน memory ของ process: {(name, path): entry}
+# entry = {"mtime", "size", "loaded_at", "data"}
+_registry = {}
+_lock = threading.Lock()
+
+# ไฟล์ stamp สำหรับสั่ง reload ข้าม process (worker ของ job pool ใช้ memory แยกจาก web server)
+# RELOAD_STAMP = reload ทุกชุด, RELOAD_STAMP.<name> = reload เฉพาะชุดนั้น
+RELOAD_STAMP = os.environ.get("REFERENCE_RELOAD_STAMP") or os.path.join(os.getcwd(), "temp", "reference_data.reload")
+
+
+def _stamp_path(name=None):
+    if name is None:
+        return RELOAD_STAMP
+    # name มาจาก query string ได้ จึงใช้เฉพาะตัวอักษรที่ปลอดภัยในชื่อไฟล์
+    return f"{RELOAD_STAMP}.{re.sub(r'[^A-Za-z0-9_-]', '_', name)}"
+
+
+def _mtime(path):
+    try:
+        return os.path.getmtime(path)
+    except OSError:
+        return 0
+
+
+def _reload_requested_at(name):
+    """เวลาล่าสุดที่สั่ง reload ชุด name (นับทั้งการสั่ง reload ทุกชุดและเฉพาะชุดนี้)"""
+    return max(_mtime(_stamp_path()), _mtime(_stamp_path(name)))
+
+
+def _touch(path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "a", encoding="utf-8"):
+        pass
+    os.utime(path)
+
+
+def get_reference(name, path, loader):
+    """
+    คืนข้อมูลอ้างอิงจาก memory ถ้ายังใช้ได้ ไม่เช่นนั้นเรียก loader(path) แล้วเก็บไว้
+    - โหลดใหม่อัตโนมัติเมื่อ mtime/ขนาดไฟล์เปลี่ยน หรือมีการสั่ง reload
+    - ผลลัพธ์ใช้ร่วมกันทั้ง process ห้ามแก้ไขข้อมูลที่ได้ (ให้ copy ก่อนถ้าจำเป็น)
+    """
+    path = os.path.abspath(path)
+    stat = os.stat(path)
+    key = (name, path)
+    with _lock:
+        entry = _registry.get(key)
+        if (entry and entry["mtime"] == stat.st_mtime and entry["size"] == stat.st_size
+                and entry["loaded_at"] >= _reload_requested_at(name)):
+            return entry["data"]
+
+        print(f"📚 โหลดข้อมูลอ้างอิง {name}: {os.path.basename(path)}")
+        data = loader(path)
+        _registry[key] = {
+            "mtime": stat.st_mtime,
+            "size": stat.st_size,
+            "loaded_at": time.time(),
+            "data": data,
+        }
+        return data
+
+
+def reload_references(name=None):
+    """
+    ล้างข้อมูลอ้างอิงใน memory (ทั้งหมด หรือเฉพาะ name) และแจ้ง process อื่นให้โหลดใหม่
+    ระบุ name แล้ว process อื่นจะโหลดใหม่เฉพาะชุดนั้น ชุดอื่นยังใช้ข้อมูลเดิมใน memory
+    """
+    with _lock:
+        keys = [key for key in _registry if name is None or key[0] == name]
+        for key in keys:
+            del _registry[key]
+    _touch(_stamp_path(name))
+    return [{"name": key[0], "path": key[1]} for key in keys]
+
+
+def _row_count(data):
+    if isinstance(data, tuple) and data:
+        data = data[0]
+    return len(data) if hasattr(data, "__len__") else None
+
+
+def reference_status():
+    """รายการข้อมูลอ้างอิงที่อยู่ใน memory ของ process นี้"""
+    with _lock:
+        return [
+            {
+                "name": name,
+                "path": path,
+                "mtime": entry["mtime"],
+                "loaded_at": entry["loaded_at"],
+                "rows": _row_count(entry["data"]),
+            }
+            for (name, path), entry in _registry.items()
+        ]
@@ -0,0 +1,148 @@
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from services.input_cache import read_excel_cached, read_csv_cached
+
+# ผลลัพธ์ที่เปิดดูล่าสุดเก็บไว้ใน memory ของ process (LRU) ส่วนสำเนา columnar บนดิสก์ใช้แคชของ input_cache
+MAX_CACHED_RESULTS = int(os.environ.get("RESULT_VIEW_CACHE_SIZE", 4))
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+MAX_DISTINCT_VALUES = 5000
+
+_cache = OrderedDict()
+_lock = threading.Lock()
+
+
+class ResultView:
+    """DataFrame ของไฟล์ผลลัพธ์ 1 ไฟล์ + ข้อความสำหรับค้นหาแต่ละแถว (สร้างเมื่อค้นหาครั้งแรก)"""
+
+    def __init__(self, df):
+        self.df = df.reset_index(drop=True)
+        self._search_text = None
+
+    @property
+    def search_text(self):
+        if self._search_text is None:
+            # เหมือนการค้นหาจากข้อความทั้งแถวในตาราง HTML เดิม
+            text = self.df.apply(_as_text).agg(" ".join, axis=1) if len(self.df.columns) else pd.Series("", index=self.df.index)
+            self._search_text = text.str.lower()
+        return self._search_text
+
+
+def _as_text(values):
+    # ใช้ map(str) แทน astype(str): pandas 2.0 แปลงคอลัมน์ object ที่โหลดจาก pickle ทับข้อมูลเดิม
+    return values.map(str)
+
+
+def _read_result(path):
+    if path.endswith(".xlsx"):
+        return read_excel_cached(path)
+    if path.endswith(".csv"):
+        return read_csv_cached(path)
+    raise ValueError(f"ไม่รองรับไฟล์ผลลัพธ์ชนิดนี้: {os.path.basename(path)}")
+
+
+def save_result_data(df, base_path):
+    """
+    บันทึก DataFrame ผลลัพธ์ของงานเป็น Parquet (ถ้าไม่ได้ใช้ pickle) คืน path ที่บันทึก
+    base_path: path ที่ยังไม่มีนามสกุล
+    """
+    path = f"{base_path}.parquet"
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        df.to_parquet(tmp_path, index=False)
+    except Exception:
+        # คอลัมน์ชนิดผสม (เช่น ตัวเลข + ข้อความ) เขียน Parquet ไม่ได้
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        path = f"{base_path}.pkl"
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        df.reset_index(drop=True).to_pickle(tmp_path)
+    os.replace(tmp_path, path)
+    return path
+
+
+def read_result_data(path):
+    return pd.read_parquet(path) if path.endswith(".parquet") else pd.read_pickle(path)
+
+
+def get_result_view(path, data_path=None):
+    """
+    โหลดไฟล์ผลลัพธ์ (จาก memory ถ้าไฟล์ไม่เปลี่ยน) คืน ResultView
+    data_path: DataFrame ผลลัพธ์ที่งานบันทึกไว้ (ถ้ามีจะใช้แทนการอ่านไฟล์ Excel/CSV)
+    """
+    if data_path and os.path.exists(data_path):
+        path, reader = data_path, read_result_data
+    else:
+        reader = _read_result
+    path = os.path.abspath(path)
+    stat = os.stat(path)
+    key = (path, stat.st_mtime, stat.st_size)
+    with _lock:
+        view = _cache.get(key)
+        if view is not None:
+            _cache.move_to_end(key)
+            return view
+    view = ResultView(reader(path))
+    with _lock:
+        _cache[key] = view
+        while len(_cache) > MAX_CACHED_RESULTS:
+            _cache.popitem(last=False)
+    return view
+
+
+def _sorted_positions(df, positions, column, ascending):
+    values = df[column].iloc[positions]
+    try:
+        order = values.sort_values(ascending=ascending, kind="mergesort", na_position="last")
+    except TypeError:
+        # คอลัมน์ที่มีชนิดข้อมูลผสมเรียงเป็นข้อความแทน
+        order = _as_text(values).where(values.notna()).sort_values(ascending=ascending, kind="mergesort", na_position="last")
+    # df ใช้ RangeIndex (reset_index แล้ว) label จึงเป็นตำแหน่งแถว
+    return order.index.to_numpy()
+
+
+def query_result(view, offset=0, limit=DEFAULT_PAGE_SIZE, sort=None, ascending=True, filters=None, search=None):
+    """
+    คืนข้อมูล 1 หน้าของผลลัพธ์
+    - filters: {คอลัมน์: ค่า} เทียบแบบข้อความตรงตัว
+    - search: ข้อความที่ต้องมีในแถว (ไม่สนตัวพิมพ์เล็ก/ใหญ่)
+    """
+    df = view.df
+    mask = np.ones(len(df), dtype=bool)
+    for column, value in (filters or {}).items():
+        if column not in df.columns:
+            raise KeyError(column)
+        mask &= (_as_text(df[column]).str.strip() == str(value).strip()).to_numpy()
+    if search:
+        mask &= view.search_text.str.contains(search.lower(), regex=False).to_numpy()
+    positions = np.flatnonzero(mask)
+
+    if sort:
+        if sort not in df.columns:
+            raise KeyError(sort)
+        positions = _sorted_positions(df, positions, sort, ascending)
+
+    offset = max(int(offset), 0)
+    limit = min(max(int(limit), 1), MAX_PAGE_SIZE)
+    page = df.iloc[positions[offset:offset + limit]]
+    return {
+        "columns": [str(c) for c in df.columns],
+        "total": len(df),
+        "filtered": len(positions),
+        "offset": offset,
+        "limit": limit,
+        "rows": page,
+    }
+
+
+def distinct_values(view, column, limit=MAX_DISTINCT_VALUES):
+    """ค่าที่ไม่ซ้ำของคอลัมน์ (ตามลำดับที่เจอ) สำหรับตัวเลือก filter"""
+    if column not in view.df.columns:
+        raise KeyError(column)
+    values = _as_text(view.df[column].dropna()).str.strip().unique()
+    return values[:limit].tolist()
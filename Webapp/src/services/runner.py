@@ -1,5 +1,88 @@
+import os
+import shutil
+import importlib
+
+import pandas as pd
+
+from services.exports import write_excel
+
+# ฟังก์ชันที่รับช่วงวันที่ (start_date, end_date) เพิ่มเติม
+DATE_RANGE_FUNCTIONS = ["DA_AUTO_UPH", "PNP_AUTO_UPH", "WB_AUTO_UPH"]
+# ฟังก์ชันที่มีสถานะสะสมและสั่งคำนวณใหม่ทั้งหมดได้ (full_refresh)
+FULL_REFRESH_FUNCTIONS = ["PNP_CHANGE_TYPE"]
+# ไฟล์ผลลัพธ์ที่ส่วนอื่นของเว็บใช้ต่อ (เช่น /api/last_type) คัดลอกจากโฟลเดอร์ของงานไปไว้ที่ temp หลังงานสำเร็จ
+PUBLISHED_OUTPUTS = {"PNP_CHANGE_TYPE": ["Last_Type.xlsx"]}
+
+
 class FunctionRunner:
     def run(self, function_name, *args, **kwargs):
         module = __import__(f"src.functions.{function_name}", fromlist=[function_name])
         function = getattr(module, function_name)
-        return function(*args, **kwargs)
\ No newline at end of file
+        return function(*args, **kwargs)
+
+
+def split_result(result):
+    """
+    แยกผลลัพธ์ของฟังก์ชันเป็น (ผลลัพธ์สำหรับหา path, DataFrame, artifacts)
+    ฟังก์ชันใน functions/ คืนได้ทั้ง path, list ของ path, DataFrame, (path, DataFrame)
+    หรือ (path, DataFrame, {ชื่อ: path ข้อมูล Parquet/pickle ที่ให้ดาวน์โหลดภายหลัง})
+    """
+    if isinstance(result, tuple) and len(result) in (2, 3) and isinstance(result[1], pd.DataFrame):
+        artifacts = result[2] if len(result) == 3 else None
+        return result[0], result[1], artifacts or {}
+    if isinstance(result, pd.DataFrame):
+        return result, result, {}
+    return result, None, {}
+
+
+def resolve_export_path(result, temp_root, operation, func_name):
+    """แปลงผลลัพธ์ของฟังก์ชันให้เป็น path ของไฟล์สำหรับแสดงผล/ดาวน์โหลด"""
+    result = split_result(result)[0]
+    export_file_path = None
+    if isinstance(result, pd.DataFrame):
+        export_file_path = os.path.join(temp_root, f"result_{operation}_{func_name}.xlsx")
+        write_excel(result, export_file_path)
+    elif isinstance(result, list):
+        # ถ้าเป็น list ของ path ให้ใช้ตัวแรกที่เป็นไฟล์จริง
+        for r in result:
+            if isinstance(r, str) and os.path.exists(r):
+                export_file_path = r
+                break
+    elif isinstance(result, str) and os.path.exists(result):
+        export_file_path = result
+    return export_file_path
+
+
+def execute_function_with_data(func_name, file_path, temp_root, start_date=None, end_date=None, operation=None, full_refresh=False):
+    """เหมือน execute_function แต่คืน (path ของไฟล์ผลลัพธ์, DataFrame ผลลัพธ์ หรือ None, artifacts)"""
+    func_module = importlib.import_module(f"functions.{func_name.lower()}")
+    func = getattr(func_module, func_name)
+    if func_name in DATE_RANGE_FUNCTIONS:
+        result = func(file_path, temp_root, start_date, end_date)
+    elif func_name in FULL_REFRESH_FUNCTIONS and full_refresh:
+        result = func(file_path, temp_root, full_refresh=True)
+    else:
+        result = func(file_path, temp_root)
+    result, result_df, artifacts = split_result(result)
+    return resolve_export_path(result, temp_root, operation, func_name), result_df, artifacts
+
+
+def publish_outputs(func_name, output_dir, shared_dir):
+    """คัดลอกไฟล์ใน PUBLISHED_OUTPUTS จาก output_dir ไปที่ shared_dir แบบ atomic (copy เป็นไฟล์ชั่วคราวแล้ว replace)"""
+    published = []
+    for name in PUBLISHED_OUTPUTS.get(func_name, []):
+        source = os.path.join(output_dir, name)
+        if not os.path.exists(source):
+            continue
+        os.makedirs(shared_dir, exist_ok=True)
+        target = os.path.join(shared_dir, name)
+        tmp_path = f"{target}.{os.getpid()}.tmp"
+        shutil.copyfile(source, tmp_path)
+        os.replace(tmp_path, target)
+        published.append(target)
+    return published
+
+
+def execute_function(func_name, file_path, temp_root, start_date=None, end_date=None, operation=None, full_refresh=False):
+    """import โมดูลใน functions/ เรียกฟังก์ชันหลัก และคืน path ของไฟล์ผลลัพธ์"""
+    return execute_function_with_data(func_name, file_path, temp_root, start_date, end_date, operation, full_refresh)[0]
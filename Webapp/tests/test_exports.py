@@ -0,0 +1,53 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from services import exports
+from services.exports import write_excel
+
+
+def _mixed_frame(n=50):
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame({
+        "int": np.arange(n),
+        "float": rng.normal(100, 10, n),
+        "text": [f"row {i}" for i in range(n)],
+        "object_mixed": pd.Series([i if i % 3 else f"s{i}" for i in range(n)], dtype=object),
+        "string": pd.Series([f"v{i}" for i in range(n)], dtype="string"),
+        "Int64": pd.Series(np.arange(n), dtype="Int64"),
+        "boolean": pd.Series([i % 2 == 0 for i in range(n)], dtype="boolean"),
+        "bool": [i % 2 == 0 for i in range(n)],
+        "datetime": pd.date_range("2024-01-01 08:30", periods=n, freq="7h"),
+        "date_only": pd.date_range("2024-01-01", periods=n, freq="D"),
+    })
+    missing = np.arange(n) % 5 == 1
+    df.loc[missing, "float"] = np.nan
+    df.loc[missing, "object_mixed"] = pd.NA
+    df.loc[np.arange(n) % 7 == 2, "object_mixed"] = None
+    df.loc[missing, "string"] = pd.NA
+    df.loc[missing, "Int64"] = pd.NA
+    df.loc[missing, "boolean"] = pd.NA
+    df.loc[missing, "datetime"] = pd.NaT
+    return df
+
+
+@pytest.mark.parametrize("chunk_rows", [exports.EXCEL_CHUNK_ROWS, 7])
+def test_write_excel_matches_to_excel(tmp_path, monkeypatch, chunk_rows):
+    monkeypatch.setattr(exports, "EXCEL_CHUNK_ROWS", chunk_rows)
+    df = _mixed_frame()
+    expected_path = tmp_path / "expected.xlsx"
+    actual_path = tmp_path / "actual.xlsx"
+    df.to_excel(expected_path, index=False)
+    write_excel(df, str(actual_path))
+
+    expected = pd.read_excel(expected_path)
+    actual = pd.read_excel(actual_path)
+    pd.testing.assert_frame_equal(actual, expected)
+    assert actual["object_mixed"].isna().sum() == df["object_mixed"].isna().sum()
+
+
+def test_write_excel_empty_frame(tmp_path):
+    df = _mixed_frame().iloc[:0]
+    path = tmp_path / "empty.xlsx"
+    write_excel(df, str(path))
+    assert list(pd.read_excel(path).columns) == list(df.columns)
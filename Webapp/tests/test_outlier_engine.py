@@ -0,0 +1,144 @@
+import numpy as np
+import pandas as pd
+import pytest
+from scipy.stats import zscore
+
+from services.outlier_engine import LABEL_FEW_POINTS, remove_outliers_grouped
+
+GROUP_COLS = ["bom_no", "machine_model"]
+
+# scipy เตือน precision loss กับกลุ่มที่ค่าเท่ากันทั้งหมด (ตั้งใจให้มีในข้อมูลทดสอบ)
+pytestmark = pytest.mark.filterwarnings("ignore:Precision loss occurred:RuntimeWarning")
+
+
+# ---- ลูปเดิมทีละกลุ่ม (ก่อนเปลี่ยนเป็น outlier_engine) ใช้เป็นค่าอ้างอิง ----
+
+def _iqr_bounds(values):
+    q1 = values.quantile(0.25)
+    q3 = values.quantile(0.75)
+    iqr = q3 - q1
+    return q1 - 1.5 * iqr, q3 + 1.5 * iqr
+
+
+def _chained_has_outlier(group):
+    lower, upper = _iqr_bounds(group["uph"])
+    return ((group["uph"] < lower) | (group["uph"] > upper)).sum() > 0
+
+
+def _chained_zscore(group):
+    std = group["uph"].std()
+    if std == 0:
+        return group
+    z = (group["uph"] - group["uph"].mean()) / std
+    return group[(z >= -3) & (z <= 3)]
+
+
+def _chained_iqr(group):
+    lower, upper = _iqr_bounds(group["uph"])
+    return group[(group["uph"] >= lower) & (group["uph"] <= upper)]
+
+
+def _chained_group(group, max_iter=20):
+    """remove_outliers_auto เดิมของ DA_AUTO_UPH / PNP_AUTO_UPH"""
+    group = group.assign(uph=pd.to_numeric(group["uph"], errors="coerce")).dropna(subset=["uph"])
+    if len(group) < 15:
+        return group, LABEL_FEW_POINTS
+    current = group
+    for i in range(max_iter):
+        z_df = _chained_zscore(current)
+        if not _chained_has_outlier(z_df):
+            return z_df, f"Z-Score Loop ×{i+1}"
+        iqr_df = _chained_iqr(z_df)
+        if not _chained_has_outlier(iqr_df):
+            return iqr_df, f"IQR Loop ×{i+1}"
+        current = iqr_df
+    return current, f"IQR-Z-Score Loop ×{max_iter}+"
+
+
+def _wire_bond_has_outliers(series):
+    if len(series) < 3:
+        return False
+    return (abs(zscore(series)) > 3).any()
+
+
+def _wire_bond_group(group, max_iter=20):
+    """ลูปเดิมใน WireBondingAnalyzer.remove_outliers (ป้ายกำกับตามรอบที่หยุด)"""
+    if len(group) < 15:
+        return group, LABEL_FEW_POINTS
+    current = group
+    for i in range(max_iter):
+        z = zscore(current["uph"])
+        z_filtered = current[(z >= -3) & (z <= 3)]
+        if not _wire_bond_has_outliers(z_filtered["uph"]):
+            return z_filtered, f"Z-Score Loop ×{i+1}"
+        lower, upper = _iqr_bounds(current["uph"])
+        iqr_filtered = current[(current["uph"] >= lower) & (current["uph"] <= upper)]
+        if not _wire_bond_has_outliers(iqr_filtered["uph"]):
+            return iqr_filtered, f"IQR Loop ×{i+1}"
+        current = iqr_filtered
+    return current, f"IQR-Z-Score Loop ×{max_iter}+"
+
+
+REFERENCE = {"chained": _chained_group, "wire_bond": _wire_bond_group}
+
+
+def _reference(df, variant):
+    kept, rows = [], []
+    for (bom_no, model), group in df.groupby(GROUP_COLS, sort=True):
+        cleaned, label = REFERENCE[variant](group)
+        kept.append(cleaned.index.to_numpy())
+        rows.append({"bom_no": bom_no, "machine_model": model, "Outlier_Method": label,
+                     "DataPoints_Before": len(group), "DataPoints_After": len(cleaned)})
+    return np.sort(np.concatenate(kept)), pd.DataFrame(rows)
+
+
+def _random_groups(seed, n=6000, n_groups=120):
+    """ข้อมูลหลายกลุ่มแบบสุ่ม มี outlier, กลุ่มค่าคงที่, กลุ่มเล็ก, ค่า NaN และค่าที่ไม่ใช่ตัวเลข"""
+    rng = np.random.default_rng(seed)
+    g = rng.integers(0, n_groups, n)
+    values = rng.normal(100, 10, n) * (1 + g % 7)
+    spikes = rng.random(n) < 0.03
+    values[spikes] *= rng.choice([0.1, 5.0, 20.0], spikes.sum())
+    values = np.round(values, rng.integers(0, 3))
+    values[g % 11 == 0] = 42.0
+    values[(g % 13 == 0) & (rng.random(n) < 0.05)] = np.nan
+    uph = pd.Series(values, dtype=object)
+    uph[(g % 19 == 0) & (rng.random(n) < 0.05)] = "n/a"
+    keep = (g % 17 != 0) | (rng.random(n) < 0.1)
+    df = pd.DataFrame({
+        "bom_no": [f"B{x % 23}" for x in g],
+        "machine_model": [f"M{x // 23}" for x in g],
+        "uph": uph,
+        "row": np.arange(n),
+    })[keep]
+    # index ไม่เรียงและไม่ต่อเนื่องเหมือนข้อมูลหลังกรองวันที่
+    return df.sample(frac=1, random_state=seed)
+
+
+@pytest.mark.parametrize("variant", ["chained", "wire_bond"])
+@pytest.mark.parametrize("seed", range(4))
+def test_grouped_matches_per_group_loop(variant, seed):
+    df = _random_groups(seed)
+    if variant == "wire_bond":
+        # WireBondingAnalyzer ได้ uph เป็นตัวเลขแล้ว (ค่าที่แปลงไม่ได้เป็น NaN)
+        df = df.assign(uph=pd.to_numeric(df["uph"], errors="coerce"))
+
+    expected_rows, expected_summary = _reference(df, variant)
+    keep, summary = remove_outliers_grouped(df, "uph", GROUP_COLS, variant=variant)
+
+    assert keep.index.equals(df.index)
+    np.testing.assert_array_equal(np.sort(df.index[keep.to_numpy()].to_numpy()), expected_rows)
+    pd.testing.assert_frame_equal(
+        summary[expected_summary.columns].reset_index(drop=True),
+        expected_summary,
+        check_dtype=False,
+    )
+    # ข้อมูลสุ่มต้องครอบคลุมทุกเส้นทางของลูป
+    methods = set(summary["Outlier_Method"])
+    assert LABEL_FEW_POINTS in methods
+    assert any(m.startswith("Z-Score") for m in methods)
+
+
+def test_unknown_variant():
+    with pytest.raises(ValueError):
+        remove_outliers_grouped(_random_groups(0), "uph", GROUP_COLS, variant="median")